@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Compare the cost of capturing created objects one INSERT at a time against buffered capture.
+
+Usage::
+
+    python benchmarks/capture.py [--objects 5000] [--repeat 3]
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import itertools
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'src')]
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test import override_settings  # noqa: E402
+
+import quade  # noqa: E402
+from quade import managers  # noqa: E402
+from quade.models import Record, Scenario  # noqa: E402
+
+User = get_user_model()
+_usernames = ('bench-{}'.format(n) for n in itertools.count())
+
+
+def users(count):
+    """Create `count` users, one save() at a time, the way a factory-based fixture would."""
+    for _ in range(count):
+        User.objects.create(username=next(_usernames))
+    return "{} users".format(count)
+
+
+def run(buffered, objects, repeat, admin):
+    qs = quade.Settings(allowed_envs=quade.AllEnvs, buffer_recorded_objects=buffered)
+    scenario = Scenario.objects.create(
+        slug='bench-{}'.format(Scenario.objects.count()),
+        config=[('users', {'count': objects})],
+        description='Benchmark',
+    )
+
+    def execute():
+        Record.objects.create(scenario=scenario, created_by=admin).execute_test()
+
+    with override_settings(QUADE=qs):
+        return min(timeit.repeat(execute, number=1, repeat=repeat))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--objects', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    call_command('migrate', verbosity=0)
+    managers.manager.register(users)
+    admin = User.objects.create(username='bench-admin', is_superuser=True)
+
+    unbuffered = run(False, args.objects, args.repeat, admin)
+    buffered = run(True, args.objects, args.repeat, admin)
+    print("Capturing {} objects (best of {}):".format(args.objects, args.repeat))
+    print("  one INSERT per object: {:.3f}s".format(unbuffered))
+    print("  buffered bulk_create:  {:.3f}s".format(buffered))
+    print("  speedup:               {:.2f}x".format(unbuffered / buffered))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Run the benchmarks in benchmarks/suite.py, optionally saving the results or comparing them against
+saved results.
+
+Usage::
+
+    python benchmarks/run.py [--filter PATTERN] [--quick]
+    python benchmarks/run.py --save benchmarks/baseline.json
+    python benchmarks/run.py --compare benchmarks/baseline.json [--threshold 1.2]
+
+When comparing, benchmarks whose best time is more than `threshold` times the saved best time are
+reported as regressions, and the exit status is 1.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+from collections import OrderedDict
+import inspect
+import io
+import json
+import os
+import platform
+import re
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'src'), os.path.dirname(os.path.abspath(__file__))]
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import transaction  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+import suite  # noqa: E402
+
+
+class Rollback(Exception):
+    pass
+
+
+def benchmarks(pattern=None):
+    """Yield ``(name, cls, method_name, param)`` for each benchmark in the suite."""
+    classes = [
+        cls for _, cls in inspect.getmembers(suite, inspect.isclass)
+        if cls.__module__ == suite.__name__ and hasattr(cls, 'params')
+    ]
+    for cls in sorted(classes, key=lambda cls: inspect.getsourcelines(cls)[1]):
+        for method_name in sorted(name for name in vars(cls) if name.startswith('time_')):
+            for param in cls.params:
+                name = '{}.{}({})'.format(cls.__name__, method_name, param)
+                if pattern is None or re.search(pattern, name):
+                    yield name, cls, method_name, param
+
+
+def run_benchmark(cls, method_name, param, quick=False):
+    """Time one benchmark; return its best and median times, in seconds per unit of work."""
+    repeat = cls.repeat.get(param, 5) if isinstance(cls.repeat, dict) else cls.repeat
+    repeat = 1 if quick else repeat
+    per = getattr(cls, 'per', 1)
+    instance = cls()
+    times = []
+    try:
+        with transaction.atomic():
+            instance.setup(param)
+            method = getattr(instance, method_name)
+            times = timeit.repeat(lambda: method(param), number=1, repeat=repeat)
+            raise Rollback
+    except Rollback:
+        pass
+    times = sorted(time / per for time in times)
+    return {'best': times[0], 'median': times[len(times) // 2], 'repeat': repeat}
+
+
+def format_time(seconds):
+    for unit, scale in [('s', 1), ('ms', 1e3), ('us', 1e6)]:
+        if seconds * scale >= 1:
+            return '{:.3f}{}'.format(seconds * scale, unit)
+    return '{:.3f}ns'.format(seconds * 1e9)
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'machine': platform.platform(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison of `results` against `baseline`; return the names of regressions."""
+    regressions = []
+    print("\n{:<45} {:>12} {:>12} {:>8}".format('benchmark', 'baseline', 'current', 'ratio'))
+    for name, result in results.items():
+        saved = baseline['results'].get(name)
+        if saved is None:
+            print("{:<45} {:>12} {:>12} {:>8}".format(
+                name, '-', format_time(result['best']), 'new'
+            ))
+            continue
+        ratio = result['best'] / saved['best']
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 / threshold:
+            flag = '  improved'
+        print("{:<45} {:>12} {:>12} {:>7.2f}x{}".format(
+            name, format_time(saved['best']), format_time(result['best']), ratio, flag
+        ))
+    if baseline.get('environment') != environment():
+        print("\nNote: the baseline was recorded in a different environment: {}".format(
+            baseline.get('environment')
+        ))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--filter', help="Only run benchmarks whose name matches this regex.")
+    parser.add_argument('--quick', action='store_true', help="Time each benchmark only once.")
+    parser.add_argument('--save', metavar='FILE', help="Save the results to FILE.")
+    parser.add_argument('--compare', metavar='FILE', help="Compare the results to FILE.")
+    parser.add_argument(
+        '--threshold', type=float, default=1.2,
+        help="The slowdown ratio above which a benchmark counts as a regression (default 1.2)."
+    )
+    args = parser.parse_args(argv)
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+    results = OrderedDict()
+    for name, cls, method_name, param in benchmarks(args.filter):
+        results[name] = result = run_benchmark(cls, method_name, param, quick=args.quick)
+        print("{:<45} best {:>12}  median {:>12}".format(
+            name, format_time(result['best']), format_time(result['median'])
+        ))
+
+    if args.save:
+        with io.open(args.save, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(
+                {'environment': environment(), 'results': results}, indent=2, sort_keys=True
+            ) + '\n')
+    if args.compare:
+        with io.open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
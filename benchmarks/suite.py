@@ -0,0 +1,100 @@
+"""
+Benchmarks for :mod:`run`, written in the style of asv: each class's ``time_*`` methods are timed
+once for every value in its ``params``, after calling ``setup`` with the same value. Times are
+divided by ``per`` (if set) so that results are per unit of work.
+
+Each class runs inside a transaction that is rolled back afterwards, so benchmarks don't see each
+other's rows.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import itertools
+
+from django.contrib.auth import get_user_model
+from django.test import Client, override_settings
+try:
+    from django.urls import reverse
+except ImportError:
+    from django.core.urlresolvers import reverse
+
+import quade
+from quade import managers
+from quade.models import Record, Scenario
+from quade.receivers import capture_qa_objects
+
+User = get_user_model()
+_names = ('bench-{}'.format(n) for n in itertools.count())
+
+
+def users(count):
+    """A synthetic fixture: create `count` users, one save() at a time."""
+    for _ in range(count):
+        User.objects.create(username=next(_names))
+    return "{} users".format(count)
+
+
+def admin_user():
+    return User.objects.create(username=next(_names), is_superuser=True, is_staff=True)
+
+
+class ExecuteScenario(object):
+    """Execute a Record whose scenario creates `objects` objects."""
+
+    params = [10, 100, 10000]
+    repeat = {10: 20, 100: 10, 10000: 3}
+
+    def setup(self, objects):
+        managers.manager.register(users)
+        self.admin = admin_user()
+        self.scenario = Scenario.objects.create(
+            slug='execute-{}'.format(objects), config=[('users', {'count': objects})],
+        )
+
+    def time_execute(self, objects):
+        Record.objects.create(scenario=self.scenario, created_by=self.admin).execute_test()
+
+
+class CaptureOverhead(object):
+    """The cost of a single save(), with no capture active and with each kind of capture."""
+
+    params = ['none', 'writer', 'buffer']
+    repeat = 5
+    per = 1000
+
+    def setup(self, capture):
+        self.record = Record.objects.create(
+            scenario=Scenario.objects.create(slug='capture-{}'.format(capture), config=[]),
+            created_by=admin_user(),
+        )
+        self.settings = quade.Settings(
+            allowed_envs=quade.AllEnvs, buffer_recorded_objects=capture == 'buffer'
+        )
+
+    def time_save(self, capture):
+        if capture == 'none':
+            users(self.per)
+            return
+        with override_settings(QUADE=self.settings), capture_qa_objects(self.record):
+            users(self.per)
+
+
+class RenderMainView(object):
+    """Render the main page with `records` Records in the database."""
+
+    params = [100000]
+    repeat = 10
+
+    def setup(self, records):
+        admin = admin_user()
+        scenario = Scenario.objects.create(slug='render', config=[])
+        Record.objects.bulk_create(
+            (Record(scenario=scenario, created_by=admin) for _ in range(records)),
+            batch_size=500,
+        )
+        self.client = Client()
+        self.client.force_login(admin)
+        self.url = reverse('quade-main')
+
+    def time_render(self, records):
+        response = self.client.get(self.url)
+        assert response.status_code == 200, response.status_code
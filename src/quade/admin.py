@@ -0,0 +1,47 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.http import HttpResponse
+
+from .models import Scenario
+from .profiling import profile_scenario
+
+
+class ScenarioAdmin(admin.ModelAdmin):
+    list_display = ['slug', 'description', 'status', 'pool_size', 'use_snapshot']
+    list_filter = ['status']
+    search_fields = ['slug', 'description']
+    actions = ['profile_scenarios']
+
+    def get_actions(self, request):
+        # Deleting a Scenario only deactivates it, which the bulk delete action would bypass.
+        actions = super(ScenarioAdmin, self).get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def profile_scenarios(self, request, queryset):
+        """Profile the selected Scenarios in a rolled-back dry run, and show the reports."""
+        if not settings.QUADE.allowed:
+            self.message_user(request, "Quade is disabled on this environment.", messages.ERROR)
+            return None
+        reports = []
+        for scenario in queryset.order_by('slug'):
+            try:
+                reports.append('\n'.join(profile_scenario(scenario).report()))
+            except Exception as exc:
+                reports.append("Scenario '{}' failed: {!r}".format(scenario.slug, exc))
+        return HttpResponse('\n\n\n'.join(reports), content_type='text/plain; charset=utf-8')
+    profile_scenarios.short_description = "Profile selected scenarios (dry run)"
+
+
+def register(site):
+    """
+    Register :class:`ScenarioAdmin` with `site`, unless the ``register_admin`` setting is disabled
+    or a ModelAdmin is already registered there for Scenario.
+    """
+    if settings.QUADE.register_admin and Scenario not in site._registry:
+        site.register(Scenario, ScenarioAdmin)
+
+
+register(admin.site)
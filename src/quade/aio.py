@@ -0,0 +1,157 @@
+"""
+Executing scenarios with asyncio, so that fixtures that wait on I/O (such as requests to stub
+services) can overlap. Requires Python 3.5 or later.
+
+``async def`` fixtures are awaited on the event loop, and must not use the ORM directly: they
+should await the functions that do, wrapped with :func:`sync_to_async`. Other fixtures are called
+on a pool of threads, as with ``step_threads``. Records whose scenarios use async fixtures are
+executed with :func:`execute_async`, unless ``atomic_execution`` is enabled; either way, what
+those threads do isn't part of the Record's transaction. Async code, such as an async view, can
+await :func:`execute_record` rather than calling ``Record.execute_test``.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import asyncio
+from builtins import str as text
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from . import metrics
+from .managers import AsyncStepError, Plan, StepRun, event_loop_running, is_async, manager
+from .receivers import activate_capture, active_capture, capture_qa_objects, capture_step
+from .telemetry import nested
+
+
+def run_coroutine(coroutine):
+    """
+    Run `coroutine` to completion on a new event loop, and return its result.
+
+    :raises: AsyncStepError if this thread is already running an event loop, in which case
+        `coroutine` should be awaited instead.
+    """
+    if event_loop_running():
+        coroutine.close()
+        raise AsyncStepError(
+            "Can't run {!r} while this thread is running an event loop; await it instead.".format(
+                coroutine
+            )
+        )
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def _call_sync(func, capture, args, kwargs):
+    try:
+        with activate_capture(capture):
+            return func(*args, **kwargs)
+    finally:
+        connections.close_all()
+
+
+def sync_to_async(func, executor=None):
+    """
+    Wrap the synchronous `func`, such as a function that uses the ORM, in a coroutine function
+    that calls it on a thread of `executor` (by default, the event loop's), so that async fixtures
+    can await it without blocking the event loop. Objects it creates are captured for the Record
+    that is executing, and the thread's database connections are closed once it returns.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            executor, _call_sync, func, active_capture(), args, kwargs
+        )
+    return wrapper
+
+
+async def _call_async(plan, step, monitors):
+    run = StepRun(step)
+    with capture_step(), nested([monitor(run) for monitor in monitors]):
+        run.output = await plan.funcs[step.func_name](**step.kwargs)
+    return run.output
+
+
+async def execute_async(config, monitors=(), threads=None):
+    """
+    Execute each step of `config` (or of a compiled :class:`.Plan`) like
+    :meth:`.FixtureManager.execute`, and return their outputs joined by newlines.
+
+    Each step starts as soon as the steps it depends on have finished. Steps that call ``async
+    def`` functions are awaited on the event loop, so independent steps overlap whenever they wait
+    on I/O; other steps are called on a pool of `threads` (which defaults to ``step_threads``)
+    threads, each with its own database connection. Monitors are entered around async steps in
+    the event loop's thread, so the queries they count include those of other async steps that
+    overlap, made in that thread.
+
+    If a step raises, steps that are waiting on others or on I/O are cancelled, and the exception
+    is re-raised once the steps running on threads have finished.
+    """
+    plan = config if isinstance(config, Plan) else manager.compile(config)
+    monitors = manager.monitors_for(plan, monitors)
+    if threads is None:
+        threads = settings.QUADE.step_threads
+    capture = active_capture()
+    loop = asyncio.get_event_loop()
+    executor = ThreadPoolExecutor(max_workers=threads)
+    futures, on_threads = {}, []
+
+    async def run(step):
+        await asyncio.gather(*[futures[index] for index in step.depends_on])
+        if is_async(plan.funcs[step.func_name]):
+            with activate_capture(capture):
+                return await _call_async(plan, step, monitors)
+        future = loop.run_in_executor(
+            executor, _call_sync, manager._call, capture, (plan, step, monitors), {}
+        )
+        on_threads.append(future)
+        # A thread can't be cancelled, so neither should the future that waits for it.
+        return await asyncio.shield(future)
+
+    try:
+        for step in plan.steps:
+            futures[step.index] = asyncio.ensure_future(run(step))
+        steps = [futures[step.index] for step in plan.steps]
+        try:
+            outputs = await asyncio.gather(*steps)
+        except Exception:
+            for future in steps:
+                future.cancel()
+            await asyncio.gather(*steps + on_threads, return_exceptions=True)
+            raise
+    finally:
+        executor.shutdown(wait=False)
+    return '\n'.join(text(output) for output in outputs)
+
+
+async def execute_record(record):
+    """
+    Execute `record` like ``Record.execute_test``, awaiting :func:`execute_async` on the running
+    event loop rather than starting one of its own, so that async views can execute Records
+    without tying up a thread for the whole scenario. The queries that keep track of the Record
+    (and restore its snapshot, if any) are still made in the event loop's thread.
+
+    With ``atomic_execution``, the steps are executed as by ``execute_test``, blocking the loop.
+    """
+    started = timezone.now()
+    try:
+        plan = record._begin()
+        if plan is not None:
+            if settings.QUADE.atomic_execution:
+                record._execute_plan(plan)
+            else:
+                with capture_qa_objects(record) as capture:
+                    instructions = await execute_async(plan, record._monitors())
+                record._executed(instructions, capture.count)
+        record._ready()
+    except Exception as ex:
+        record._fail(exception=ex)
+        raise
+    finally:
+        metrics.observe_execution(record, started)
@@ -0,0 +1,126 @@
+"""
+JSON endpoints for creating Records and polling their status, e.g. from a CI pipeline.
+
+Both endpoints use the same access checks as the HTML views, and the create endpoint is protected
+against CSRF like any other POST: clients authenticate with a session and send the CSRF token in
+the ``X-CSRFToken`` header.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils import six
+from django.views.generic import View
+
+from .models import Record, Scenario
+from .views import QuadeAccessMixin
+
+logger = logging.getLogger(__name__)
+
+STATUS_NAMES = dict(Record._meta.get_field('status').choices)
+
+
+class ApiError(Exception):
+    pass
+
+
+def record_status(values):
+    """Serialize the ``values()`` of a Record."""
+    values = dict(values, status=STATUS_NAMES[values['status']])
+    values['scenario'] = values.pop('scenario__slug')
+    return values
+
+
+class CreateRecordsView(QuadeAccessMixin, View):
+    """
+    Create Records for a batch of Scenarios, then execute them.
+
+    The request body is a JSON list of ``{"slug": ..., "count": ...}`` objects (``count`` defaults
+    to 1). Every Record is created in one transaction, so either all of them are created or none
+    are. They are then executed on Celery workers if ``use_celery`` is enabled, or else one after
+    another before responding.
+    """
+    max_records = 500
+
+    def post(self, request):
+        if not settings.QUADE.allowed:
+            return JsonResponse({'error': "Quade is disabled on this environment."}, status=403)
+        try:
+            counts = self.parse(request.body)
+            scenarios = {
+                scenario.slug: scenario for scenario in
+                Scenario.objects.active().filter(slug__in=[slug for slug, _ in counts])
+            }
+            missing = sorted(set(slug for slug, _ in counts) - set(scenarios))
+            if missing:
+                raise ApiError("No active scenario(s) with slug: {}".format(', '.join(missing)))
+        except ApiError as exc:
+            return JsonResponse({'error': six.text_type(exc)}, status=400)
+
+        with transaction.atomic():
+            records = [
+                Record.objects.create(scenario=scenarios[slug], created_by=request.user)
+                for slug, count in counts
+                for _ in range(count)
+            ]
+        for record in records:
+            try:
+                record.dispatch()
+            except Exception:
+                # The Record has been marked as failed; carry on with the others.
+                logger.exception("Record #%s failed", record.pk)
+
+        ids = [record.pk for record in records]
+        return JsonResponse({'records': RecordStatusView.statuses(ids)}, status=201)
+
+    def parse(self, body):
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except ValueError:
+            raise ApiError("The request body must be JSON.")
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            raise ApiError("Expected a list of {\"slug\": ..., \"count\": ...} objects.")
+        counts = []
+        for item in data:
+            slug, count = item.get('slug'), item.get('count', 1)
+            if not isinstance(slug, six.string_types):
+                raise ApiError("Every item needs a slug.")
+            if not isinstance(count, six.integer_types) or isinstance(count, bool) or count < 1:
+                raise ApiError("Invalid count for {}: {!r}".format(slug, count))
+            counts.append((slug, count))
+        if sum(count for _, count in counts) > self.max_records:
+            raise ApiError("At most {} records can be created at once.".format(self.max_records))
+        return counts
+
+
+class RecordStatusView(QuadeAccessMixin, View):
+    """
+    Return the status of many Records at once, with a single query. Records are given as a
+    comma-separated ``ids`` query parameter; IDs of Records that don't exist are left out.
+    """
+    max_records = 1000
+    fields = ['id', 'scenario__slug', 'status', 'instructions', 'completed_steps', 'total_steps']
+
+    def get(self, request):
+        try:
+            ids = [int(value) for value in request.GET.get('ids', '').split(',') if value]
+        except ValueError:
+            return JsonResponse({'error': "ids must be a comma-separated list of integers."},
+                                status=400)
+        if len(ids) > self.max_records:
+            return JsonResponse(
+                {'error': "At most {} records can be requested at once.".format(self.max_records)},
+                status=400,
+            )
+        return JsonResponse({'records': self.statuses(ids)})
+
+    @classmethod
+    def statuses(cls, ids):
+        if not ids:
+            return []
+        values = Record.objects.filter(pk__in=ids).order_by('pk').values(*cls.fields)
+        return [record_status(record) for record in values]
@@ -1,14 +1,33 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 from django.apps import AppConfig
-from django.conf import settings
-
-from .managers import manager
+from django.db.models.signals import post_delete, post_save
 
 
 class QuadeConfig(AppConfig):
     name = 'quade'
 
     def ready(self):
-        if settings.QUADE.allowed:
-            manager.setup()
+        from .receivers import associate_instance_with_qa_record
+        post_save.connect(
+            associate_instance_with_qa_record,
+            dispatch_uid='quade.receivers.associate_instance_with_qa_record',
+        )
+        self.connect_cache_invalidation()
+        # The fixtures are imported when they're first needed; see FixtureManager.load().
+
+    def connect_cache_invalidation(self):
+        from .caching import invalidate_records, invalidate_scenarios
+        receivers = [
+            (post_save, 'Scenario', invalidate_scenarios),
+            (post_delete, 'Scenario', invalidate_scenarios),
+            (post_save, 'Record', invalidate_records),
+            (post_delete, 'Record', invalidate_records),
+            (post_save, 'RecordStep', invalidate_records),
+        ]
+        for signal, model_name, receiver in receivers:
+            signal.connect(
+                receiver,
+                sender=self.get_model(model_name),
+                dispatch_uid='quade.caching.{}.{}'.format(receiver.__name__, model_name),
+            )
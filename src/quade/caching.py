@@ -0,0 +1,68 @@
+"""
+Caching for the main page, with Django's cache framework: the active Scenario choices, and the
+rendered table of recent Records. Nothing is cached unless the ``cache_alias`` setting names a
+cache.
+
+Cached values are grouped into generations: saving or deleting a Scenario starts a new generation
+of both groups, and saving or deleting a Record (or saving a RecordStep) starts a new generation of
+the recent Records. Updates made with ``QuerySet.update()``, such as the step counter of a Record
+that is executing, don't send signals; those are only picked up when the cached value expires.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+
+SCENARIOS = 'scenarios'
+RECORDS = 'records'
+
+
+def get_cache():
+    """Return the cache configured by ``cache_alias``, or None if caching is disabled."""
+    alias = settings.QUADE.cache_alias
+    return caches[alias] if alias is not None else None
+
+
+def _generation_key(group):
+    return 'quade:{}:generation'.format(group)
+
+
+def _generation(cache, group):
+    generation = cache.get(_generation_key(group))
+    if generation is None:
+        cache.add(_generation_key(group), uuid4().hex, None)
+        generation = cache.get(_generation_key(group))
+    return generation
+
+
+def invalidate(*groups):
+    """Start a new generation of each of `groups`, so that none of their cached values are used."""
+    cache = get_cache()
+    if cache is not None:
+        cache.set_many({_generation_key(group): uuid4().hex for group in groups}, None)
+
+
+def cached(group, name, compute):
+    """
+    Return the value cached as `name` in the current generation of `group`, computing and caching
+    it with `compute()` if there is none.
+    """
+    cache = get_cache()
+    if cache is None:
+        return compute()
+    key = 'quade:{}:{}:{}'.format(group, _generation(cache, group), name)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value)
+    return value
+
+
+def invalidate_scenarios(sender, **kwargs):
+    invalidate(SCENARIOS, RECORDS)
+
+
+def invalidate_records(sender, **kwargs):
+    invalidate(RECORDS)
@@ -0,0 +1,380 @@
+"""
+Tools for copying the rows that a Record created: serializing them to JSON-compatible dicts, and
+inserting new copies of them with bulk_create, remapping primary keys and foreign keys among the
+copies and rewriting unique fields so that the copies don't collide with the originals.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import defaultdict, OrderedDict
+import re
+import uuid
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, models as m, router
+from django.utils import six
+
+
+__all__ = [
+    'CopyError',
+    'RowCopier',
+    'dependency_order',
+    'load_pk',
+    'recorded_models',
+    'rewrite_unique_value',
+    'serialize_rows',
+    'unique_transform',
+]
+
+JSON_NATIVE_TYPES = six.string_types + six.integer_types + (bool, float)
+
+
+class CopyError(Exception):
+    """
+    The rows of a Record can't be copied, e.g. because they belong to a model that isn't supported.
+    """
+
+
+def model_label(model):
+    opts = model._meta
+    return '{}.{}'.format(opts.app_label, opts.model_name)
+
+
+def remote_field(field):
+    """Return the relation of `field` (``field.rel`` before Django 1.9)."""
+    return getattr(field, 'remote_field', None) or field.rel
+
+
+def target_field(field):
+    """Return the field that the foreign key `field` refers to."""
+    return field.foreign_related_fields[0]
+
+
+def load_pk(model, value):
+    """
+    Convert `value` (e.g. a RecordedObject's object_id, or a serialized primary key) to the
+    Python type of `model`'s primary key.
+    """
+    pk_field = model._meta.pk
+    # The primary key might itself be a relation (e.g. a OneToOneField primary key).
+    return target_field(pk_field).to_python(value) if pk_field.is_relation else \
+        pk_field.to_python(value)
+
+
+def recorded_models(record):
+    """
+    Return an OrderedDict mapping each model that `record` created objects of to the primary keys
+    of those objects, in dependency order.
+    """
+    pks_by_content_type = defaultdict(list)
+    values = record.recorded_objects.order_by('pk').values_list('content_type_id', 'object_id')
+    for content_type_id, object_id in values:
+        pks_by_content_type[content_type_id].append(object_id)
+    pks_by_model = {}
+    for content_type_id, pks in pks_by_content_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:  # The model has been removed since the Record was executed.
+            continue
+        pks_by_model[model] = [load_pk(model, pk) for pk in pks]
+    return OrderedDict((model, pks_by_model[model]) for model in dependency_order(pks_by_model))
+
+
+def dependency_order(models):
+    """
+    Sort `models` so that every model comes after the models it has foreign keys to. Cycles are
+    broken deterministically; the copier defers the foreign keys that close them.
+    """
+    models = sorted(set(models), key=model_label)
+    dependencies = {
+        model: set(
+            remote_field(field).model._meta.concrete_model
+            for field in model._meta.concrete_fields
+            if field.is_relation
+        ) & set(models) - {model}
+        for model in models
+    }
+    ordered = []
+    while dependencies:
+        ready = [model for model in models if model in dependencies and not dependencies[model]]
+        if not ready:
+            # Every remaining model is part of a cycle; take the first one.
+            ready = [next(model for model in models if model in dependencies)]
+        for model in ready:
+            ordered.append(model)
+            del dependencies[model]
+        for remaining in dependencies.values():
+            remaining.difference_update(ready)
+    return ordered
+
+
+def _check_supported(model):
+    if model._meta.parents:
+        raise CopyError("{} uses multi-table inheritance, which can't be copied.".format(
+            model_label(model)
+        ))
+
+
+def _serialize_value(field, obj):
+    value = field.value_from_object(obj)
+    if value is None or isinstance(value, JSON_NATIVE_TYPES):
+        return value
+    return field.value_to_string(obj)
+
+
+def serialize_rows(model, pks, chunk_size=500):
+    """
+    Yield a JSON-compatible dict for each of the objects of `model` with the given primary keys,
+    fetching at most `chunk_size` objects at a time.
+    """
+    _check_supported(model)
+    opts = model._meta
+    m2m_fields = [
+        field for field in opts.local_many_to_many if remote_field(field).through._meta.auto_created
+    ]
+    pks = list(pks)
+    for start in range(0, len(pks), chunk_size):
+        queryset = model._base_manager.filter(pk__in=pks[start:start + chunk_size]).order_by('pk')
+        if m2m_fields:
+            queryset = queryset.prefetch_related(*[field.name for field in m2m_fields])
+        for obj in queryset:
+            yield {
+                'model': model_label(model),
+                'pk': _serialize_value(opts.pk, obj),
+                'fields': {
+                    field.attname: _serialize_value(field, obj)
+                    for field in opts.concrete_fields if not field.primary_key
+                },
+                'm2m': {
+                    field.name: [
+                        _serialize_value(related._meta.pk, related)
+                        for related in getattr(obj, field.name).all()
+                    ]
+                    for field in m2m_fields
+                },
+            }
+
+
+def rewrite_unique_value(field, value, token):
+    """
+    The default transform for unique fields: make `value` distinct by working `token` into it.
+    Values of types it doesn't know how to rewrite are returned unchanged.
+    """
+    if value is None:
+        return value
+    if isinstance(field, m.UUIDField):
+        return uuid.uuid4()
+    if isinstance(value, six.string_types):
+        if isinstance(field, m.EmailField) and '@' in value:
+            local, domain = value.rsplit('@', 1)
+            return '{}+{}@{}'.format(local, token, domain)
+        max_length = field.max_length or len(value) + len(token) + 1
+        return '{}-{}'.format(value[:max(max_length - len(token) - 1, 0)], token)[-max_length:]
+    return value
+
+
+def unique_transform(transforms):
+    """
+    Return a transform for :class:`RowCopier` that rewrites each unique field with the transform
+    that `transforms` maps its ``'app_label.model_name.field_name'`` to, if any, or else with
+    :func:`rewrite_unique_value`.
+    """
+    if not transforms:
+        return rewrite_unique_value
+
+    def transform(field, value, token):
+        key = '{}.{}'.format(model_label(field.model), field.name)
+        return transforms.get(key, rewrite_unique_value)(field, value, token)
+    return transform
+
+
+def _supports_returning_bulk_pks(connection):
+    return getattr(
+        connection.features, 'can_return_rows_from_bulk_insert',
+        getattr(connection.features, 'can_return_ids_from_bulk_insert', False)
+    )
+
+
+class RowCopier(object):
+    """
+    Inserts copies of serialized rows, one model at a time, in dependency order.
+
+    Primary keys of the copies are tracked so that foreign keys (and many-to-many relations)
+    between copied rows point at the new copies; references to rows that weren't copied are left
+    alone. Nullable foreign keys that point "forward" (to a row that hasn't been copied yet, e.g.
+    in a cycle or a self-referential model) are inserted as NULL and filled in by :meth:`finish`.
+    The rows of a model may be passed to :meth:`copy` in several chunks, as long as all of them
+    are copied before moving on to the next model.
+
+    Many-to-many relations are inserted along with each chunk, unless they refer to rows that
+    haven't been copied yet. What's kept in memory until the copier is discarded is the map of old
+    to new primary keys (an entry per copied row), the forward references and many-to-many
+    relations that :meth:`finish` fills in, and the replacements that :meth:`rewrite_text` makes
+    (only those of values that occur in `text`, if it's given).
+
+    :param models: every model that will be copied.
+    :param transform: a callable ``(field, value, token)`` used to rewrite the values of unique
+        fields; defaults to :func:`rewrite_unique_value`.
+    :param batch_size: passed to ``bulk_create``.
+    :param text: the text that will be passed to :meth:`rewrite_text`, if known.
+    """
+
+    def __init__(self, models, transform=rewrite_unique_value, batch_size=500, text=None):
+        self.models = set(models)
+        self.transform = transform
+        self.batch_size = batch_size
+        self.text = text
+        self.pk_map = defaultdict(dict)
+        self.replacements = {}
+        self._current = None
+        self._completed = set()
+        self._deferred_fks = []
+        self._deferred_m2m = []
+
+    def copy(self, model, rows):
+        """
+        Insert copies of `rows` (as produced by :func:`serialize_rows`) of `model`, and return the
+        new objects.
+        """
+        _check_supported(model)
+        if self._current is not model:
+            if self._current is not None:
+                self._completed.add(self._current)
+            self._current = model
+        opts = model._meta
+        rows = list(rows)
+        batch_pks = set(load_pk(model, row['pk']) for row in rows)
+        objs, old_pks, deferred = [], [], []
+        for row in rows:
+            obj = model()
+            for field in opts.concrete_fields:
+                if field.primary_key or field.attname not in row['fields']:
+                    continue
+                value = field.to_python(row['fields'][field.attname])
+                if field.is_relation:
+                    value = self._remap(obj, field, value, model, batch_pks, deferred)
+                elif field.unique:
+                    value = self._rewrite(field, value)
+                setattr(obj, field.attname, value)
+            old_pk = load_pk(model, row['pk'])
+            obj.pk = self._new_pk(opts.pk, old_pk)
+            objs.append(obj)
+            old_pks.append(old_pk)
+
+        self._insert(model, objs)
+        new_pks = self.pk_map[model]
+        for old_pk, obj in zip(old_pks, objs):
+            new_pks[old_pk] = obj.pk
+        for obj, field, old_value in deferred:
+            self._deferred_fks.append((model, obj.pk, field, old_value))
+        through_rows = defaultdict(list)
+        for old_pk, row in zip(old_pks, rows):
+            for name, related_pks in row.get('m2m', {}).items():
+                if related_pks:
+                    self._relate(model, new_pks[old_pk], name, related_pks, through_rows)
+        self._insert_through_rows(through_rows)
+        return objs
+
+    def finish(self):
+        """
+        Fill in deferred foreign keys and create the many-to-many relations that were deferred.
+        Call this once every model has been copied.
+        """
+        self._completed.update(self.models)
+        for model, pk, field, old_value in self._deferred_fks:
+            target = remote_field(field).model._meta.concrete_model
+            value = self.pk_map[target].get(old_value, old_value)
+            model._base_manager.filter(pk=pk).update(**{field.attname: value})
+        self._deferred_fks = []
+
+        deferred_m2m, self._deferred_m2m = self._deferred_m2m, []
+        through_rows = defaultdict(list)
+        for model, pk, name, related_pks in deferred_m2m:
+            self._relate(model, pk, name, related_pks, through_rows)
+        self._insert_through_rows(through_rows)
+
+    def rewrite_text(self, text):
+        """Replace the original values of rewritten unique fields in `text` with the new values."""
+        if not text or not self.replacements:
+            return text
+        # One pass over `text`, so that new values are never rewritten again, trying longer values
+        # first, so that e.g. 'user10' isn't rewritten as 'user1' followed by '0'.
+        pattern = re.compile('|'.join(
+            re.escape(old) for old in sorted(self.replacements, key=len, reverse=True)
+        ))
+        return pattern.sub(lambda match: self.replacements[match.group(0)], text)
+
+    def _relate(self, model, pk, name, related_pks, through_rows):
+        """
+        Add the rows relating the copy `pk` of `model` to `related_pks` through its many-to-many
+        field `name` to `through_rows`, or defer them to :meth:`finish` if some of the related rows
+        are still to be copied.
+        """
+        field = model._meta.get_field(name)
+        through = remote_field(field).through
+        target = remote_field(field).model._meta.concrete_model
+        new_pks = self.pk_map[target]
+        related_pks = [load_pk(target, related_pk) for related_pk in related_pks]
+        if target in self.models and target not in self._completed and not all(
+            related_pk in new_pks for related_pk in related_pks
+        ):
+            self._deferred_m2m.append((model, pk, name, related_pks))
+            return
+        source_attname = field.m2m_column_name()
+        target_attname = field.m2m_reverse_name()
+        for related_pk in related_pks:
+            through_rows[through].append(through(**{
+                source_attname: pk,
+                target_attname: new_pks.get(related_pk, related_pk),
+            }))
+
+    def _insert_through_rows(self, through_rows):
+        for through, objs in through_rows.items():
+            through._base_manager.bulk_create(objs, batch_size=self.batch_size)
+
+    def _remap(self, obj, field, value, model, batch_pks, deferred):
+        if value is None:
+            return value
+        target = remote_field(field).model._meta.concrete_model
+        if not target_field(field).primary_key:
+            return value  # Only references by primary key are remapped.
+        if value in self.pk_map[target]:
+            return self.pk_map[target][value]
+        if target not in self.models or target in self._completed:
+            return value  # A reference to an object that isn't being copied.
+        if field.null:
+            deferred.append((obj, field, value))
+            return None
+        if target is model and value not in batch_pks:
+            return value
+        raise CopyError(
+            "Can't copy {}.{}: it refers to an object that hasn't been copied yet and isn't "
+            "nullable.".format(model_label(model), field.name)
+        )
+
+    def _rewrite(self, field, value):
+        new_value = self.transform(field, value, uuid.uuid4().hex[:8])
+        if isinstance(value, six.string_types) and value and new_value != value:
+            # Only rewrite_text needs the replacements, so don't keep those it won't use.
+            if self.text is None or value in self.text:
+                self.replacements[value] = six.text_type(new_value)
+        return new_value
+
+    def _new_pk(self, pk_field, old_pk):
+        if isinstance(pk_field, m.AutoField) or pk_field.is_relation:
+            if pk_field.is_relation:
+                target = remote_field(pk_field).model._meta.concrete_model
+                return self.pk_map[target].get(old_pk, old_pk)
+            return None
+        if pk_field.has_default():
+            return pk_field.get_default()
+        return self._rewrite(pk_field, old_pk)
+
+    def _insert(self, model, objs):
+        connection = connections[router.db_for_write(model)]
+        needs_pks = any(obj.pk is None for obj in objs)
+        if not needs_pks or _supports_returning_bulk_pks(connection):
+            model._base_manager.bulk_create(objs, batch_size=self.batch_size)
+        else:
+            # This backend can't report the primary keys that bulk_create generated, so save the
+            # rows one at a time, the way loaddata does.
+            for obj in objs:
+                obj.save_base(raw=True, force_insert=True)
@@ -0,0 +1,115 @@
+"""
+Exporting the objects a Record created to a file, and importing them into another database as a
+new Record.
+
+Exports are gzipped JSON Lines: a header describing the Record, followed by one line per row (as
+produced by :func:`.serialize_rows`), grouped by model in dependency order. Both directions stream
+rows in batches, so memory use doesn't grow with the size of each model's rows, beyond what the
+import's :class:`.RowCopier` keeps: mainly the map of old to new primary keys, to remap foreign
+keys.
+
+On databases that can't return the primary keys that ``bulk_create`` generates (SQLite, MySQL,
+and PostgreSQL before Django 1.10), rows with auto-incremented primary keys are imported one at a
+time, the way ``loaddata`` does, which is much slower for large exports.
+
+References to objects that weren't created by the Record (such as content types or permissions)
+are kept as they are, so those objects must have the same primary keys wherever it's imported.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import gzip
+from itertools import groupby
+import json
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from .copying import RowCopier, model_label, recorded_models, serialize_rows, unique_transform
+from .models import Record, Scenario, chunks
+
+FORMAT = 'quade-record'
+VERSION = 1
+
+
+class ExportError(Exception):
+    """An export can't be imported, e.g. because it's of an unknown format or Scenario."""
+
+
+def _write_line(fileobj, data):
+    fileobj.write((json.dumps(data, cls=DjangoJSONEncoder) + '\n').encode('utf-8'))
+
+
+def export_record(record, path, batch_size=500):
+    """
+    Write the objects `record` created to a gzipped JSON Lines file at `path`. Returns the number
+    of rows written.
+    """
+    models = recorded_models(record)
+    count = 0
+    with gzip.open(path, 'wb') as fileobj:
+        _write_line(fileobj, {
+            'format': FORMAT,
+            'version': VERSION,
+            'scenario': record.scenario.slug,
+            'config_hash': record.config_hash,
+            'instructions': record.instructions,
+            'models': [model_label(model) for model in models],
+        })
+        for model, pks in models.items():
+            for row in serialize_rows(model, pks, chunk_size=batch_size):
+                _write_line(fileobj, row)
+                count += 1
+    return count
+
+
+def _read_lines(fileobj):
+    for line in fileobj:
+        yield json.loads(line.decode('utf-8'))
+
+
+def import_record(path, created_by, batch_size=500):
+    """
+    Create a READY Record for `created_by` from the export at `path`, inserting copies of the
+    exported rows with ``bulk_create``, `batch_size` at a time (or one at a time on databases
+    that can't return generated primary keys; see above), in one transaction. Returns the
+    Record and the number of rows imported.
+
+    :raises: ExportError, or CopyError if the rows can't be copied.
+    """
+    with gzip.open(path, 'rb') as fileobj:
+        lines = _read_lines(fileobj)
+        header = next(lines, None)
+        if not header or header.get('format') != FORMAT or header.get('version') != VERSION:
+            raise ExportError("{} isn't a Quade record export.".format(path))
+        try:
+            scenario = Scenario.objects.get(slug=header['scenario'])
+        except Scenario.DoesNotExist:
+            raise ExportError("There is no Scenario with slug '{}'.".format(header['scenario']))
+        try:
+            models = [apps.get_model(label) for label in header['models']]
+        except LookupError as exc:
+            raise ExportError(exc)
+
+        copier = RowCopier(
+            models, transform=unique_transform(settings.QUADE.unique_transforms),
+            batch_size=batch_size, text=header['instructions'],
+        )
+        count = 0
+        with transaction.atomic():
+            record = Record.objects.create(
+                scenario=scenario,
+                status=Record.Status.READY,
+                config_hash=header['config_hash'],
+                created_by=created_by,
+            )
+            for label, rows in groupby(lines, lambda row: row['model']):
+                model = apps.get_model(label)
+                for batch in chunks(rows, batch_size):
+                    record.copy_rows(copier, model, batch)
+                    count += len(batch)
+            copier.finish()
+            record.instructions = copier.rewrite_text(header['instructions'])
+            record.save(update_fields=['instructions', 'updated_on'])
+    return record, count
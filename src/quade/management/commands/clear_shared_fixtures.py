@@ -0,0 +1,26 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from quade.models import SharedFixture
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the shared outputs of fixtures registered with shared=True, so that they are "
+        "called again. The objects they created are left alone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'func_names', nargs='*', metavar='NAME',
+            help="Only clear the outputs of these fixtures (default: all of them)."
+        )
+
+    def handle(self, *args, **options):
+        shared = SharedFixture.objects.all()
+        if options['func_names']:
+            shared = shared.filter(func_name__in=options['func_names'])
+        count = shared.count()
+        shared.delete()
+        self.stdout.write("Cleared {} shared fixture output(s).".format(count))
@@ -0,0 +1,33 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from quade.exports import export_record
+from quade.models import Record
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the objects a Record created to a gzipped JSON Lines file, which import_record can "
+        "load into another database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('record_id', type=int, help="The ID of the Record to export.")
+        parser.add_argument('path', help="The file to write the export to.")
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="The number of rows to fetch per query (default 500)."
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+        try:
+            record = Record.objects.select_related('scenario').get(pk=options['record_id'])
+        except Record.DoesNotExist:
+            raise CommandError("No Record with ID {}.".format(options['record_id']))
+        if not record.clonable:
+            raise CommandError("Record #{} hasn't executed successfully.".format(record.pk))
+        count = export_record(record, options['path'], batch_size=options['batch_size'])
+        self.stdout.write("Exported {} rows to {}.".format(count, options['path']))
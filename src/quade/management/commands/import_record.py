@@ -0,0 +1,48 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from quade.copying import CopyError
+from quade.exports import ExportError, import_record
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a file written by export_record as a new, READY Record. On databases that can't "
+        "return the primary keys of bulk inserts, such as SQLite and MySQL, rows with "
+        "auto-incremented primary keys are inserted one at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The export to import.")
+        parser.add_argument(
+            '--username',
+            help="The username of the user the Record will be created by (required)."
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="The number of rows to insert per query (default 500)."
+        )
+
+    def handle(self, *args, **options):
+        if not settings.QUADE.allowed:
+            raise CommandError("Quade is disabled on this environment.")
+        if not options['username']:
+            raise CommandError("--username is required.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+        User = get_user_model()
+        try:
+            created_by = User._default_manager.get_by_natural_key(options['username'])
+        except User.DoesNotExist:
+            raise CommandError("No user with username '{}'.".format(options['username']))
+
+        try:
+            record, count = import_record(
+                options['path'], created_by, batch_size=options['batch_size']
+            )
+        except (CopyError, ExportError) as exc:
+            raise CommandError("Can't import {}: {}".format(options['path'], exc))
+        self.stdout.write("Imported Record #{} with {} rows.".format(record.pk, count))
@@ -1,20 +1,50 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 
-from quade.managers import manager
+from quade.managers import manager, read_manifest
 
 
 class Command(BaseCommand):
+    help = (
+        "List the functions registered with Quade, from the fixtures_manifest if there is one. "
+        "With --verbosity 2, their signatures are listed too."
+    )
 
-    def handle(self, *args, **kwargs):
-        if len(manager.registry) == 0:
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--write-manifest', action='store_true',
+            help="Import the fixtures, and write their names and signatures to the "
+            "fixtures_manifest."
+        )
+        parser.add_argument(
+            '--no-manifest', action='store_true',
+            help="Import the fixtures, even if there is a manifest."
+        )
+
+    def handle(self, *args, **options):
+        path = settings.QUADE.fixtures_manifest
+        fixtures = None
+        if options['write_manifest']:
+            if path is None:
+                raise CommandError("The fixtures_manifest setting is not set.")
+            manager.write_manifest(path)
+        elif path is not None and not options['no_manifest']:
+            fixtures = read_manifest(path)
+        if fixtures is None:
+            fixtures = manager.manifest()
+
+        if len(fixtures) == 0:
             self.stdout.write("0 functions are registered with Quade.")
         else:
-            if len(manager.registry) == 1:
+            if len(fixtures) == 1:
                 opening = "1 function is"
             else:
-                opening = "{} functions are".format(len(manager.registry))
+                opening = "{} functions are".format(len(fixtures))
             self.stdout.write("{} registered with Quade:".format(opening))
-            for func_name in sorted(manager.registry):
-                self.stdout.write("- {}".format(func_name))
+            for fixture in fixtures:
+                if options['verbosity'] >= 2:
+                    self.stdout.write("- {name}{signature}".format(**fixture))
+                else:
+                    self.stdout.write("- {}".format(fixture['name']))
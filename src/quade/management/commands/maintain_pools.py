@@ -0,0 +1,33 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from quade.models import Scenario
+
+
+class Command(BaseCommand):
+    help = "Refill the pool of pre-executed Records of every Scenario with a pool size."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, metavar='SECONDS',
+            help="Keep refilling the pools, waiting this long between refills, until interrupted."
+        )
+
+    def handle(self, *args, **options):
+        if not settings.QUADE.allowed:
+            raise CommandError("Quade is disabled on this environment.")
+        if options['interval'] is not None and options['interval'] <= 0:
+            raise CommandError("--interval must be positive.")
+        try:
+            while True:
+                records = Scenario.objects.refill_pools()
+                self.stdout.write("Created {} pooled record(s).".format(len(records)))
+                if options['interval'] is None:
+                    return
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,44 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from builtins import str as text
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from quade.managers import AsyncStepError
+from quade.models import Scenario
+from quade.profiling import profile_scenario
+
+
+class Command(BaseCommand):
+    help = (
+        "Execute a Scenario in a transaction that is rolled back, and report its hotspots: the "
+        "slowest functions, the queries it runs, and the time each step takes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug', help="The slug of the Scenario to profile.")
+        parser.add_argument(
+            '--top', type=int, default=20,
+            help="The number of functions and duplicated queries to list (default 20)."
+        )
+        parser.add_argument(
+            '--trace-memory', action='store_true',
+            help="Measure each step's peak memory with tracemalloc, which slows execution down."
+        )
+
+    def handle(self, *args, **options):
+        if not settings.QUADE.allowed:
+            raise CommandError("Quade is disabled on this environment.")
+        if options['top'] < 1:
+            raise CommandError("--top must be positive.")
+        try:
+            scenario = Scenario.objects.get(slug=options['slug'])
+        except Scenario.DoesNotExist:
+            raise CommandError("No scenario with slug '{}'.".format(options['slug']))
+        try:
+            profile = profile_scenario(scenario, trace_memory=options['trace_memory'])
+        except AsyncStepError as exc:
+            raise CommandError(text(exc))
+        for line in profile.report(top=options['top']):
+            self.stdout.write(line)
@@ -0,0 +1,64 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from quade.models import Record
+
+STATUSES = dict((name, value) for value, name in Record.Status.choices)
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete old Records, along with the objects that executing them created. Records whose "
+        "objects are protected by other rows are skipped and reported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, metavar='DAYS',
+            help="Only purge Records created more than this many days ago (required)."
+        )
+        parser.add_argument(
+            '--status', action='append', choices=sorted(STATUSES),
+            help="Only purge Records with this status. May be given more than once."
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="The number of objects to delete per query (default 1000)."
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Report what would be deleted, without deleting anything."
+        )
+
+    def handle(self, *args, **options):
+        if options['older_than'] is None:
+            raise CommandError("--older-than is required.")
+        if options['older_than'] < 0 or options['batch_size'] < 1:
+            raise CommandError("--older-than can't be negative, and --batch-size must be positive.")
+        records = Record.objects.filter(
+            created_on__lt=timezone.now() - timedelta(days=options['older_than'])
+        )
+        if options['status']:
+            records = records.filter(status__in=[STATUSES[name] for name in options['status']])
+
+        counts, skipped = records.purge(
+            batch_size=options['batch_size'], dry_run=options['dry_run']
+        )
+        if options['dry_run']:
+            self.stdout.write("Would delete {} rows (not counting cascades):".format(
+                sum(counts.values())
+            ))
+        else:
+            self.stdout.write("Deleted {} rows:".format(sum(counts.values())))
+        for label in sorted(label for label in counts if counts[label]):
+            self.stdout.write("- {}: {}".format(label, counts[label]))
+        if skipped:
+            self.stderr.write(
+                "Skipped {} Records whose objects are protected:".format(len(skipped))
+            )
+            for record_id, error in skipped:
+                self.stderr.write("- Record #{}: {}".format(record_id, error.args[0]))
@@ -0,0 +1,143 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import math
+import multiprocessing
+from timeit import default_timer
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+# Models are imported inside functions: with the "spawn" start method, worker processes unpickle
+# functions from this module before Django has been set up.
+
+
+def percentile(values, pct):
+    """Return the `pct` percentile of `values`, using the nearest-rank method."""
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[max(rank - 1, 0)]
+
+
+def init_worker():
+    """Prepare a worker process: set up Django if needed, and import the fixtures."""
+    if not apps.ready:
+        django.setup()
+    from quade.managers import manager
+    manager.setup()
+
+
+def execute_record(record_id):
+    """
+    Execute a single Record. Returns a tuple of the Record's ID, how long execution took, and the
+    repr of the exception that made it fail (or None).
+    """
+    from quade.models import Record
+    start = default_timer()
+    try:
+        Record.objects.get(pk=record_id).execute_test()
+    except Exception as exc:
+        error = repr(exc)
+    else:
+        error = None
+    return record_id, default_timer() - start, error
+
+
+def parse_scenario_arg(value):
+    slug, _, count = value.partition(':')
+    try:
+        count = int(count) if count else 1
+    except ValueError:
+        count = 0
+    if count < 1:
+        raise CommandError("Invalid count in '{}'; expected SLUG or SLUG:COUNT.".format(value))
+    return slug, count
+
+
+class Command(BaseCommand):
+    help = "Create and execute Records for one or more Scenarios, in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios', nargs='+', metavar='SLUG[:COUNT]',
+            help="A Scenario slug, optionally followed by the number of Records to create for it "
+            "(default 1)."
+        )
+        parser.add_argument(
+            '--username',
+            help="The username of the user the Records will be created by (required)."
+        )
+        parser.add_argument(
+            '--processes', type=int, default=multiprocessing.cpu_count(),
+            help="The number of worker processes (default: the number of CPUs). With 1, Records "
+            "are executed in this process."
+        )
+
+    def handle(self, *args, **options):
+        from quade.models import Record, Scenario
+
+        if not settings.QUADE.allowed:
+            raise CommandError("Quade is disabled on this environment.")
+        if not options['username']:
+            raise CommandError("--username is required.")
+        if options['processes'] < 1:
+            raise CommandError("--processes must be at least 1.")
+        counts = [parse_scenario_arg(value) for value in options['scenarios']]
+        scenarios = {
+            scenario.slug: scenario
+            for scenario in Scenario.objects.active().filter(slug__in=[slug for slug, _ in counts])
+        }
+        missing = sorted(set(slug for slug, _ in counts) - set(scenarios))
+        if missing:
+            raise CommandError("No active scenario(s) with slug: {}".format(', '.join(missing)))
+        User = get_user_model()
+        try:
+            created_by = User._default_manager.get_by_natural_key(options['username'])
+        except User.DoesNotExist:
+            raise CommandError("No user with username '{}'.".format(options['username']))
+
+        with transaction.atomic():
+            record_ids = [
+                Record.objects.create(scenario=scenarios[slug], created_by=created_by).pk
+                for slug, count in counts
+                for _ in range(count)
+            ]
+        self.stdout.write("Executing {} records with {} process(es)...".format(
+            len(record_ids), options['processes']
+        ))
+
+        start = default_timer()
+        durations, failures = [], 0
+        for record_id, duration, error in self.execute_records(record_ids, options['processes']):
+            durations.append(duration)
+            if error is not None:
+                failures += 1
+                self.stderr.write("Record #{} failed: {}".format(record_id, error))
+        self.report(durations, failures, default_timer() - start)
+
+    def execute_records(self, record_ids, processes):
+        if processes == 1:
+            init_worker()
+            for record_id in record_ids:
+                yield execute_record(record_id)
+            return
+        # Worker processes must open their own database connections rather than share ours.
+        connections.close_all()
+        pool = multiprocessing.Pool(processes, initializer=init_worker)
+        try:
+            for result in pool.imap_unordered(execute_record, record_ids):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+    def report(self, durations, failures, elapsed):
+        self.stdout.write("Executed {} records in {:.2f}s ({:.2f} records/s), {} failed.".format(
+            len(durations), elapsed, len(durations) / elapsed if elapsed else float('inf'), failures
+        ))
+        self.stdout.write("Latency: p50 {:.3f}s, p95 {:.3f}s, p99 {:.3f}s.".format(
+            percentile(durations, 50), percentile(durations, 95), percentile(durations, 99)
+        ))
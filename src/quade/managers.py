@@ -1,10 +1,23 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 from builtins import str as text
+from collections import defaultdict, namedtuple
+import functools
+import hashlib
 import importlib
+import inspect
+import io
+import json
+from multiprocessing.pool import ThreadPool
 
+from attr import attrib, attrs
 from django.conf import settings
-from django.db import transaction
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.utils import six
+from six.moves import queue
+
+from .telemetry import QueryBudget, nested
 
 
 class ConfigurationError(Exception):
@@ -15,47 +28,465 @@ class ConfigurationError(Exception):
         self.unregistered_functions = unregistered_functions
 
 
+class StepFormatError(Exception):
+    """
+    A test configuration isn't a list of steps, or has a step that isn't ``[func_name, kwargs]`` or
+    ``[func_name, kwargs, options]``.
+    """
+
+
+class StepDependencyError(Exception):
+    """
+    A test configuration has a step whose dependencies can't be satisfied.
+    """
+
+
+class StepArgumentError(Exception):
+    """
+    A test configuration passes arguments to a function that its signature doesn't accept.
+    """
+
+
+class AsyncStepError(Exception):
+    """
+    A test configuration with ``async def`` steps can't be executed here: synchronously, in a
+    thread that is already running an event loop, or where every step must use this thread's
+    database connection (in dry runs and with ``atomic_execution``), since the ORM work of async
+    steps is done on other threads.
+    """
+
+
+Step = namedtuple('Step', ['index', 'name', 'func_name', 'kwargs', 'depends_on'])
+
+
+class StepRun(object):
+    """
+    One execution of a :class:`Step`, as seen by the monitors passed to
+    :meth:`FixtureManager.execute`. `output` is set once the step has returned.
+    """
+
+    def __init__(self, step):
+        self.step = step
+        self.output = None
+
+
+def parse_steps(config):
+    """
+    Parse a config into a list of :class:`Step` tuples.
+
+    Each step in a config is either ``[func_name, kwargs]`` or ``[func_name, kwargs, options]``.
+    ``options`` may give the step a ``name`` (which defaults to ``func_name``), and may list the
+    names of the earlier steps that it ``depends_on``. A step that doesn't list its dependencies
+    depends on every step before it, so configs without any options run strictly in order.
+
+    :raises: StepFormatError or StepDependencyError
+    """
+    if not config:  # Including a Scenario's config that hasn't been set.
+        return []
+    if not isinstance(config, (list, tuple)):
+        raise StepFormatError("config must be a list of steps, not {!r}".format(config))
+    steps = []
+    for index, step in enumerate(config):
+        _check_step_format(index, step)
+        func_name, kwargs = step[0], step[1]
+        options = step[2] if len(step) > 2 else {}
+        name = options.get('name', func_name)
+        if 'depends_on' in options:
+            depends_on = []
+            for dependency in options['depends_on']:
+                matches = [earlier.index for earlier in steps if earlier.name == dependency]
+                if not matches:
+                    raise StepDependencyError(
+                        "step {} ({}) depends on '{}', which is not the name of an earlier "
+                        "step".format(index, name, dependency)
+                    )
+                if len(matches) > 1:
+                    raise StepDependencyError(
+                        "step {} ({}) depends on '{}', which is the name of more than one "
+                        "step".format(index, name, dependency)
+                    )
+                depends_on.extend(matches)
+        else:
+            depends_on = range(index)
+        steps.append(Step(index, name, func_name, kwargs, tuple(depends_on)))
+    return steps
+
+
+def _check_step_format(index, step):
+    if not isinstance(step, (list, tuple)) or len(step) not in (2, 3):
+        raise StepFormatError(
+            "step {} must be [func_name, kwargs] or [func_name, kwargs, options], not {!r}".format(
+                index, step
+            )
+        )
+    func_name = step[0]
+    if not isinstance(func_name, six.string_types):
+        raise StepFormatError(
+            "step {}: the function name must be a string, not {!r}".format(index, func_name)
+        )
+    problems = []
+    if not isinstance(step[1], dict):
+        problems.append("kwargs must be a dict, not {!r}".format(step[1]))
+    options = step[2] if len(step) > 2 else {}
+    if not isinstance(options, dict):
+        problems.append("options must be a dict, not {!r}".format(options))
+    else:
+        unknown = sorted(set(options) - {'name', 'depends_on'})
+        if unknown:
+            problems.append("unknown options: {}".format(', '.join(map(text, unknown))))
+        if not isinstance(options.get('name', func_name), six.string_types):
+            problems.append("name must be a string, not {!r}".format(options['name']))
+        if not isinstance(options.get('depends_on', []), (list, tuple)):
+            problems.append(
+                "depends_on must be a list of step names, not {!r}".format(options['depends_on'])
+            )
+    if problems:
+        raise StepFormatError("step {} ({}): {}".format(index, func_name, '; '.join(problems)))
+
+
+@attrs(frozen=True)
+class Plan(object):
+    """
+    A config compiled for execution: its steps, with their kwargs bound to the signatures of the
+    registered functions (with defaults applied), and the functions themselves.
+    """
+    config_hash = attrib()
+    steps = attrib()
+    funcs = attrib()
+
+    @property
+    def is_async(self):
+        """Whether any of the plan's functions are ``async def`` functions."""
+        return any(is_async(func) for func in self.funcs.values())
+
+    def call(self, step):
+        func = self.funcs[step.func_name]
+        if getattr(func, 'quade_shared', False):
+            from .models import SharedFixture
+            return SharedFixture.objects.call(func, step)
+        if is_async(func):
+            from .aio import run_coroutine
+            return run_coroutine(func(**step.kwargs))
+        return func(**step.kwargs)
+
+
+def is_async(func):
+    """Whether `func` is an ``async def`` function (which Python 2 doesn't have)."""
+    iscoroutinefunction = getattr(inspect, 'iscoroutinefunction', None)
+    return iscoroutinefunction is not None and iscoroutinefunction(func)
+
+
+def event_loop_running():
+    """Whether this thread is running an asyncio event loop (which Python 2 doesn't have)."""
+    try:
+        import asyncio
+    except ImportError:
+        return False
+    get_running_loop = getattr(asyncio, '_get_running_loop', None)
+    return get_running_loop is not None and get_running_loop() is not None
+
+
+def bind_kwargs(func, step):
+    """
+    Check `step`'s kwargs against the signature of `func`, and return them with defaults applied.
+    """
+    try:
+        signature = inspect.signature(func)
+    except AttributeError:  # pragma: no cover
+        return dict(step.kwargs)  # Python 2 has no inspect.signature; don't check anything.
+    except ValueError:
+        return dict(step.kwargs)  # Some callables don't have a signature.
+    try:
+        bound = signature.bind(**step.kwargs)
+    except TypeError as exc:
+        raise StepArgumentError("step {} ({}): {}".format(step.index, step.name, exc))
+    bound.apply_defaults()
+    kwargs = {}
+    for name, value in bound.arguments.items():
+        kind = signature.parameters[name].kind
+        if kind == inspect.Parameter.VAR_KEYWORD:
+            kwargs.update(value)
+        elif kind != inspect.Parameter.VAR_POSITIONAL:
+            kwargs[name] = value
+    return kwargs
+
+
+def config_hash(config):
+    """
+    Return a stable hash of a Scenario config.
+    """
+    serialized = json.dumps(config, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def _source_of(func):
+    while hasattr(func, '__wrapped__'):
+        func = func.__wrapped__
+    try:
+        return inspect.getsource(func)
+    except (IOError, TypeError):
+        code = func.__code__
+        return repr((code.co_code, code.co_consts, code.co_names))
+
+
+def source_hash(func):
+    """Return a hash of the source code of `func`, which changes whenever the function does."""
+    return hashlib.sha1(_source_of(func).encode('utf-8')).hexdigest()
+
+
+def _signature_of(func):
+    try:
+        return text(inspect.signature(func))
+    except AttributeError:  # pragma: no cover
+        return ''  # Python 2 has no inspect.signature.
+    except ValueError:
+        return ''
+
+
+def read_manifest(path):
+    """
+    Return the fixtures listed in the manifest at `path`, as written by
+    :meth:`FixtureManager.write_manifest`, or None if there is no manifest of the current
+    ``fixtures_file`` there.
+    """
+    try:
+        with io.open(path, encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+    except (IOError, OSError, ValueError):
+        return None
+    if manifest.get('fixtures_file') != settings.QUADE.fixtures_file:
+        return None
+    return manifest['fixtures']
+
+
 class FixtureManager:
+    """
+    The registry of fixture functions. The ``fixtures_file`` module, which registers them, is
+    imported the first time the registry is used (if Quade is allowed on this environment), so
+    that processes that never execute a scenario don't pay for importing it.
+    """
     def __init__(self):
         self._registry = {}
+        self._plans = {}
+        self._loaded = False
 
     def register(self, func):
         self._registry[func.__name__] = func
+        self._plans = {}
 
     @property
     def registry(self):
+        self.load()
         return self._registry
 
     def setup(self):
+        """Import the ``fixtures_file`` module now."""
         importlib.import_module(settings.QUADE.fixtures_file)
+        self._loaded = True
 
-    def execute(self, config):
-        instructions = []
-        for step in config:
-            func_name, kwargs = step
-            func = self._registry[func_name]
-            output = func(**kwargs)
-            instructions.append(text(output))
-        return '\n'.join(instructions)
+    def load(self):
+        """Import the ``fixtures_file`` module, unless it has been already."""
+        if not self._loaded and settings.QUADE.allowed:
+            self.setup()
 
-    def validate(self, config):
+    def manifest(self):
+        """Return the name and signature of each registered function, sorted by name."""
+        return [
+            {'name': name, 'signature': _signature_of(func)}
+            for name, func in sorted(self.registry.items())
+        ]
+
+    def write_manifest(self, path):
         """
-        :return: raises or None
+        Save the :meth:`manifest` to `path` as JSON, so that it can be read with
+        :func:`read_manifest` without importing the fixtures.
+        """
+        manifest = {'fixtures_file': settings.QUADE.fixtures_file, 'fixtures': self.manifest()}
+        with io.open(path, 'w', encoding='utf-8') as manifest_file:
+            manifest_file.write(text(json.dumps(manifest, indent=2, sort_keys=True)))
+
+    def compile(self, config):
+        """
+        Validate `config` and compile it into a :class:`Plan`. Plans are cached by the hash of
+        their config, so compiling the same config again is cheap.
+
+        :raises: ConfigurationError, StepFormatError, StepDependencyError or StepArgumentError
         """
-        func_names = set(step[0] for step in config)
-        registered_funcs = set(self._registry.keys())
-        unregistered_funcs = func_names - registered_funcs
+        self.load()
+        hashed_config = config_hash(config)
+        try:
+            return self._plans[hashed_config]
+        except KeyError:
+            pass
+        steps = parse_steps(config)
+        unregistered_funcs = set(step.func_name for step in steps) - set(self.registry)
         if unregistered_funcs:
             raise ConfigurationError(unregistered_funcs)
+        funcs = {step.func_name: self.registry[step.func_name] for step in steps}
+        plan = Plan(
+            config_hash=hashed_config,
+            steps=tuple(
+                step._replace(kwargs=bind_kwargs(funcs[step.func_name], step)) for step in steps
+            ),
+            funcs=funcs,
+        )
+        self._plans[hashed_config] = plan
+        return plan
+
+    def execute(self, config, monitors=(), threads=None):
+        """
+        Execute each step of `config` (or of a compiled :class:`Plan`), and return their outputs
+        joined by newlines, in the order the steps appear in the config.
+
+        If `threads` (which defaults to ``step_threads``) is more than 1, steps whose dependencies
+        have finished run concurrently on a pool of threads, each with its own database
+        connection.
+
+        Each of `monitors` is called with a :class:`StepRun` for every step, and must return a
+        context manager, which is entered in the thread that executes the step, around the step.
+        The queries of steps whose functions were registered with a ``query_budget`` are counted
+        by a :class:`.QueryBudget`, innermost.
+        """
+        plan = config if isinstance(config, Plan) else self.compile(config)
+        monitors = self.monitors_for(plan, monitors)
+        if threads is None:
+            threads = settings.QUADE.step_threads
+        threads = min(threads, len(plan.steps))
+        if threads > 1:
+            outputs = self._execute_concurrently(plan, threads, monitors)
+        else:
+            outputs = [self._call(plan, step, monitors) for step in plan.steps]
+        return '\n'.join(text(output) for output in outputs)
+
+    def monitors_for(self, plan, monitors):
+        """Return `monitors`, followed by a :class:`.QueryBudget` if `plan` needs one."""
+        monitors = tuple(monitors)
+        if any(QueryBudget.budget_of(func) is not None for func in plan.funcs.values()):
+            monitors += (QueryBudget(plan),)
+        return monitors
+
+    def _call(self, plan, step, monitors=()):
+        from .receivers import capture_step
+        run = StepRun(step)
+        with capture_step() as step_capture:
+            with nested([monitor(run) for monitor in monitors]):
+                try:
+                    run.output = plan.call(step)
+                except Exception:
+                    # Registered functions are atomic, so what the step created was rolled back.
+                    if step_capture is not None and not is_async(plan.funcs[step.func_name]):
+                        step_capture.discard()
+                    raise
+        return run.output
+
+    def _execute_concurrently(self, plan, threads, monitors=()):
+        from .receivers import active_capture
+        capture = active_capture()
+        steps = plan.steps
+        waiting_on = {step.index: set(step.depends_on) for step in steps}
+        dependents = defaultdict(list)
+        for step in steps:
+            for dependency in step.depends_on:
+                dependents[dependency].append(step.index)
+
+        outputs = [None] * len(steps)
+        finished = queue.Queue()
+        pool = ThreadPool(threads)
+        running, error = 0, None
+
+        def submit(index):
+            pool.apply_async(
+                self._call_in_thread, (plan, steps[index], capture, monitors),
+                callback=finished.put,
+            )
+
+        try:
+            for index in sorted(waiting_on):
+                if not waiting_on[index]:
+                    submit(index)
+                    running += 1
+            while running:
+                index, output, exc = finished.get()
+                running -= 1
+                if exc is not None:
+                    error = error or exc
+                if error is not None:
+                    continue  # Let running steps finish, but don't start any more.
+                outputs[index] = output
+                for dependent in dependents[index]:
+                    waiting_on[dependent].discard(index)
+                    if not waiting_on[dependent]:
+                        submit(dependent)
+                        running += 1
+        finally:
+            pool.close()
+            pool.join()
+        if error is not None:
+            raise error
+        return outputs
+
+    def _call_in_thread(self, plan, step, capture, monitors):
+        from .receivers import activate_capture
+        try:
+            with activate_capture(capture):
+                return step.index, self._call(plan, step, monitors), None
+        except Exception as exc:
+            return step.index, None, exc
+        finally:
+            connections.close_all()
+
+    def code_hash(self, config):
+        """
+        Return a hash of the source code of the registered functions that `config` uses, which
+        changes whenever one of those functions does.
+        """
+        digest = hashlib.sha1()
+        for func_name in sorted(set(step[0] for step in config)):
+            digest.update(func_name.encode('utf-8'))
+            digest.update(_source_of(self.registry[func_name]).encode('utf-8'))
+        return digest.hexdigest()
+
+    def validate(self, config):
+        """
+        :return: raises or None
+        """
+        self.compile(config)
 
 
 manager = FixtureManager()  # Singleton pattern.
 
 
-def register(func):
+def register(func=None, shared=False, ttl=None, query_budget=None):
     """
     Register a function with the FixtureManager. Also wraps the function in an atomic transaction.
+
+    Use as ``@register``, or as ``@register(shared=True)`` to share the function's output, and the
+    objects it creates, between Records: it is only called once for each set of kwargs, and later
+    steps that call it with the same kwargs return the same output (see :class:`.SharedFixture`),
+    for `ttl` seconds if given.
+
+    With ``@register(query_budget=N)``, steps that call the function and run more than N SQL
+    queries are reported according to the ``query_budget_action`` setting.
+
+    ``async def`` functions may be registered too (except as shared functions), and are awaited;
+    see :func:`.execute_async`. A transaction can't span a coroutine's awaits, so they aren't
+    wrapped in one.
     """
-    func = transaction.atomic(func)
-    manager.register(func)
-    return func
+    if ttl is not None and not shared:
+        raise ValueError("ttl only applies to shared fixtures.")
+    if query_budget is not None and query_budget < 0:
+        raise ValueError("query_budget can't be negative.")
+    if func is None:
+        return functools.partial(register, shared=shared, ttl=ttl, query_budget=query_budget)
+    if is_async(func):
+        if shared:
+            raise ValueError("async functions can't be shared.")
+        registered_func = func
+    else:
+        registered_func = transaction.atomic(func)
+        registered_func.__wrapped__ = func  # Python 2's functools.wraps doesn't set this.
+    registered_func.quade_shared = shared
+    registered_func.quade_ttl = ttl
+    registered_func.quade_query_budget = query_budget
+    manager.register(registered_func)
+    return registered_func
@@ -0,0 +1,270 @@
+"""
+Metrics about executing Records, served by :class:`.MetricsView` in Prometheus' text exposition
+format: counters and histograms kept by each process, and gauges counted from the database when
+they are scraped.
+
+Without the ``metrics_dir`` setting, values are kept in memory, and each process only reports its
+own executions. With it, each process keeps its values in a memory-mapped file of its own in that
+directory, and the view adds up the files of every process, so that executions on Celery workers
+and other web processes are counted too.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from builtins import str as text
+from collections import OrderedDict, defaultdict
+import glob
+import io
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+GAUGE = 'gauge'
+
+SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float('inf'))
+OBJECTS_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, float('inf'))
+
+METRICS = OrderedDict([
+    ('quade_executions_total', (COUNTER, "Records executed, by scenario and final status.", None)),
+    ('quade_execution_seconds', (
+        HISTOGRAM, "Time spent executing Records, by scenario.", SECONDS_BUCKETS
+    )),
+    ('quade_queued_seconds', (
+        HISTOGRAM, "Time from creating Records to starting to execute them, by scenario.",
+        SECONDS_BUCKETS
+    )),
+    ('quade_captured_objects', (
+        HISTOGRAM, "Objects created by each execution of a Record, by scenario.", OBJECTS_BUCKETS
+    )),
+])
+RECORDS_GAUGE = ('quade_records', "Records that haven't finished executing, by status.")
+
+
+class MemoryValues(object):
+    """Values kept in this process's memory."""
+
+    def __init__(self):
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, key, amount):
+        with self._lock:
+            self._values[key] += amount
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+
+class MmapValues(object):
+    """
+    Values kept in a memory-mapped file, which only this process writes to, and which any process
+    can read with :func:`read_values_file`.
+
+    The file starts with the number of bytes in use (8 bytes). Each value follows as the length of
+    its key (4 bytes), the key (UTF-8, padded to a multiple of 8 bytes) and the value (a double).
+    Entries are written before the length in use is updated, so readers never see partial ones.
+    """
+    initial_size = 1 << 16
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = io.open(path, 'a+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            self._file.truncate(self.initial_size)
+            size = self.initial_size
+        self._size = size
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._positions = {}
+        self._used = struct.unpack_from(b'Q', self._map, 0)[0] or 8
+        for key, _, position in _entries(self._map, self._used):
+            self._positions[key] = position
+
+    def inc(self, key, amount):
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._append(key)
+            value = struct.unpack_from(b'd', self._map, position)[0]
+            struct.pack_into(b'd', self._map, position, value + amount)
+
+    def _append(self, key):
+        encoded = key.encode('utf-8')
+        padded = encoded + b' ' * (-(len(encoded) + 4) % 8)
+        entry = struct.pack(b'i', len(encoded)) + padded + struct.pack(b'd', 0.0)
+        while self._used + len(entry) > self._size:
+            self._size *= 2
+            self._file.truncate(self._size)
+            self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), self._size)
+        self._map[self._used:self._used + len(entry)] = entry
+        position = self._used + len(entry) - 8
+        self._used += len(entry)
+        struct.pack_into(b'Q', self._map, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def items(self):
+        return list(read_values_file(self.path).items())
+
+
+def _entries(data, used):
+    """Yield (key, value, position of value) for each entry in a values file's `data`."""
+    position = 8
+    while position < used:
+        length = struct.unpack_from(b'i', data, position)[0]
+        start = position + 4
+        key = bytes(data[start:start + length]).decode('utf-8')
+        position = start + length + (-(length + 4) % 8)
+        yield key, struct.unpack_from(b'd', data, position)[0], position
+        position += 8
+
+
+def read_values_file(path):
+    """Return a dict of the values in a file written by :class:`MmapValues`."""
+    with io.open(path, 'rb') as values_file:
+        data = values_file.read()
+    if len(data) < 8:
+        return {}
+    used = struct.unpack_from(b'Q', data, 0)[0]
+    return {key: value for key, value, _ in _entries(data, used)}
+
+
+_values = {}
+_values_lock = threading.Lock()
+
+
+def get_values():
+    """
+    Return the values this process writes to: an :class:`MmapValues` in ``metrics_dir`` named
+    after the process ID (so that forked processes get their own), or else a :class:`MemoryValues`.
+    """
+    directory = settings.QUADE.metrics_dir
+    key = (directory, os.getpid())
+    with _values_lock:
+        if key not in _values:
+            if directory is None:
+                _values[key] = MemoryValues()
+            else:
+                path = os.path.join(directory, 'quade_{}.metrics'.format(os.getpid()))
+                _values[key] = MmapValues(path)
+        return _values[key]
+
+
+def _key(sample, labels):
+    return json.dumps([sample, sorted(labels.items())])
+
+
+def inc(name, labels, amount=1):
+    """Add `amount` to the counter `name` with `labels`."""
+    get_values().inc(_key(name, labels), amount)
+
+
+def observe(name, labels, value):
+    """Add `value` to the histogram `name` with `labels`."""
+    values = get_values()
+    for bound in METRICS[name][2]:
+        if value <= bound:
+            values.inc(_key(name + '_bucket', dict(labels, le=_format_value(bound))), 1)
+    values.inc(_key(name + '_sum', labels), value)
+    values.inc(_key(name + '_count', labels), 1)
+
+
+def observe_execution(record, started):
+    """
+    Count the execution of `record`, which started at `started`. Errors are logged rather than
+    raised, so that metrics never make an execution fail.
+    """
+    try:
+        labels = {'scenario': record.scenario.slug}
+        inc('quade_executions_total', dict(labels, status=record.Status.get_name(record.status)))
+        observe('quade_execution_seconds', labels, (timezone.now() - started).total_seconds())
+        observe('quade_queued_seconds', labels, (started - record.created_on).total_seconds())
+        if record.objects_captured is not None:
+            observe('quade_captured_objects', labels, record.objects_captured)
+    except Exception:
+        logger.exception("Couldn't update the metrics of record #%s", record.pk)
+
+
+def collect():
+    """Return the values of every process (or just this one, without ``metrics_dir``)."""
+    directory = settings.QUADE.metrics_dir
+    if directory is None:
+        return dict(get_values().items())
+    totals = defaultdict(float)
+    for path in glob.glob(os.path.join(directory, 'quade_*.metrics')):
+        for key, value in read_values_file(path).items():
+            totals[key] += value
+    return totals
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _escape(value):
+    return text(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    """Format a list of (name, value) pairs as a label set."""
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in labels) + '}'
+
+
+def _sample_order(sample):
+    """Sort samples by their labels, with histogram buckets in order of their bounds."""
+    labels, _ = sample
+    bound = dict(labels).get('le')
+    return (
+        [label for label in labels if label[0] != 'le'],
+        float('inf') if bound == '+Inf' else float(bound or 0),
+    )
+
+
+def exposition():
+    """Return every metric in Prometheus' text exposition format."""
+    from .models import Record
+    samples = defaultdict(list)
+    for key, value in collect().items():
+        sample, labels = json.loads(key)
+        samples[sample].append(([tuple(label) for label in labels], value))
+
+    lines = []
+    for name, (kind, help_text, _) in METRICS.items():
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        suffixes = ['_bucket', '_sum', '_count'] if kind == HISTOGRAM else ['']
+        for suffix in suffixes:
+            for labels, value in sorted(samples[name + suffix], key=_sample_order):
+                lines.append('{}{} {}'.format(
+                    name + suffix, _format_labels(labels), _format_value(value)
+                ))
+
+    name, help_text = RECORDS_GAUGE
+    lines.append('# HELP {} {}'.format(name, help_text))
+    lines.append('# TYPE {} {}'.format(name, GAUGE))
+    counts = dict(Record.objects.filter(
+        status__in=[Record.Status.NOT_READY, Record.Status.IN_PROGRESS]
+    ).values_list('status').annotate(count=Count('pk')).order_by())
+    for status in [Record.Status.NOT_READY, Record.Status.IN_PROGRESS]:
+        lines.append('{}{} {}'.format(
+            name, _format_labels([('status', Record.Status.get_name(status))]),
+            _format_value(counts.get(status, 0))
+        ))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quade', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scenario',
+            name='use_snapshot',
+            field=models.BooleanField(default=False, help_text='Replay the rows created by the last successful execution of this config, instead of executing its fixtures again.'),
+        ),
+        migrations.CreateModel(
+            name='Snapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('config_hash', models.CharField(max_length=40)),
+                ('code_hash', models.CharField(max_length=40)),
+                ('instructions', models.TextField(blank=True, null=True)),
+                ('rows', jsonfield.fields.JSONField()),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('record', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='quade.Record')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='snapshot',
+            unique_together=set([('config_hash', 'code_hash')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quade', '0002_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='record',
+            name='config_hash',
+            field=models.CharField(blank=True, help_text="A hash of the scenario's config at the time this record was executed.", max_length=40),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quade', '0003_record_config_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordStep',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('duration', models.FloatField(help_text='Wall-clock time, in seconds.', null=True)),
+                ('query_count', models.PositiveIntegerField(null=True)),
+                ('objects_captured', models.PositiveIntegerField(null=True)),
+                ('memory_peak', models.BigIntegerField(help_text='Peak memory allocated, in bytes.', null=True)),
+                ('record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='steps', to='quade.Record')),
+            ],
+            options={
+                'ordering': ['record', 'index'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='recordstep',
+            unique_together=set([('record', 'index')]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quade', '0004_recordstep'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='record',
+            name='completed_steps',
+            field=models.PositiveIntegerField(default=0, help_text='The number of steps that have finished executing so far.'),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='total_steps',
+            field=models.PositiveIntegerField(help_text='The number of steps in the config being executed.', null=True),
+        ),
+        migrations.AddField(
+            model_name='recordstep',
+            name='output',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quade', '0005_step_progress'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='record',
+            index_together=set([('created_on', 'id'), ('status', 'created_on', 'id'), ('scenario', 'created_on', 'id'), ('created_by', 'created_on', 'id')]),
+        ),
+    ]
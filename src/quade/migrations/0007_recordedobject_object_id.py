@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quade', '0006_record_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recordedobject',
+            name='object_id',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterIndexTogether(
+            name='recordedobject',
+            index_together=set([('content_type', 'object_id')]),
+        ),
+    ]
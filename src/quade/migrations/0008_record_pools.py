@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('quade', '0007_recordedobject_object_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scenario',
+            name='pool_size',
+            field=models.PositiveIntegerField(default=0, help_text='The number of Records to keep executed in advance, ready to be claimed.'),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='pooled',
+            field=models.BooleanField(default=False, help_text='Whether this Record was executed in advance, and is waiting to be claimed.'),
+        ),
+        migrations.AlterField(
+            model_name='record',
+            name='created_by',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterIndexTogether(
+            name='record',
+            index_together=set([('created_on', 'id'), ('status', 'created_on', 'id'), ('scenario', 'created_on', 'id'), ('created_by', 'created_on', 'id'), ('scenario', 'pooled', 'status')]),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quade', '0008_record_pools'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SharedFixture',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('func_name', models.CharField(max_length=255)),
+                ('kwargs_hash', models.CharField(max_length=40)),
+                ('code_hash', models.CharField(max_length=40)),
+                ('output', models.TextField(blank=True)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('expires_on', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='sharedfixture',
+            unique_together=set([('func_name', 'kwargs_hash')]),
+        ),
+    ]
@@ -1,17 +1,38 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from builtins import str as text
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import groupby, islice
+import logging
+
+import django
+from django.apps import apps
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.db import models as m
+from django.db import IntegrityError, connections, models as m, transaction
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django_fsm.db.fields import FSMIntegerField, transition
 from django_light_enums import enum
 from jsonfield import JSONField
 
-from .managers import manager, ConfigurationError
-from .receivers import connect_qa_object_receiver
+from . import metrics
+from .copying import (
+    CopyError, RowCopier, dependency_order, load_pk, recorded_models, serialize_rows,
+    unique_transform,
+)
+from .managers import (
+    config_hash, event_loop_running, manager, source_hash, AsyncStepError, ConfigurationError,
+    StepArgumentError, StepDependencyError, StepFormatError
+)
+from .receivers import activate_capture, capture_qa_objects
+from .telemetry import StepRecorder, StepTelemetry
+
+
+logger = logging.getLogger(__name__)
 
 
 class ScenarioManager(m.QuerySet):
@@ -19,6 +40,189 @@ class ScenarioManager(m.QuerySet):
     def active(self):
         return self.filter(status=Scenario.Status.ACTIVE)
 
+    def refill_pools(self):
+        """
+        Refill the pool of every active Scenario with a `pool_size`, and discard the pooled
+        Records of every other Scenario. Returns the new Records.
+        """
+        scenarios = list(self.active().filter(pool_size__gt=0))
+        Record.objects.filter(pooled=True).exclude(scenario__in=scenarios).exclude(
+            status=Record.Status.NOT_READY
+        ).purge()
+        return [record for scenario in scenarios for record in scenario.refill_pool()]
+
+
+def chunks(items, size):
+    """Yield successive lists of at most `size` of `items`, which may be any iterable."""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _delete(queryset, counts, dry_run):
+    """Delete `queryset`, adding the number of rows deleted per model label to `counts`."""
+    opts = queryset.model._meta
+    label = '{}.{}'.format(opts.app_label, opts.object_name)
+    if dry_run:
+        counts[label] += queryset.count()
+        return
+    if django.VERSION < (1, 9):
+        # Django < 1.9 doesn't report what it deleted, so count the rows themselves beforehand.
+        counts[label] += queryset.count()
+        queryset.delete()
+        return
+    counts.update(queryset.delete()[1])
+
+
+def _purge_record(record_id, pks_by_content_type, counts, batch_size, dry_run):
+    """
+    Delete the Record `record_id` and the objects it created, given as sets of primary keys by
+    content type ID, adding the number of rows deleted per model label to `counts`.
+    """
+    pks_by_model = {}
+    for content_type_id, object_ids in pks_by_content_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is not None:  # Skip models that have been removed.
+            pks_by_model[model] = sorted(load_pk(model, object_id) for object_id in object_ids)
+    for model in reversed(dependency_order(pks_by_model)):
+        for pks in chunks(pks_by_model[model], batch_size):
+            _delete(model._base_manager.filter(pk__in=pks), counts, dry_run)
+    _delete(Record.objects.filter(pk=record_id), counts, dry_run)
+
+
+class RecordQuerySet(m.QuerySet):
+
+    def newest_first(self):
+        """Order by creation, newest first, breaking ties by ID so that the order is total."""
+        return self.order_by('-created_on', '-id')
+
+    def older_than(self, created_on, id):
+        """
+        Filter to the Records that come after (`created_on`, `id`) in :meth:`newest_first`
+        order. Paginating with this (keyset pagination) costs the same for every page.
+        """
+        return self.filter(
+            m.Q(created_on__lt=created_on) | m.Q(created_on=created_on, id__lt=id)
+        )
+
+    def in_pool(self, scenario):
+        """
+        Filter to the unclaimed Records in `scenario`'s pool that are ready, or still to be
+        executed, with its current config.
+        """
+        return self.filter(
+            scenario=scenario,
+            pooled=True,
+            status__in=[Record.Status.NOT_READY, Record.Status.READY],
+            config_hash__in=['', config_hash(scenario.config)],
+        )
+
+    def stale_pool(self, scenario):
+        """
+        Filter to the Records in `scenario`'s pool that can never be claimed: those that failed,
+        and those that were executed with a config the scenario no longer has.
+        """
+        return self.filter(scenario=scenario, pooled=True).filter(
+            m.Q(status=Record.Status.FAILED)
+            | m.Q(status=Record.Status.READY) & ~m.Q(config_hash=config_hash(scenario.config))
+        )
+
+    def claim(self, scenario, user):
+        """
+        Hand one of the READY Records in `scenario`'s pool to `user`, or return None if there
+        are none. Rows are locked with ``SKIP LOCKED`` where the database supports it, so
+        concurrent claims never get the same Record, and don't wait for each other.
+        """
+        features = connections[self.db].features
+        skip_locked = {}
+        if getattr(features, 'has_select_for_update_skip_locked', False):
+            skip_locked['skip_locked'] = True
+        with transaction.atomic(using=self.db):
+            record = self.in_pool(scenario).filter(
+                status=Record.Status.READY
+            ).order_by('pk').select_for_update(**skip_locked).first()
+            if record is None:
+                return None
+            record.pooled = False
+            record.created_by = user
+            # The Record is new to the user, so it belongs at the top of the recent records.
+            record.created_on = timezone.now()
+            record.save(update_fields=['pooled', 'created_by', 'created_on', 'updated_on'])
+        return record
+
+    def purge(self, batch_size=1000, dry_run=False):
+        """
+        Delete these Records and the objects they created, one Record at a time, each in its own
+        transaction. Objects are deleted one model at a time, in reverse dependency order, with a
+        ``filter(pk__in=...)`` delete for every `batch_size` objects; deletes cascade as usual.
+
+        A Record whose objects can't be deleted because other rows protect them (e.g. a user it
+        created has since created a Record of their own) is skipped, and left as it was.
+
+        :return: a (counts, skipped) pair. `counts` is a Counter of the rows deleted, by model
+            label; on Django < 1.9, which doesn't report cascades, only the Records and the objects
+            they created are counted. `skipped` is a list of (Record ID, ProtectedError) pairs.
+            With `dry_run`, nothing is deleted (or skipped), and `counts` holds the Records and
+            the objects they created, without cascades.
+        """
+        counts, skipped = Counter(), []
+        record_ids = list(self.values_list('pk', flat=True))
+        for ids in chunks(record_ids, batch_size):
+            pks_by_record = defaultdict(lambda: defaultdict(set))
+            values = RecordedObject.objects.filter(record__in=ids).values_list(
+                'record_id', 'content_type_id', 'object_id'
+            )
+            for record_id, content_type_id, object_id in values:
+                pks_by_record[record_id][content_type_id].add(object_id)
+            for record_id in ids:
+                record_counts = Counter()
+                try:
+                    with transaction.atomic(using=self.db):
+                        _purge_record(
+                            record_id, pks_by_record[record_id], record_counts, batch_size, dry_run
+                        )
+                except m.ProtectedError as error:
+                    skipped.append((record_id, error))
+                else:
+                    counts.update(record_counts)
+        return counts, skipped
+
+    def for_object(self, obj):
+        """Filter to the Record that created `obj` (there is at most one)."""
+        return self.filter(
+            recorded_objects__content_type=ContentType.objects.get_for_model(obj),
+            recorded_objects__object_id=RecordedObject.object_id_for(obj.pk),
+        )
+
+    def for_objects(self, objects):
+        """
+        Return a dict mapping each of `objects` (a QuerySet, or any iterable of model instances)
+        that was created by one of these Records to that Record, using a single query.
+        """
+        objects = list(objects)
+        if not objects:
+            return {}
+        lookup = m.Q()
+        objects_by_key = {}
+        for obj in objects:
+            content_type = ContentType.objects.get_for_model(obj)
+            objects_by_key[content_type.pk, RecordedObject.object_id_for(obj.pk)] = obj
+        object_ids_by_content_type = defaultdict(list)
+        for content_type_id, object_id in objects_by_key:
+            object_ids_by_content_type[content_type_id].append(object_id)
+        for content_type_id, object_ids in object_ids_by_content_type.items():
+            lookup |= m.Q(content_type_id=content_type_id, object_id__in=object_ids)
+        recorded_objects = RecordedObject.objects.filter(lookup, record__in=self).select_related(
+            'record'
+        )
+        return {
+            objects_by_key[recorded.content_type_id, recorded.object_id]: recorded.record
+            for recorded in recorded_objects
+        }
+
 
 @python_2_unicode_compatible
 class Scenario(m.Model):
@@ -28,6 +232,17 @@ class Scenario(m.Model):
     The heart of a ``Scenario`` is the `config` attribute. `config` is a list of several fixtures,
     possibly with arguments, which are executed sequentially to create and modify objects in the
     database.
+
+    Each step of `config` is ``[func_name, kwargs]``, or ``[func_name, kwargs, options]``. A step's
+    options may give it a ``name`` (which defaults to `func_name`) and list the names of the
+    earlier steps it ``depends_on``; steps that don't list their dependencies depend on every
+    earlier step. With the ``step_threads`` setting, independent steps are executed concurrently::
+
+        [
+            ['warehouses', {'count': 3}, {'depends_on': []}],
+            ['customers', {'count': 50}, {'depends_on': []}],
+            ['orders', {}, {'depends_on': ['warehouses', 'customers']}],
+        ]
     """
 
     class Meta:
@@ -46,6 +261,15 @@ class Scenario(m.Model):
     status = enum.EnumField(Status, default=Status.ACTIVE)
     config = JSONField()
     description = m.TextField()
+    use_snapshot = m.BooleanField(
+        default=False,
+        help_text="Replay the rows created by the last successful execution of this config, instead"
+        " of executing its fixtures again."
+    )
+    pool_size = m.PositiveIntegerField(
+        default=0,
+        help_text="The number of Records to keep executed in advance, ready to be claimed."
+    )
     created_on = m.DateTimeField(auto_now_add=True)
     updated_on = m.DateTimeField(auto_now=True)
 
@@ -66,23 +290,78 @@ class Scenario(m.Model):
     def hard_delete(self, *args, **kwargs):
         super(Scenario, self).delete(*args, **kwargs)
 
-    def save(self, *args, **kwargs):
+    def clean(self):
+        # Show invalid configs next to the config field of forms, such as the admin's.
+        try:
+            self.validate_config()
+        except ValidationError as exc:
+            raise ValidationError({'config': exc.messages})
+
+    def validate_config(self):
+        """
+        Check that this Scenario's config can be compiled.
+
+        :raises: ValidationError
+        """
         try:
             manager.validate(self.config)
+        except StepFormatError as exc:
+            raise ValidationError("config {} is invalid: {}".format(self.config, exc))
         except ConfigurationError as exc:
             raise ValidationError("config {} contains unregistered function(s): {}".format(
                 self.config, ','.join(exc.unregistered_functions)
             ))
+        except StepDependencyError as exc:
+            raise ValidationError("config {} has invalid step dependencies: {}".format(
+                self.config, exc
+            ))
+        except StepArgumentError as exc:
+            raise ValidationError("config {} has invalid arguments: {}".format(self.config, exc))
+
+    def save(self, *args, **kwargs):
+        self.validate_config()
         super(Scenario, self).save(*args, **kwargs)
+        # Pooled Records executed with a previous config must never be claimed.
+        stale = Record.objects.stale_pool(self)
+        if stale.exists():
+            stale.purge()
+
+    def refill_pool(self):
+        """
+        Discard the Records in this scenario's pool that can't be claimed, then create and
+        dispatch enough new ones to bring the pool up to `pool_size`. Returns the new Records.
+        """
+        Record.objects.stale_pool(self).purge()
+        missing = self.pool_size - Record.objects.in_pool(self).count()
+        records = [Record.objects.create(scenario=self, pooled=True) for _ in range(missing)]
+        for record in records:
+            try:
+                record.dispatch()
+            except Exception:
+                # The Record has been marked as failed, and will be discarded next time.
+                logger.exception("Pooled record #%s failed", record.pk)
+        return records
 
 
 class Record(m.Model):
     """
     A record of setting up, and possibly executing, a particular :class:`Scenario`.
+
+    Records can also be executed in advance, to keep a scenario's pool stocked (see
+    ``Scenario.pool_size``); testers then claim them with ``Record.objects.claim()``.
     """
 
     class Meta:
         app_label = 'quade'
+        # Support listing records newest first, optionally filtered by one of these fields.
+        index_together = [
+            ('created_on', 'id'),
+            ('status', 'created_on', 'id'),
+            ('scenario', 'created_on', 'id'),
+            ('created_by', 'created_on', 'id'),
+            # Support counting and claiming a scenario's pooled records.
+            ('scenario', 'pooled', 'status'),
+        ]
 
     class Status(enum.Enum):
         FAILED = -10
@@ -91,6 +370,8 @@ class Record(m.Model):
         IN_PROGRESS = 10
         DONE = 20
 
+    objects = RecordQuerySet.as_manager()
+
     scenario = m.ForeignKey(Scenario, on_delete=m.PROTECT)
     instructions = m.TextField(
         blank=True,
@@ -99,32 +380,226 @@ class Record(m.Model):
         " information."
     )
     status = FSMIntegerField(choices=Status.choices, default=Status.NOT_READY)
-    created_by = m.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=m.PROTECT)
+    config_hash = m.CharField(
+        max_length=40,
+        blank=True,
+        help_text="A hash of the scenario's config at the time this record was executed."
+    )
+    total_steps = m.PositiveIntegerField(
+        null=True,
+        help_text="The number of steps in the config being executed."
+    )
+    completed_steps = m.PositiveIntegerField(
+        default=0,
+        help_text="The number of steps that have finished executing so far."
+    )
+    pooled = m.BooleanField(
+        default=False,
+        help_text="Whether this Record was executed in advance, and is waiting to be claimed."
+    )
+    # Null while the Record is waiting in its scenario's pool.
+    created_by = m.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name='+', null=True, on_delete=m.PROTECT
+    )
     created_on = m.DateTimeField(auto_now_add=True)
     updated_on = m.DateTimeField(auto_now=True)
 
+    # The number of objects the last execution of this instance created, for the metrics.
+    objects_captured = None
+
     def execute_test(self):
         """
         Public method for attempting to execute a test scenario. Exceptions put the record in the
         FAILED state and re-raise.
+
+        :raises: AsyncStepError, leaving the record as it was, if the scenario has ``async def``
+            steps and this thread is running an event loop; await ``quade.aio.execute_record``
+            there instead.
         """
+        if event_loop_running():
+            try:
+                plan = manager.compile(self.scenario.config)
+            except Exception:
+                plan = None  # Compiled again below, failing the record.
+            if plan is not None and plan.is_async:
+                raise AsyncStepError(
+                    "Record #{} has async steps, and this thread is running an event loop; await"
+                    " quade.aio.execute_record() instead.".format(self.pk)
+                )
+        started = timezone.now()
         try:
             self._execute()
         except Exception as ex:
             self._fail(exception=ex)
             raise
+        finally:
+            metrics.observe_execution(self, started)
+
+    def dispatch(self):
+        """
+        Execute this record: on a Celery worker if ``use_celery`` is enabled, or else right away
+        (in which case exceptions are re-raised, as with :meth:`execute_test`).
+
+        The Celery task is only sent once the current transaction (if any) commits, so that the
+        worker can see the record; Django 1.8 can't wait, and sends it right away.
+        """
+        if settings.QUADE.use_celery:
+            from .tasks import execute_test_task
+            if hasattr(transaction, 'on_commit'):
+                transaction.on_commit(lambda: execute_test_task.delay(self.id))
+            else:
+                execute_test_task.delay(self.id)
+        else:
+            self.execute_test()
+
+    @property
+    def clonable(self):
+        """Whether this Record was executed successfully, and so can be cloned."""
+        return self.status in [self.Status.READY, self.Status.IN_PROGRESS, self.Status.DONE]
+
+    def clone(self, created_by):
+        """
+        Create a READY copy of this Record for `created_by`, by copying the rows it created with
+        ``bulk_create``, model by model, instead of executing its scenario again. Unique fields are
+        rewritten according to the ``unique_transforms`` setting.
+
+        :raises: CopyError if this Record wasn't executed successfully, or its rows can't be copied.
+        """
+        if not self.clonable:
+            raise CopyError("Record #{} wasn't executed successfully.".format(self.pk))
+        models = recorded_models(self)
+        copier = RowCopier(
+            models, transform=unique_transform(settings.QUADE.unique_transforms),
+            text=self.instructions,
+        )
+        with transaction.atomic():
+            clone = Record.objects.create(
+                scenario=self.scenario,
+                status=self.Status.READY,
+                config_hash=self.config_hash,
+                created_by=created_by,
+            )
+            for model, pks in models.items():
+                for rows in chunks(serialize_rows(model, pks), copier.batch_size):
+                    clone.copy_rows(copier, model, rows)
+            copier.finish()
+            clone.instructions = copier.rewrite_text(self.instructions)
+            clone.save(update_fields=['instructions', 'updated_on'])
+        return clone
+
+    def copy_rows(self, copier, model, rows):
+        """
+        Insert copies of serialized `rows` of `model` with `copier` (a
+        ``quade.copying.RowCopier``), and record the copies as objects this Record created.
+        """
+        objs = copier.copy(model, rows)
+        content_type = ContentType.objects.get_for_model(model)
+        RecordedObject.objects.bulk_create([
+            RecordedObject(record=self, content_type=content_type, object_id=obj.pk)
+            for obj in objs
+        ], batch_size=copier.batch_size)
 
-    @transition(status, source=Status.NOT_READY, target=Status.READY, save=True)
     def _execute(self):
-        with connect_qa_object_receiver(self):
-            instructions = manager.execute(self.scenario.config)
+        plan = self._begin()
+        if plan is not None:
+            self._execute_plan(plan)
+        self._ready()
+
+    def _begin(self):
+        """
+        Compile the scenario's config, and restore its snapshot if it has a current one. Return the
+        Plan to execute, or None if the snapshot was restored.
+        """
+        config = self.scenario.config
+        # Compiling the config validates it before any work is done in the database.
+        plan = manager.compile(config)
+        self.config_hash = plan.config_hash
+        if self.scenario.use_snapshot:
+            snapshot = Snapshot.objects.current(config)
+            if snapshot is not None:
+                try:
+                    self.instructions = snapshot.restore(self)
+                    self.objects_captured = len(snapshot.rows)
+                    return None
+                except (CopyError, IntegrityError) as exc:
+                    logger.warning("Discarding snapshot #%s: %s", snapshot.pk, exc)
+                    snapshot.delete()
+        self.total_steps, self.completed_steps = len(plan.steps), 0
+        Record.objects.filter(pk=self.pk).update(
+            total_steps=self.total_steps, completed_steps=self.completed_steps
+        )
+        return plan
+
+    def _monitors(self):
+        monitors = []
+        telemetry = StepTelemetry() if settings.QUADE.collect_telemetry else None
+        # The recorder must be the outermost monitor, so that it sees the step's measurements.
+        monitors.append(StepRecorder(self, telemetry))
+        if telemetry is not None:
+            monitors.append(telemetry)
+        return monitors
+
+    def _execute_plan(self, plan):
+        monitors = self._monitors()
+        if settings.QUADE.atomic_execution:
+            if plan.is_async:
+                raise AsyncStepError(
+                    "Scenario '{}' has async steps, which can't be executed in one transaction"
+                    " (atomic_execution).".format(self.scenario.slug)
+                )
+            # Steps must all use this thread's connection to be part of the transaction.
+            with transaction.atomic(), capture_qa_objects(self) as capture:
+                instructions = manager.execute(plan, monitors, threads=1)
+        else:
+            with capture_qa_objects(self) as capture:
+                if plan.is_async:
+                    from .aio import execute_async, run_coroutine
+                    instructions = run_coroutine(execute_async(plan, monitors))
+                else:
+                    instructions = manager.execute(plan, monitors)
+        self._executed(instructions, capture.count)
+
+    def _executed(self, instructions, objects_captured):
         self.instructions = instructions
+        self.objects_captured = objects_captured
+        if self.scenario.use_snapshot:
+            Snapshot.objects.take(self)
+
+    @transition(status, source=Status.NOT_READY, target=Status.READY, save=True)
+    def _ready(self):
+        pass
 
     @transition(status, source=Status.NOT_READY, target=Status.FAILED, save=True)
     def _fail(self, exception):
         self.instructions = repr(exception)
 
 
+@python_2_unicode_compatible
+class RecordStep(m.Model):
+    """
+    One step of executing a :class:`Record`, saved as soon as the step finishes. `output` is null
+    if the step raised. Measurements are only taken when ``collect_telemetry`` is enabled, and are
+    otherwise left null.
+    """
+
+    class Meta:
+        app_label = 'quade'
+        ordering = ['record', 'index']
+        unique_together = [('record', 'index')]
+
+    record = m.ForeignKey(Record, related_name='steps', on_delete=m.CASCADE)
+    index = m.PositiveIntegerField()
+    name = m.CharField(max_length=255)
+    output = m.TextField(null=True, blank=True)
+    duration = m.FloatField(null=True, help_text="Wall-clock time, in seconds.")
+    query_count = m.PositiveIntegerField(null=True)
+    objects_captured = m.PositiveIntegerField(null=True)
+    memory_peak = m.BigIntegerField(null=True, help_text="Peak memory allocated, in bytes.")
+
+    def __str__(self):
+        return "Step {} of Record #{}: {}".format(self.index, self.record_id, self.name)
+
+
 @python_2_unicode_compatible
 class RecordedObject(m.Model):
     """
@@ -134,11 +609,163 @@ class RecordedObject(m.Model):
 
     class Meta:
         app_label = 'quade'
+        index_together = [('content_type', 'object_id')]
 
     content_type = m.ForeignKey(ContentType, on_delete=m.CASCADE)
-    object_id = m.PositiveIntegerField()
+    # Text, so that objects with any kind of primary key (integer, bigint, UUID, string) can be
+    # recorded. Use object_id_for() to look up an object by its primary key.
+    object_id = m.CharField(max_length=255)
     object = GenericForeignKey('content_type', 'object_id')
     record = m.ForeignKey(Record, related_name='recorded_objects', on_delete=m.CASCADE)
 
     def __str__(self):
         return "RecordedObject #{}: {}".format(self.pk, self.object)
+
+    @staticmethod
+    def object_id_for(pk):
+        """Return the `object_id` that an object with primary key `pk` is recorded under."""
+        return RecordedObject._meta.get_field('object_id').get_prep_value(pk)
+
+
+class SnapshotManager(m.QuerySet):
+
+    def current(self, config):
+        """
+        Return the Snapshot for `config` that was taken with the current code of its fixtures, or
+        None.
+        """
+        return self.filter(
+            config_hash=config_hash(config), code_hash=manager.code_hash(config)
+        ).first()
+
+    def take(self, record):
+        """
+        Save the rows that `record` created as the Snapshot for its config, replacing any previous
+        Snapshot of that config. Returns None if the rows can't be copied.
+        """
+        config = record.scenario.config
+        try:
+            rows = [
+                row
+                for model, pks in recorded_models(record).items()
+                for row in serialize_rows(model, pks)
+            ]
+        except CopyError as exc:
+            logger.warning("Not taking a snapshot of record #%s: %s", record.pk, exc)
+            return None
+        hashed_config = config_hash(config)
+        try:
+            with transaction.atomic():
+                self.filter(config_hash=hashed_config).delete()
+                return self.create(
+                    config_hash=hashed_config,
+                    code_hash=manager.code_hash(config),
+                    record=record,
+                    instructions=record.instructions,
+                    rows=rows,
+                )
+        except IntegrityError:  # Another Record with the same config took one first.
+            return None
+
+
+class Snapshot(m.Model):
+    """
+    The rows created by a successful execution of a :class:`Scenario` with ``use_snapshot``
+    enabled. Later :class:`Records <Record>` with the same config replay these rows, instead of
+    executing the fixtures again, until the config or the code of one of its fixtures changes.
+    """
+
+    class Meta:
+        app_label = 'quade'
+        unique_together = [('config_hash', 'code_hash')]
+
+    objects = SnapshotManager.as_manager()
+
+    config_hash = m.CharField(max_length=40)
+    code_hash = m.CharField(max_length=40)
+    record = m.ForeignKey(Record, null=True, related_name='+', on_delete=m.SET_NULL)
+    instructions = m.TextField(blank=True, null=True)
+    rows = JSONField()
+    created_on = m.DateTimeField(auto_now_add=True)
+
+    def restore(self, record):
+        """
+        Insert copies of this Snapshot's rows, associate them with `record`, and return the
+        instructions, rewritten to refer to the copies.
+        """
+        models = [
+            apps.get_model(label) for label, _ in groupby(self.rows, lambda row: row['model'])
+        ]
+        copier = RowCopier(
+            models, transform=unique_transform(settings.QUADE.unique_transforms),
+            text=self.instructions,
+        )
+        with transaction.atomic():
+            for model, (_, rows) in zip(models, groupby(self.rows, lambda row: row['model'])):
+                record.copy_rows(copier, model, rows)
+            copier.finish()
+        return copier.rewrite_text(self.instructions)
+
+
+class SharedFixtureQuerySet(m.QuerySet):
+
+    def call(self, func, step):
+        """
+        Return the shared output of calling `func`, a fixture registered with ``shared=True``,
+        with `step`'s kwargs, calling it only if there is no current output.
+        """
+        kwargs_hash, code_hash = config_hash(step.kwargs), source_hash(func)
+        now = timezone.now()
+        # Shared objects belong to no Record in particular, so none of them capture them.
+        with activate_capture(None):
+            shared = self.filter(func_name=step.func_name, kwargs_hash=kwargs_hash).first()
+            if shared is not None and shared.is_current(code_hash, now):
+                return shared.output
+            output = text(func(**step.kwargs))
+            try:
+                with transaction.atomic():
+                    self.filter(func_name=step.func_name, kwargs_hash=kwargs_hash).delete()
+                    self.create(
+                        func_name=step.func_name,
+                        kwargs_hash=kwargs_hash,
+                        code_hash=code_hash,
+                        output=output,
+                        expires_on=now + timedelta(seconds=func.quade_ttl)
+                        if func.quade_ttl is not None else None,
+                    )
+            except IntegrityError:  # Another execution shared its output first.
+                pass
+        return output
+
+
+@python_2_unicode_compatible
+class SharedFixture(m.Model):
+    """
+    The output of a fixture registered with ``shared=True``, for one set of kwargs. Later steps
+    that call the fixture with the same kwargs return this output instead of calling it again, and
+    so reuse the objects it created, until it expires, the fixture's code changes, or it is deleted
+    (e.g. with the ``clear_shared_fixtures`` command).
+
+    The objects that shared fixtures create aren't recorded by any :class:`Record`, since every
+    Record that reuses them depends on them, so ``purge_records`` doesn't delete them.
+    """
+
+    class Meta:
+        app_label = 'quade'
+        unique_together = [('func_name', 'kwargs_hash')]
+
+    objects = SharedFixtureQuerySet.as_manager()
+
+    func_name = m.CharField(max_length=255)
+    kwargs_hash = m.CharField(max_length=40)
+    code_hash = m.CharField(max_length=40)
+    output = m.TextField(blank=True)
+    created_on = m.DateTimeField(auto_now_add=True)
+    expires_on = m.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "Shared output of {} #{}".format(self.func_name, self.pk)
+
+    def is_current(self, code_hash, now):
+        """Whether this output was made by the current code of its fixture, and hasn't expired."""
+        return self.code_hash == code_hash and (self.expires_on is None or self.expires_on > now)
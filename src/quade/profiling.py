@@ -0,0 +1,126 @@
+"""
+Profiling a Scenario without leaving data behind: its config is executed inside transactions (one
+per database) that are always rolled back, under ``cProfile``, and the SQL it runs is logged so
+that queries that are repeated with the same parameters can be reported.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import Counter
+import cProfile
+import pstats
+from timeit import default_timer
+
+from django.db import connections, transaction
+from django.utils.six import StringIO
+
+from .managers import AsyncStepError, manager
+from .receivers import activate_capture
+from .telemetry import QueryCounter, StepTelemetry, nested
+
+
+class _RollBack(Exception):
+    """Raised to roll back a dry run once it has finished."""
+
+
+class QueryLog(QueryCounter):
+    """A :class:`.QueryCounter` that also keeps the SQL and parameters of every query."""
+
+    def __init__(self):
+        super(QueryLog, self).__init__()
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, repr(params)))
+        return super(QueryLog, self).__call__(execute, sql, params, many, context)
+
+    def duplicates(self):
+        """
+        Return ((sql, params), count) pairs for the queries that were run more than once with the
+        same parameters, most repeated first.
+        """
+        return [(query, count) for query, count in Counter(self.queries).most_common() if count > 1]
+
+
+class ScenarioProfile(object):
+    """The results of :func:`profile_scenario`."""
+
+    def __init__(self, scenario, duration, output, stats, steps, queries):
+        self.scenario = scenario
+        self.duration = duration
+        self.output = output
+        self.stats = stats
+        self.steps = steps
+        self.queries = queries
+
+    def report(self, top=20):
+        """Return the profile as lines of text, listing the `top` functions by cumulative time."""
+        duplicates = self.queries.duplicates()
+        lines = ["Profiled scenario '{}' in {:.3f}s (rolled back).".format(
+            self.scenario.slug, self.duration
+        )]
+        if self.queries.count is None:
+            lines.append("Queries: not counted on this version of Django.")
+        else:
+            lines.append("Queries: {}, of which {} repeated with the same parameters.".format(
+                self.queries.count, sum(count - 1 for _, count in duplicates)
+            ))
+        lines.extend(["", "Steps:"])
+        for step in self.steps:
+            line = "- {index}: {name}: {duration:.3f}s, {query_count} queries".format(**step)
+            if step['memory_peak'] is not None:
+                line += ", {:.1f} KiB peak".format(step['memory_peak'] / 1024.0)
+            lines.append(line)
+        if duplicates:
+            lines.extend(["", "Duplicated queries:"])
+            for (sql, params), count in duplicates[:top]:
+                lines.append("- {}x {} {}".format(count, sql, params))
+        stream = StringIO()
+        self.stats.stream = stream
+        self.stats.sort_stats('cumulative').print_stats(top)
+        lines.extend(["", "Top {} functions by cumulative time:".format(top)])
+        lines.extend(stream.getvalue().strip('\n').split('\n'))
+        return lines
+
+
+def profile_scenario(scenario, trace_memory=False):
+    """
+    Execute `scenario`'s config in a dry run that is always rolled back, and return a
+    :class:`ScenarioProfile`. Steps are executed one at a time, in this thread, so that
+    ``cProfile`` sees all of them; the objects they create aren't recorded.
+
+    Exceptions raised by the steps propagate, after the dry run has been rolled back.
+
+    :raises: AsyncStepError if the scenario has ``async def`` steps, whose ORM work is done on
+        other threads and so couldn't be rolled back.
+    """
+    plan = manager.compile(scenario.config)
+    if plan.is_async:
+        raise AsyncStepError(
+            "Scenario '{}' has async steps, which can't be profiled in a dry run.".format(
+                scenario.slug
+            )
+        )
+    telemetry = StepTelemetry(trace_memory=trace_memory)
+    queries = QueryLog()
+    profiler = cProfile.Profile()
+    atomics = [transaction.atomic(using=alias) for alias in connections]
+    start = default_timer()
+    try:
+        with nested(atomics), queries.counting(), activate_capture(None):
+            profiler.enable()
+            try:
+                output = manager.execute(plan, monitors=[telemetry], threads=1)
+            finally:
+                profiler.disable()
+            raise _RollBack
+    except _RollBack:
+        pass
+    duration = default_timer() - start
+    return ScenarioProfile(
+        scenario=scenario,
+        duration=duration,
+        output=output,
+        stats=pstats.Stats(profiler),
+        steps=[telemetry.measurements[index] for index in sorted(telemetry.measurements)],
+        queries=queries,
+    )
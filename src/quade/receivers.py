@@ -1,29 +1,213 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 from contextlib import contextmanager
-from functools import partial
+import threading
+import weakref
 
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 
+try:
+    from contextvars import ContextVar
+except ImportError:  # pragma: no cover
+    ContextVar = None
+try:
+    import asyncio
+except ImportError:  # pragma: no cover
+    asyncio = None
 
-def associate_instance_with_qa_record(record, instance, created, **kwargs):
+
+class _ThreadLocalVar(threading.local):
+    """
+    A minimal stand-in for contextvars.ContextVar on Pythons that lack it (before 3.7). Values are
+    scoped to the current thread (or greenlet, when gevent has patched the threading module), and
+    to the current asyncio task, if any. Unlike with ContextVar, a new task doesn't inherit values
+    set in the task that created it; it sees the thread's value until it sets its own.
+    """
+
+    def __init__(self, name, default):
+        self.name = name
+        self.value = default
+        self.task_values = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def _current_task():
+        if asyncio is None:  # pragma: no cover
+            return None
+        loop = asyncio.events._get_running_loop()
+        return asyncio.Task.current_task(loop) if loop is not None else None
+
+    def get(self):
+        task = self._current_task()
+        if task is not None and task in self.task_values:
+            return self.task_values[task]
+        return self.value
+
+    def set(self, value):
+        token, task = self.get(), self._current_task()
+        if task is not None:
+            self.task_values[task] = value
+        else:
+            self.value = value
+        return token
+
+    def reset(self, token):
+        task = self._current_task()
+        if task is not None:
+            self.task_values[task] = token
+        else:
+            self.value = token
+
+
+if ContextVar is not None:
+    _active_captures = ContextVar('quade_active_captures', default=())
+else:  # pragma: no cover
+    _active_captures = _ThreadLocalVar('quade_active_captures', default=())
+
+
+class RecordedObjectWriter(object):
+    """
+    Saves a RecordedObject for each object created while a Record is executing, as soon as the
+    object is created.
+    """
+
+    def __init__(self, record):
+        self.record = record
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, instance):
+        from .models import RecordedObject
+        RecordedObject.objects.create(record=self.record, object=instance)
+        with self._lock:
+            self.count += 1
+
+    def flush(self):
+        pass
+
+
+class RecordedObjectBuffer(object):
+    """
+    Collects the objects created while a Record is executing, and saves them as RecordedObjects in
+    batches instead of one INSERT per object. Safe to share between the threads executing the
+    steps of a scenario.
+    """
+
+    def __init__(self, record, batch_size):
+        self.record = record
+        self.batch_size = batch_size
+        self._pending = []
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, instance):
+        content_type = ContentType.objects.get_for_model(instance)
+        with self._lock:
+            self._pending.append((content_type.pk, instance.pk))
+            self.count += 1
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        from .models import RecordedObject
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        RecordedObject.objects.bulk_create(
+            [
+                RecordedObject(record=self.record, content_type_id=content_type_id, object_id=pk)
+                for content_type_id, pk in pending
+            ],
+            batch_size=self.batch_size,
+        )
+
+    def discard(self):
+        """Forget the objects added so far, whose rows were rolled back."""
+        with self._lock:
+            self._pending = []
+            self.count = 0
+
+
+def active_capture():
+    """
+    Return the capture (a RecordedObjectWriter or RecordedObjectBuffer) that objects created in the
+    current thread or context should be added to, or None if no Record is executing there.
+    """
+    captures = _active_captures.get()
+    return captures[-1] if captures else None
+
+
+@contextmanager
+def activate_capture(capture):
     """
-    A signal receiver that's meant to catch a post-save signal and associate a created model
-    instance with the Record that generated it. Can only be used as a signal when the `record`
-    argument is fixed (via functools.partial).
+    A context manager that routes objects created in the current thread or context to `capture`.
+    Activations nest; the innermost capture wins.
     """
+    token = _active_captures.set(_active_captures.get() + (capture,))
+    try:
+        yield capture
+    finally:
+        _active_captures.reset(token)
+
+
+def associate_instance_with_qa_record(sender, instance, created, **kwargs):
+    """
+    A post-save signal receiver that associates a created model instance with the Record executing
+    in the current thread or context, if any. It is connected once, when the app is ready; objects
+    saved by other threads, or by other Records executing concurrently, are never mixed up.
+    """
+    if not created:
+        return
+    capture = active_capture()
+    if capture is None:
+        return
     from .models import RecordedObject
-    if created and not isinstance(instance, RecordedObject):  # Avoid infinite recursion
-        RecordedObject.objects.create(record=record, object=instance)
+    if not isinstance(instance, RecordedObject):  # Avoid infinite recursion
+        capture.add(instance)
+
+
+@contextmanager
+def capture_step():
+    """
+    A context manager for executing one step of a scenario. If the active capture buffers objects,
+    the objects the step creates are buffered separately, in a buffer that is yielded (or else
+    None), and saved when the step exits, even if it raised: a monitor can raise after the step's
+    transaction committed. If the transaction was rolled back instead, the caller must discard the
+    buffer, so that rows that no longer exist aren't recorded. Full batches are saved as the step
+    goes, in its transaction, so they are rolled back with it.
+    """
+    capture = active_capture()
+    if not isinstance(capture, RecordedObjectBuffer):
+        yield None
+        return
+    step_capture = RecordedObjectBuffer(capture.record, capture.batch_size)
+    try:
+        with activate_capture(step_capture):
+            yield step_capture
+    finally:
+        step_capture.flush()
+        with capture._lock:
+            capture.count += step_capture.count
 
 
 @contextmanager
-def connect_qa_object_receiver(record):
+def capture_qa_objects(record):
     """
-    A context manager that connects the post-save signal to the associate_instance_with_qa_record
-    receiver, and ensures the receiver is disconnected on exit.
+    A context manager that associates the objects created in the current thread or context with
+    `record` until it exits.
+
+    If ``buffer_recorded_objects`` is enabled, created objects are buffered, and any remaining
+    buffered objects are saved on exit. Objects created by steps are buffered by step (see
+    :func:`capture_step`), so those of steps whose transactions roll back are never saved.
     """
-    callback = partial(associate_instance_with_qa_record, record=record)
-    post_save.connect(callback)
-    yield callback
-    post_save.disconnect(callback)
+    if settings.QUADE.buffer_recorded_objects:
+        capture = RecordedObjectBuffer(record, settings.QUADE.recorded_objects_batch_size)
+    else:
+        capture = RecordedObjectWriter(record)
+    try:
+        with activate_capture(capture):
+            yield capture
+    finally:
+        capture.flush()
@@ -6,6 +6,7 @@ from inspect import cleandoc
 from attr import attrib, attrs
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
 from django.utils import six
 from six import with_metaclass
 
@@ -91,6 +92,33 @@ def validate_boolean(val):
         raise TypeError
 
 
+def validate_optional_string(val):
+    if val is None or isinstance(val, six.string_types):
+        return val
+    raise TypeError
+
+
+def validate_unique_transforms(val):
+    if isinstance(val, dict) and all(
+        isinstance(key, six.string_types) and callable(transform) for key, transform in val.items()
+    ):
+        return {key.lower(): transform for key, transform in val.items()}
+    raise TypeError
+
+
+def validate_query_budget_action(val):
+    if val in ('warn', 'fail'):
+        return val
+    raise TypeError
+
+
+def validate_positive_integer(val):
+    if isinstance(val, six.integer_types) and not isinstance(val, bool) and val > 0:
+        return val
+    else:
+        raise TypeError
+
+
 class SettingsMeta(type):
 
     def __new__(cls, name, bases, dct):
@@ -100,6 +128,18 @@ class SettingsMeta(type):
             default='quade.fixtures',
             description="""A dotted path to the location of your fixtures.""",
         )
+        obj.define_setting(
+            name='fixtures_manifest',
+            default=None,
+            description="""The path of a JSON file listing the names and signatures of the
+            registered fixtures, or None.
+
+            The fixtures are only imported when a scenario is validated or executed. The
+            ``list_fixtures`` command reads this file instead of importing them, if it exists; run
+            ``list_fixtures --write-manifest`` to write it (e.g. when deploying).
+            """,
+            validator=validate_optional_string,
+        )
         obj.define_setting(
             name='allowed_envs',
             default=DebugEnvs,
@@ -143,15 +183,155 @@ class SettingsMeta(type):
             """,
             validator=validate_boolean,
         )
+        obj.define_setting(
+            name='buffer_recorded_objects',
+            default=False,
+            description="""Whether to buffer the objects created while executing a Record in memory
+            instead of saving a :class:`.RecordedObject` for each one as soon as it is created.
+
+            Each step's objects are buffered separately, and written with ``bulk_create`` when the
+            step finishes, or whenever its buffer reaches ``recorded_objects_batch_size``. If the
+            step's transaction rolls back, its buffer is discarded along with the objects; if the
+            step raises after its transaction committed (e.g. from a monitor), they are still
+            written. This avoids doubling the number of INSERTs issued by scenarios that create
+            many objects.
+            """,
+            validator=validate_boolean,
+        )
+        obj.define_setting(
+            name='recorded_objects_batch_size',
+            default=500,
+            description="""The number of buffered :class:`RecordedObjects <.RecordedObject>` to
+            write at a time when ``buffer_recorded_objects`` is enabled.""",
+            validator=validate_positive_integer,
+        )
+        obj.define_setting(
+            name='step_threads',
+            default=1,
+            description="""The number of threads used to execute the steps of a scenario.
+
+            With more than one thread, steps whose dependencies have finished are executed
+            concurrently, each thread using its own database connection. Steps depend on every
+            earlier step unless they list their dependencies; see :class:`.Scenario`.
+            """,
+            validator=validate_positive_integer,
+        )
+        obj.define_setting(
+            name='collect_telemetry',
+            default=False,
+            description="""Whether to measure each step of a scenario as it executes: how long it
+            took, how many SQL queries it ran, how many objects it created, and the peak memory it
+            allocated. Measurements are saved as :class:`RecordSteps <.RecordStep>`.
+
+            Query counts require Django 2.0 or later. Peak memory is measured with
+            :mod:`tracemalloc`, which slows execution down noticeably, and is process-wide, so
+            it overlaps between steps that run concurrently.
+            """,
+            validator=validate_boolean,
+        )
+        obj.define_setting(
+            name='query_budget_action',
+            default='warn',
+            description="""What to do when a step runs more SQL queries than the ``query_budget``
+            its fixture was registered with: ``'warn'`` logs a warning, and ``'fail'`` raises
+            ``quade.telemetry.QueryBudgetExceeded`` from the first query over budget, which rolls
+            back what the step created and fails the Record.
+
+            Either way, the message lists the SQL the step ran repeatedly (with lists of
+            placeholders collapsed), and where in your code the first repeat came from; repeated
+            queries are often a sign of an N+1 pattern, such as saving related objects one at a
+            time. Queries are only counted on Django 2.0 or later.
+            """,
+            validator=validate_query_budget_action,
+        )
+        obj.define_setting(
+            name='atomic_execution',
+            default=False,
+            description="""Whether to execute all the steps of a Record in one transaction, in which
+            each fixture's own transaction becomes a savepoint.
+
+            This saves a commit per step, and if a step fails, everything the Record created so
+            far is rolled back, along with its :class:`RecordedObjects <.RecordedObject>`. Steps
+            are executed one at a time, regardless of ``step_threads``, and the Record's steps
+            and progress aren't visible to other connections (such as the main page) until every
+            step has finished. Scenarios with ``async def`` fixtures fail in this mode, as their
+            ORM work is done on other threads, outside the transaction.
+            """,
+            validator=validate_boolean,
+        )
+        obj.define_setting(
+            name='register_admin',
+            default=True,
+            description="""Whether to register ``quade.admin.ScenarioAdmin`` with the Django admin
+            site, which it isn't if a ModelAdmin is already registered for :class:`.Scenario`.
+
+            Disable this if your project registers its own ModelAdmin for Scenario from an app
+            that comes after Quade in ``INSTALLED_APPS``, which would otherwise raise
+            ``AlreadyRegistered``; you can subclass ``ScenarioAdmin`` to keep its actions.
+            """,
+            validator=validate_boolean,
+        )
+        obj.define_setting(
+            name='unique_transforms',
+            default={},
+            description="""How to rewrite the values of unique fields when the rows a Record created
+            are copied, by cloning the Record or replaying a snapshot.
+
+            A dict mapping ``'app_label.model_name.field_name'`` to a callable that accepts the
+            field, the original value and a short random token, and returns the new value. Unique
+            fields that aren't listed are rewritten by ``quade.copying.rewrite_unique_value``.
+            """,
+            validator=validate_unique_transforms,
+        )
+        obj.define_setting(
+            name='cache_alias',
+            default=None,
+            description="""The alias of a cache in Django's ``CACHES`` setting to cache the main
+            page's scenario choices and table of recent Records in, or None to disable caching.
+
+            Cached values are invalidated whenever a :class:`.Scenario`, :class:`.Record` or
+            :class:`.RecordStep` is saved or deleted. The step counters of executing Records are
+            updated without saving them, so they can be out of date on the page until the cached
+            table expires after the cache's ``TIMEOUT`` (the page follows executing Records live,
+            regardless).
+            """,
+            validator=validate_optional_string,
+        )
+        obj.define_setting(
+            name='metrics_dir',
+            default=None,
+            description="""The path of a directory in which each process keeps the metrics served by
+            ``quade.views.MetricsView`` in a memory-mapped file, so that the view reports the
+            executions of every process (including Celery workers) on the host, or None to keep
+            metrics in each process's memory.
+
+            The directory must be writable by all of those processes, and should be emptied when
+            they are restarted, as files are named after process IDs.
+            """,
+            validator=validate_optional_string,
+        )
         return obj
 
 
+# Incremented whenever Django's settings are changed, e.g. by override_settings.
+_django_settings_version = 0
+
+
+def _django_settings_changed(**kwargs):
+    global _django_settings_version
+    _django_settings_version += 1
+
+
+setting_changed.connect(_django_settings_changed)
+
+
 class Settings(with_metaclass(SettingsMeta)):
 
-    _WHITELISTED_PROPERTIES = ['_construction_complete']
+    _WHITELISTED_PROPERTIES = ['_construction_complete', '_allowed']
 
     def __init__(self, **kwargs):
         self._construction_complete = False
+        self._allowed = None
         for setting in all_settings.values():
             val = kwargs.pop(setting.name, setting.default)
             if setting.validator:
@@ -175,7 +355,13 @@ class Settings(with_metaclass(SettingsMeta)):
 
     @property
     def allowed(self):
-        """Based on the settings, determine if scenarios are allowed to run on this environment."""
+        """
+        Based on the settings, determine if scenarios are allowed to run on this environment.
+
+        The result is remembered until Django's settings change (which only happens in tests).
+        """
+        if self._allowed is not None and self._allowed[0] == _django_settings_version:
+            return self._allowed[1]
         if self.allowed_envs in [AllEnvs, DebugEnvs]:
             func = self.allowed_envs.func
         elif callable(self.allowed_envs):
@@ -185,10 +371,9 @@ class Settings(with_metaclass(SettingsMeta)):
         elif isinstance(self.allowed_envs, Iterable):  # pragma: no branch
             def func(s): return s.ENV in self.allowed_envs
 
-        if func(settings):
-            return True
-        else:
-            return False
+        allowed = bool(func(settings))
+        self._allowed = (_django_settings_version, allowed)
+        return allowed
 
     def __setattr__(self, key, value):
         if key in self._WHITELISTED_PROPERTIES:
@@ -2,10 +2,20 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 from celery import shared_task
 
-from .models import Record
+from .models import Record, Scenario
 
 
 @shared_task
 def execute_test_task(record_id):
     record = Record.objects.get(id=record_id)
     record.execute_test()
+
+
+@shared_task
+def refill_pool_task(scenario_id):
+    Scenario.objects.get(id=scenario_id).refill_pool()
+
+
+@shared_task
+def refill_pools_task():
+    Scenario.objects.refill_pools()
@@ -0,0 +1,318 @@
+"""
+Monitors for scenario execution, passed to :meth:`.FixtureManager.execute`: saving each step's
+output as it finishes, (when the ``collect_telemetry`` setting is enabled) per-step
+measurements of wall time, SQL queries, captured objects and peak memory, and enforcing the query
+budgets of fixtures registered with one.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from builtins import str as text
+from collections import Counter
+from contextlib import contextmanager
+import logging
+import os
+import re
+import sysconfig
+import threading
+from timeit import default_timer
+import traceback
+
+from django.conf import settings
+from django.db import connections, models as m
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def nested(context_managers):
+    """Enter each of `context_managers` in turn, and exit them in reverse order."""
+    if not context_managers:
+        yield
+        return
+    with context_managers[0]:
+        with nested(context_managers[1:]):
+            yield
+
+
+class QueryCounter(object):
+    """
+    Counts the SQL queries run through the current thread's database connections, using
+    ``connection.execute_wrapper`` (Django 2.0+). On older versions of Django, `count` stays None.
+    """
+
+    def __init__(self):
+        self.count = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def counting(self):
+        databases = list(connections.all())
+        if not all(hasattr(connection, 'execute_wrapper') for connection in databases):
+            yield self
+            return
+        self.count = 0
+        with nested([connection.execute_wrapper(self) for connection in databases]):
+            yield self
+
+
+class CountingCapture(object):
+    """Counts the objects captured during a step, passing them on to the Record's capture."""
+
+    def __init__(self, capture):
+        self.capture = capture
+        self.count = 0
+
+    def add(self, instance):
+        self.count += 1
+        if self.capture is not None:
+            self.capture.add(instance)
+
+
+class _MemoryTracer(object):
+    """
+    Starts tracemalloc while any step is being measured, and stops it afterwards unless it was
+    already running. Peaks are process-wide, so they overlap when steps run concurrently.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = 0
+        self._started = False
+
+    @contextmanager
+    def tracing(self):
+        """
+        A context manager that yields a callable returning the peak memory allocated (in bytes)
+        since it was entered.
+        """
+        if tracemalloc is None:  # pragma: no cover
+            yield lambda: None
+            return
+        with self._lock:
+            if self._users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started = True
+            self._users += 1
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        try:
+            yield lambda: max(tracemalloc.get_traced_memory()[1] - baseline, 0)
+        finally:
+            with self._lock:
+                self._users -= 1
+                if self._users == 0 and self._started:
+                    tracemalloc.stop()
+                    self._started = False
+
+
+memory_tracer = _MemoryTracer()
+
+
+@contextmanager
+def _not_tracing():
+    yield lambda: None
+
+
+class StepTelemetry(object):
+    """
+    A monitor for :meth:`.FixtureManager.execute` that measures every step it executes.
+    Measurements are kept in `measurements`, keyed by step index.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.measurements = {}
+
+    @contextmanager
+    def __call__(self, run):
+        from .receivers import activate_capture, active_capture
+        counter = QueryCounter()
+        capture = CountingCapture(active_capture())
+        tracing = memory_tracer.tracing() if self.trace_memory else _not_tracing()
+        start = default_timer()
+        with tracing as peak, counter.counting(), activate_capture(capture):
+            try:
+                yield
+            finally:
+                self.measurements[run.step.index] = {
+                    'index': run.step.index,
+                    'name': run.step.name,
+                    'duration': default_timer() - start,
+                    'query_count': counter.count,
+                    'objects_captured': capture.count,
+                    'memory_peak': peak(),
+                }
+
+
+class StepRecorder(object):
+    """
+    A monitor that saves a :class:`.RecordStep` for each step as soon as it finishes, with the
+    step's output and any measurements taken by `telemetry`, and advances the Record's
+    ``completed_steps`` counter. Steps that raise are saved without output, and aren't counted.
+    """
+
+    def __init__(self, record, telemetry=None):
+        self.record = record
+        self.telemetry = telemetry
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def __call__(self, run):
+        try:
+            yield
+        except Exception:
+            self.save(run, completed=False)
+            raise
+        else:
+            self.save(run, completed=True)
+
+    def save(self, run, completed):
+        from .models import Record, RecordStep
+        from .receivers import activate_capture
+        fields = {'index': run.step.index, 'name': run.step.name}
+        if self.telemetry is not None:
+            fields.update(self.telemetry.measurements.get(run.step.index, {}))
+        # The Record's own bookkeeping isn't one of the objects its scenario created.
+        with activate_capture(None):
+            RecordStep.objects.create(
+                record=self.record, output=text(run.output) if completed else None, **fields
+            )
+            if completed:
+                Record.objects.filter(pk=self.record.pk).update(
+                    completed_steps=m.F('completed_steps') + 1
+                )
+        if completed:
+            with self._lock:
+                self.record.completed_steps += 1
+
+
+class QueryBudgetExceeded(Exception):
+    """A step ran more SQL queries than its fixture's query budget allows."""
+
+
+_TRANSACTION_SQL = re.compile(
+    r'(?:BEGIN|SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.IGNORECASE
+)
+_PLACEHOLDER_LIST = re.compile(r'\((?:%s|\?)(?:, (?:%s|\?))+\)')
+_ROW_LIST = re.compile(r'\(\.\.\.\)(?:, \(\.\.\.\))+')
+
+
+def normalize_sql(sql):
+    """
+    Collapse lists of placeholders in `sql`, such as those of ``IN`` clauses and multi-row
+    inserts, so that queries that only differ in the number of parameters look the same.
+    """
+    return _ROW_LIST.sub('(...)', _PLACEHOLDER_LIST.sub('(...)', sql))
+
+
+_LIBRARY_PATHS = tuple(set(
+    os.path.join(os.path.abspath(path), '')
+    for name, path in sysconfig.get_paths().items()
+    if name in ('stdlib', 'platstdlib', 'purelib', 'platlib')
+)) + (os.path.join(os.path.dirname(os.path.abspath(__file__)), ''),)
+
+
+def call_site():
+    """
+    Return the file and line (as ``'path:line'``) of the innermost frame on the stack that isn't
+    in Quade, the standard library or an installed package, i.e. in the project's own code.
+    """
+    for frame in reversed(traceback.extract_stack()):
+        filename, lineno = frame[0], frame[1]
+        if not os.path.abspath(filename).startswith(_LIBRARY_PATHS):
+            return '{}:{}'.format(filename, lineno)
+    return None
+
+
+class QueryPatterns(QueryCounter):
+    """
+    A :class:`QueryCounter` that also counts queries by their normalized SQL, and notes the call
+    site of the first repeat of each. If given, `check` is called with the patterns after each
+    query other than those that manage transactions, so that it can raise from the step's own
+    transaction.
+    """
+
+    def __init__(self, check=None):
+        super(QueryPatterns, self).__init__()
+        self.patterns = Counter()
+        self.call_sites = {}
+        self.check = check
+
+    def __call__(self, execute, sql, params, many, context):
+        pattern = normalize_sql(sql)
+        self.patterns[pattern] += 1
+        if self.patterns[pattern] == 2:
+            self.call_sites[pattern] = call_site()
+        result = super(QueryPatterns, self).__call__(execute, sql, params, many, context)
+        if self.check is not None and not _TRANSACTION_SQL.match(sql):
+            self.check(self)
+        return result
+
+    def repeated(self):
+        """Return (sql, count, call_site) for each pattern run more than once, most run first."""
+        return [
+            (pattern, count, self.call_sites.get(pattern))
+            for pattern, count in self.patterns.most_common() if count > 1
+        ]
+
+
+class QueryBudget(object):
+    """
+    A monitor that counts the queries run by each step whose fixture was registered with a
+    ``query_budget``, and if a step runs more, logs a warning or (if the ``query_budget_action``
+    setting is ``'fail'``) raises :class:`QueryBudgetExceeded`, listing the SQL it repeated.
+    Budgets aren't checked on versions of Django that can't count queries (before 2.0).
+
+    :class:`QueryBudgetExceeded` is raised by the first query over budget, so that the fixture's
+    transaction rolls back what the step created. Only steps that catch it are failed afterwards,
+    with whatever they committed.
+    """
+    max_patterns = 5
+
+    def __init__(self, plan):
+        self.plan = plan
+
+    @staticmethod
+    def budget_of(func):
+        return getattr(func, 'quade_query_budget', None)
+
+    @contextmanager
+    def __call__(self, run):
+        budget = self.budget_of(self.plan.funcs[run.step.func_name])
+        if budget is None:
+            yield
+            return
+        fail = settings.QUADE.query_budget_action == 'fail'
+
+        def check(queries):
+            if queries.count > budget:
+                raise QueryBudgetExceeded(self.describe(run, budget, queries))
+
+        queries = QueryPatterns(check=check if fail else None)
+        with queries.counting():
+            yield
+        if queries.count is not None and queries.count > budget:
+            message = self.describe(run, budget, queries)
+            if fail:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+    def describe(self, run, budget, queries):
+        lines = ["Step {} ({}) ran {} queries, over its budget of {}.".format(
+            run.step.index, run.step.name, queries.count, budget
+        )]
+        repeated = queries.repeated()
+        if repeated:
+            lines.append("Likely N+1 queries:")
+            for sql, count, site in repeated[:self.max_patterns]:
+                lines.append("- {}x at {}: {}".format(count, site or 'an unknown call site', sql))
+        return '\n'.join(lines)
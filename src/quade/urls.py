@@ -2,13 +2,28 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 from django.conf.urls import url
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     url(r'^$', views.MainView.as_view(), name='quade-main'),
+    url(r'^history/$', views.RecordHistoryView.as_view(), name='quade-history'),
+    url(
+        r'^record/(?P<test_record_id>[0-9]+)/$',
+        views.RecordDetailView.as_view(),
+        name='quade-record'
+    ),
     url(
         r'^record/(?P<test_record_id>[0-9]+)/done/$',
         views.MarkDoneView.as_view(),
         name='quade-mark-done'
     ),
+    url(
+        r'^record/(?P<test_record_id>[0-9]+)/clone/$',
+        views.CloneRecordView.as_view(),
+        name='quade-clone-record'
+    ),
+    url(r'^records/progress/$', views.RecordProgressView.as_view(), name='quade-records-progress'),
+    url(r'^metrics/$', views.MetricsView.as_view(), name='quade-metrics'),
+    url(r'^api/records/$', api.CreateRecordsView.as_view(), name='quade-api-create-records'),
+    url(r'^api/records/status/$', api.RecordStatusView.as_view(), name='quade-api-record-status'),
 ]
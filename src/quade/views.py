@@ -1,19 +1,42 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import functools
+from itertools import groupby
+import json
+import time
+from timeit import default_timer
+
 from django import forms
 from django.conf import settings
-from django.http import HttpResponseRedirect
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.paginator import InvalidPage, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError
+from django.db.models import Count
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect,
+    StreamingHttpResponse,
+)
+from django.middleware.csrf import get_token
 from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
 try:
     from django.urls import reverse, reverse_lazy
 except ImportError:
     from django.core.urlresolvers import reverse, reverse_lazy
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.functional import cached_property
-from django.views.generic import View, FormView
+from django.utils.safestring import mark_safe
+from django.views.generic import View, FormView, TemplateView
 
+from . import metrics
+from .caching import RECORDS, SCENARIOS, cached, get_cache
 from .compatability import UserPassesTestMixin
-from .models import Record, Scenario
+from .copying import CopyError, load_pk
+from .models import Record, RecordStep, Scenario
+from .templatetags.qa_extras import status
 
 
 class QuadeAccessMixin(UserPassesTestMixin):
@@ -34,16 +57,25 @@ class ExecuteTestForm(forms.Form):
     def __init__(self, *args, **kwargs):
         # Overwrite the queryset when the form is initialized to avoid stale data.
         super(ExecuteTestForm, self).__init__(*args, **kwargs)
-        self.fields['scenarios'].queryset = Scenario.objects.active()
+        field = self.fields['scenarios']
+        field.queryset = Scenario.objects.active()
+        if get_cache() is None:
+            return
+        # Selected scenarios are still looked up in the queryset when the form is cleaned.
+        field.choices = cached(SCENARIOS, 'choices', lambda: [('', field.empty_label)] + [
+            (scenario.slug, field.label_from_instance(scenario)) for scenario in field.queryset
+        ])
 
     def execute_test(self, created_by):
+        """Claim a Record from the scenario's pool, or else create and execute a new one."""
         scenario = self.cleaned_data['scenarios']
-        record = Record.objects.create(scenario=scenario, created_by=created_by)
-        if settings.QUADE.use_celery:
-            from .tasks import execute_test_task
-            execute_test_task.delay(record.id)
-        else:
-            record.execute_test()
+        record = Record.objects.claim(scenario, created_by)
+        if record is None:
+            record = Record.objects.create(scenario=scenario, created_by=created_by)
+            record.dispatch()
+        elif settings.QUADE.use_celery:
+            from .tasks import refill_pool_task
+            refill_pool_task.delay(scenario.pk)
         return record
 
 
@@ -51,6 +83,7 @@ class MainView(QuadeAccessMixin, FormView):
     template_name = 'quade/main.jinja'
     form_class = ExecuteTestForm
     success_url = reverse_lazy('quade-main')
+    csrf_placeholder = 'QUADE_CSRF_TOKEN'
 
     def get_context_data(self, **kwargs):
         context = super(MainView, self).get_context_data(**kwargs)
@@ -60,19 +93,287 @@ class MainView(QuadeAccessMixin, FormView):
             context['form'] = None
         context['allowed'] = settings.QUADE.allowed
         context['use_celery'] = settings.QUADE.use_celery
-        context['recent_tests'] = Record.objects.all().order_by(
-            '-created_on'
-        ).select_related('scenario')[:30]
+        context['recent_records'] = self.render_recent_records()
         return context
 
+    def render_recent_records(self):
+        """
+        Render the table of recent Records, caching it per time zone. The table is rendered with a
+        placeholder for the CSRF token, which is filled in for each request.
+        """
+        def render():
+            # Pooled records stay out of the way until someone claims them.
+            recent_tests = Record.objects.filter(pooled=False).newest_first()
+            return render_to_string('quade/recent_records.jinja', {
+                'recent_tests': recent_tests.select_related('scenario').prefetch_related(
+                    'steps'
+                )[:30],
+                'csrf_token': self.csrf_placeholder,
+            })
+        html = cached(RECORDS, 'recent:{}'.format(timezone.get_current_timezone_name()), render)
+        # Before Django 1.9, there's no token unless CsrfViewMiddleware is in use.
+        token = get_token(self.request) or ''
+        return mark_safe(html.replace(self.csrf_placeholder, token))
+
     def form_valid(self, form):
         form.execute_test(created_by=self.request.user)
         return super(MainView, self).form_valid(form)
 
 
+def encode_cursor(record):
+    return '{},{}'.format(record.created_on.isoformat(), record.id)
+
+
+def decode_cursor(value):
+    """Return the (created_on, id) tuple encoded in `value`, or None if it isn't valid."""
+    created_on, _, record_id = value.rpartition(',')
+    try:
+        created_on, record_id = parse_datetime(created_on), int(record_id)
+    except ValueError:
+        return None
+    return (created_on, record_id) if created_on is not None else None
+
+
+class RecordHistoryForm(forms.Form):
+    status = forms.TypedChoiceField(
+        choices=[('', 'Any')] + [
+            (value, name.replace('_', ' ').title()) for value, name in Record.Status.choices
+        ],
+        coerce=int,
+        empty_value=None,
+        required=False,
+    )
+    scenario = forms.ModelChoiceField(
+        queryset=Scenario.objects.all(),
+        to_field_name='slug',
+        empty_label='Any',
+        required=False,
+    )
+    created_by = forms.CharField(label='Created by (username)', required=False)
+    after = forms.CharField(widget=forms.HiddenInput, required=False)
+
+    def clean_created_by(self):
+        username = self.cleaned_data['created_by']
+        if not username:
+            return None
+        User = get_user_model()
+        try:
+            return User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            raise forms.ValidationError("No user with this username.")
+
+    def clean_after(self):
+        value = self.cleaned_data['after']
+        if not value:
+            return None
+        cursor = decode_cursor(value)
+        if cursor is None:
+            raise forms.ValidationError("Invalid cursor.")
+        return cursor
+
+    def records(self):
+        """The Records matching the filters, newest first, starting after the cursor."""
+        records = Record.objects.newest_first()
+        for field in ['status', 'scenario', 'created_by']:
+            if self.cleaned_data[field] is not None:
+                records = records.filter(**{field: self.cleaned_data[field]})
+        if self.cleaned_data['after'] is not None:
+            records = records.older_than(*self.cleaned_data['after'])
+        return records
+
+
+class RecordHistoryView(QuadeAccessMixin, TemplateView):
+    """
+    Every Record, newest first, optionally filtered. Pages are fetched by keyset (the creation
+    time and ID of the last Record on the previous page), so every page costs the same.
+    """
+    template_name = 'quade/history.jinja'
+    page_size = 50
+
+    def get_context_data(self, **kwargs):
+        context = super(RecordHistoryView, self).get_context_data(**kwargs)
+        form = RecordHistoryForm(self.request.GET)
+        records, next_query = [], None
+        if form.is_valid():
+            records = list(form.records().select_related('scenario', 'created_by')[
+                :self.page_size + 1
+            ])
+            if len(records) > self.page_size:
+                records = records[:self.page_size]
+                query = self.request.GET.copy()
+                query['after'] = encode_cursor(records[-1])
+                next_query = query.urlencode()
+        context.update(form=form, records=records, next_query=next_query)
+        return context
+
+
+class RecordDetailView(QuadeAccessMixin, TemplateView):
+    """
+    A Record, its steps, and the objects it created, grouped by content type. The objects are
+    paginated, and each page fetches the instances of each model on it with a single query.
+    """
+    template_name = 'quade/record.jinja'
+    page_size = 100
+
+    def get_context_data(self, **kwargs):
+        context = super(RecordDetailView, self).get_context_data(**kwargs)
+        record = get_object_or_404(
+            Record.objects.select_related('scenario', 'created_by'), id=kwargs['test_record_id']
+        )
+        counts = record.recorded_objects.values('content_type').annotate(
+            count=Count('pk')
+        ).order_by('content_type')
+        recorded_objects = record.recorded_objects.order_by('content_type', 'pk')
+        paginator = Paginator(recorded_objects, self.page_size)
+        try:
+            page = paginator.page(self.request.GET.get('page', 1))
+        except InvalidPage:
+            raise Http404("Invalid page.")
+        context.update(
+            record=record,
+            steps=list(record.steps.all()),
+            counts=[
+                (ContentType.objects.get_for_id(row['content_type']), row['count'])
+                for row in counts
+            ],
+            page=page,
+            groups=[
+                (
+                    ContentType.objects.get_for_id(content_type_id),
+                    self.fetch(content_type_id, group),
+                )
+                for content_type_id, group in groupby(
+                    page.object_list, lambda recorded: recorded.content_type_id
+                )
+            ],
+        )
+        return context
+
+    def fetch(self, content_type_id, recorded_objects):
+        """
+        Return a list of (object_id, object) pairs for `recorded_objects`, all of one content
+        type, fetching the objects with a single query. Objects that no longer exist are None.
+        """
+        recorded_objects = list(recorded_objects)
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:  # The model has been removed.
+            return [(recorded.object_id, None) for recorded in recorded_objects]
+        pks = [load_pk(model, recorded.object_id) for recorded in recorded_objects]
+        objects = model._base_manager.in_bulk(pks)
+        return [
+            (recorded.object_id, objects.get(pk)) for recorded, pk in zip(recorded_objects, pks)
+        ]
+
+
 class MarkDoneView(QuadeAccessMixin, View):
     def post(self, request, test_record_id):
         record = get_object_or_404(Record, id=test_record_id)
         record.status = Record.Status.DONE
         record.save()
         return HttpResponseRedirect(reverse('quade-main'))
+
+
+class CloneRecordView(QuadeAccessMixin, View):
+    """Clone a Record for the current user, and redirect to the clone."""
+
+    def post(self, request, test_record_id):
+        if not settings.QUADE.allowed:
+            return HttpResponseForbidden("Quade is disabled on this environment.")
+        record = get_object_or_404(Record, id=test_record_id)
+        try:
+            clone = record.clone(created_by=request.user)
+        except (CopyError, IntegrityError) as exc:
+            return HttpResponseBadRequest("Record #{} can't be cloned: {}".format(record.pk, exc))
+        return HttpResponseRedirect(reverse('quade-record', args=[clone.pk]))
+
+
+class RecordProgressView(QuadeAccessMixin, View):
+    """
+    Stream the progress of the Records given as a comma-separated ``ids`` query parameter as
+    server-sent events, so that a page can follow all of its executing Records over one
+    connection: a ``step`` event with each step's output as it finishes, a ``progress`` event
+    whenever a Record's step counter changes, and a ``done`` event once a Record has finished
+    executing (or a ``gone`` event, if it has been deleted). The data of every event includes the
+    ID of its ``record``.
+
+    Each response ends once every Record has finished, or after `max_duration` seconds; browsers
+    then reconnect, sending the ID of the last step they received, so no step is sent twice.
+    """
+    poll_interval = 1
+    max_duration = 60
+    max_records = 100
+
+    def get(self, request):
+        try:
+            ids = [int(value) for value in request.GET.get('ids', '').split(',') if value]
+        except ValueError:
+            return HttpResponseBadRequest("ids must be a comma-separated list of integers.")
+        if len(ids) > self.max_records:
+            return HttpResponseBadRequest(
+                "At most {} records can be followed at once.".format(self.max_records)
+            )
+        try:
+            last_step_id = int(request.META.get('HTTP_LAST_EVENT_ID', 0))
+        except ValueError:
+            last_step_id = 0
+        response = StreamingHttpResponse(
+            self.events(ids, last_step_id), content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream.
+        return response
+
+    def events(self, record_ids, last_step_id):
+        deadline = default_timer() + self.max_duration
+        yield 'retry: {}\n\n'.format(int(self.poll_interval * 1000))
+        last_progress = {}
+        pending = set(record_ids)
+        while pending:
+            steps = RecordStep.objects.filter(record__in=pending, pk__gt=last_step_id)
+            for step in steps.order_by('pk').values('id', 'record', 'index', 'name', 'output'):
+                last_step_id = step['id']
+                yield self.event('step', step, id=step['id'])
+            records = Record.objects.filter(pk__in=pending).only(
+                'status', 'instructions', 'completed_steps', 'total_steps'
+            ).order_by('pk')
+            followed, pending = pending, set()
+            for record in records:
+                progress = {
+                    'record': record.pk,
+                    'status': status(record),
+                    'completed_steps': record.completed_steps,
+                    'total_steps': record.total_steps,
+                }
+                if progress != last_progress.get(record.pk):
+                    last_progress[record.pk] = progress
+                    yield self.event('progress', progress)
+                if record.status != Record.Status.NOT_READY:
+                    yield self.event('done', dict(progress, instructions=record.instructions))
+                else:
+                    pending.add(record.pk)
+                followed.discard(record.pk)
+            for record_id in sorted(followed):
+                yield self.event('gone', {'record': record_id})
+            if not pending or default_timer() >= deadline:
+                return
+            time.sleep(self.poll_interval)
+
+    def event(self, name, data, id=None):
+        lines = ['event: {}'.format(name)]
+        if id is not None:
+            lines.append('id: {}'.format(id))
+        lines.append('data: {}'.format(json.dumps(data, cls=DjangoJSONEncoder)))
+        return '\n'.join(lines) + '\n\n'
+
+
+class MetricsView(QuadeAccessMixin, View):
+    """
+    Metrics about executing Records, in Prometheus' text exposition format: executions by scenario
+    and final status, histograms of execution time, time spent queued and objects captured per
+    execution, and the number of Records that haven't finished executing. See ``metrics_dir``.
+    """
+
+    def get(self, request):
+        return HttpResponse(
+            metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
@@ -0,0 +1,45 @@
+"""Async fixtures, in a module of their own because Python 2 can't parse them."""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import asyncio
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save
+
+from quade.aio import sync_to_async
+
+running = {'now': 0, 'most': 0}
+
+
+async def wait_on_io(delay=0.05):
+    """Waits on I/O, keeping track of how many steps are waiting at once."""
+    running['now'] += 1
+    running['most'] = max(running['most'], running['now'])
+    try:
+        await asyncio.sleep(delay)
+    finally:
+        running['now'] -= 1
+    return delay
+
+
+def announce_user(pk):
+    """Sends post_save for a new user, as saving one would, without touching the database."""
+    User = get_user_model()
+    post_save.send(sender=User, instance=User(pk=pk), created=True)
+    return pk
+
+
+async def async_announce(pk):
+    """Announces a user through sync_to_async, after waiting on I/O."""
+    await asyncio.sleep(0.01)
+    return await sync_to_async(announce_user)(pk)
+
+
+async def async_fail():
+    await asyncio.sleep(0.01)
+    raise ValueError("Step failed")
+
+
+async def in_event_loop(func, *args):
+    """Calls the synchronous `func` from a coroutine, as an async view would."""
+    return func(*args)
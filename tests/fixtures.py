@@ -22,3 +22,12 @@ def staff_user_id():
     """Creates a staff user and returns its ID."""
     staff = factories.UserStaff()
     return staff.pk
+
+
+def customer_username():
+    """Creates a customer and returns its username."""
+    return factories.User().username
+
+
+def fail():
+    raise ValueError("Step failed")
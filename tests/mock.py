@@ -23,8 +23,10 @@ class QuadeMock:
         @wraps(fn)
         def wrapper(*args, **kwargs):
             original_registry = self.module.manager._registry
-            # Monkey patch the registry.
+            original_plans = self.module.manager._plans
+            # Monkey patch the registry, and start with no compiled plans.
             self.module.manager._registry = {func.__name__: func for func in self.funcs}
+            self.module.manager._plans = {}
 
             try:
                 # Run the wrapped function (e.g. a test).
@@ -36,5 +38,6 @@ class QuadeMock:
             finally:
                 # Restore the original registry.
                 self.module.manager._registry = original_registry
+                self.module.manager._plans = original_plans
 
         return wrapper
@@ -0,0 +1,186 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+import threading
+from unittest import skipIf
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+import quade
+from quade import managers
+from quade.models import Record, RecordStep
+from quade.profiling import profile_scenario
+from quade.receivers import activate_capture
+from quade.telemetry import StepTelemetry
+from . import factories
+from .mock import QuadeMock
+
+
+def synchronous():
+    """Runs on one of execute_async's threads."""
+    return threading.current_thread().name
+
+
+if sys.version_info >= (3, 5):
+    from quade.aio import execute_async, execute_record, run_coroutine
+    from .async_fixtures import async_announce, async_fail, in_event_loop, running, wait_on_io
+    FUNCS = [async_announce, async_fail, synchronous, wait_on_io]
+else:  # pragma: no cover
+    FUNCS = []
+
+INDEPENDENT = {'depends_on': []}
+
+
+class ListCapture(object):
+
+    def __init__(self):
+        self.objects = []
+
+    def add(self, instance):
+        self.objects.append(instance)
+
+
+@skipIf(sys.version_info < (3, 5), "async fixtures require Python 3.5+")
+class TestExecuteAsync(TestCase):
+
+    def setUp(self):
+        running.update(now=0, most=0)
+
+    @QuadeMock(managers, funcs=FUNCS)
+    def test_independent_steps_overlap(self):
+        output = run_coroutine(execute_async([
+            ('wait_on_io', {}, {'name': 'first'}),
+            ('wait_on_io', {}, dict(INDEPENDENT, name='second')),
+            ('synchronous', {}, INDEPENDENT),
+        ]))
+        first, second, thread_name = output.split('\n')
+        self.assertEqual([first, second], ['0.05', '0.05'])
+        self.assertNotEqual(thread_name, threading.current_thread().name)
+        self.assertEqual(running['most'], 2)
+
+    @QuadeMock(managers, funcs=FUNCS)
+    def test_dependent_steps_in_order(self):
+        run_coroutine(execute_async([('wait_on_io', {}), ('wait_on_io', {})]))
+        self.assertEqual(running['most'], 1)
+
+    @QuadeMock(managers, funcs=FUNCS)
+    def test_failure(self):
+        with self.assertRaisesRegexp(ValueError, "Step failed"):
+            run_coroutine(execute_async([
+                ('wait_on_io', {'delay': 5}), ('async_fail', {}, INDEPENDENT),
+            ]))
+        self.assertEqual(running['now'], 0)
+
+    @QuadeMock(managers, funcs=FUNCS)
+    def test_objects_captured_per_step(self):
+        capture, telemetry = ListCapture(), StepTelemetry(trace_memory=False)
+        with activate_capture(capture):
+            output = run_coroutine(execute_async([
+                ('async_announce', {'pk': 1}, {'name': 'first'}),
+                ('async_announce', {'pk': 2}, dict(INDEPENDENT, name='second')),
+            ], monitors=[telemetry]))
+        self.assertEqual(output, '1\n2')
+        self.assertEqual(sorted(obj.pk for obj in capture.objects), [1, 2])
+        # The steps overlap, but each only counts the object it created.
+        self.assertEqual(
+            [telemetry.measurements[index]['objects_captured'] for index in [0, 1]], [1, 1]
+        )
+
+    def test_run_coroutine_in_event_loop(self):
+        with self.assertRaises(managers.AsyncStepError):
+            run_coroutine(in_event_loop(run_coroutine, wait_on_io(0)))
+
+    @QuadeMock(managers, funcs=FUNCS)
+    def test_synchronous_execution(self):
+        self.assertEqual(managers.manager.execute([('wait_on_io', {'delay': 0})]), '0')
+
+    def test_register(self):
+        try:
+            self.assertIs(managers.register(query_budget=10)(wait_on_io), wait_on_io)
+            self.assertEqual(wait_on_io.quade_query_budget, 10)
+            with self.assertRaises(ValueError):
+                managers.register(shared=True)(wait_on_io)
+        finally:
+            managers.manager._registry = {}
+            for attribute in ['quade_shared', 'quade_ttl', 'quade_query_budget']:
+                delattr(wait_on_io, attribute)
+
+
+@skipIf(sys.version_info < (3, 5), "async fixtures require Python 3.5+")
+class TestAsyncRecords(TestCase):
+
+    def setUp(self):
+        running.update(now=0, most=0)
+
+    @QuadeMock(managers, funcs=FUNCS)
+    @override_settings(QUADE=quade.Settings(allowed_envs=quade.AllEnvs, collect_telemetry=True))
+    def test_execute(self):
+        record = factories.Record(scenario__config=[
+            ('wait_on_io', {}, {'name': 'first'}),
+            ('wait_on_io', {'delay': 0.1}, dict(INDEPENDENT, name='second')),
+        ])
+        record.execute_test()
+        record.refresh_from_db()
+        self.assertEqual(record.status, Record.Status.READY)
+        self.assertEqual(record.instructions, '0.05\n0.1')
+        self.assertEqual(record.completed_steps, 2)
+        self.assertEqual(running['most'], 2)
+        self.assertEqual(
+            list(RecordStep.objects.values_list('name', flat=True)), ['first', 'second']
+        )
+
+    @QuadeMock(managers, funcs=FUNCS)
+    def test_failed(self):
+        record = factories.Record(scenario__config=[('wait_on_io', {}), ('async_fail', {})])
+        with self.assertRaises(ValueError):
+            record.execute_test()
+        self.assertEqual(record.status, Record.Status.FAILED)
+
+    @QuadeMock(managers, funcs=FUNCS)
+    def test_execute_record(self):
+        record = factories.Record(scenario__config=[
+            ('wait_on_io', {}),
+            ('wait_on_io', {'delay': 0.1}, INDEPENDENT),
+        ])
+        run_coroutine(execute_record(record))
+        record.refresh_from_db()
+        self.assertEqual(record.status, Record.Status.READY)
+        self.assertEqual(record.instructions, '0.05\n0.1')
+        self.assertEqual(record.completed_steps, 2)
+        self.assertEqual(running['most'], 2)
+
+    @QuadeMock(managers, funcs=FUNCS)
+    def test_execute_record_failed(self):
+        record = factories.Record(scenario__config=[('async_fail', {})])
+        with self.assertRaises(ValueError):
+            run_coroutine(execute_record(record))
+        record.refresh_from_db()
+        self.assertEqual(record.status, Record.Status.FAILED)
+
+    @QuadeMock(managers, funcs=FUNCS)
+    def test_execute_test_in_event_loop(self):
+        record = factories.Record(scenario__config=[('wait_on_io', {})])
+        with self.assertRaises(managers.AsyncStepError):
+            run_coroutine(in_event_loop(record.execute_test))
+        record.refresh_from_db()
+        self.assertEqual(record.status, Record.Status.NOT_READY)
+        self.assertIsNone(record.total_steps)
+
+    @QuadeMock(managers, funcs=FUNCS)
+    @override_settings(QUADE=quade.Settings(allowed_envs=quade.AllEnvs, atomic_execution=True))
+    def test_atomic_execution_refused(self):
+        record = factories.Record(scenario__config=[('wait_on_io', {})])
+        with self.assertRaises(managers.AsyncStepError):
+            record.execute_test()
+        self.assertEqual(record.status, Record.Status.FAILED)
+        self.assertEqual(running['most'], 0)
+
+    @QuadeMock(managers, funcs=FUNCS)
+    def test_profile_refused(self):
+        scenario = factories.Scenario(config=[('wait_on_io', {})])
+        with self.assertRaises(managers.AsyncStepError):
+            profile_scenario(scenario)
+        with self.assertRaisesRegexp(CommandError, "can't be profiled in a dry run"):
+            call_command('profile_scenario', scenario.slug)
+        self.assertEqual(running['most'], 0)
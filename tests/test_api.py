@@ -0,0 +1,132 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from unittest import skipIf
+
+from django.db import connection, transaction
+from django.test import Client, TestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+try:
+    from django.urls import reverse
+except ImportError:
+    from django.core.urlresolvers import reverse
+from django_webtest import WebTest
+from mock import mock
+
+import quade
+from quade import managers
+from quade.models import Record
+
+from .fixtures import fail
+from .mock import QuadeMock
+from .utils import CSRF_MIDDLEWARE, login, requires_celery
+from . import factories
+
+
+class TestCreateRecords(WebTest):
+    csrf_checks = False
+
+    def setUp(self):
+        self.superuser = factories.UserAdmin()
+        self.app.set_user(self.superuser)
+        self.url = reverse('quade-api-create-records')
+
+    @QuadeMock(managers)
+    def test_create_batch(self):
+        customers = factories.Scenario(config=[('customer', {})])
+        staff = factories.Scenario(config=[('staff_user', {})])
+        resp = self.app.post_json(
+            self.url, params=[{'slug': customers.slug, 'count': 2}, {'slug': staff.slug}],
+            status=201,
+        )
+        records = resp.json['records']
+        self.assertEqual(
+            [(record['scenario'], record['status']) for record in records],
+            [(customers.slug, 'READY'), (customers.slug, 'READY'), (staff.slug, 'READY')]
+        )
+        self.assertEqual(
+            set(Record.objects.values_list('created_by', flat=True)), {self.superuser.pk}
+        )
+
+    @QuadeMock(managers, funcs=[fail])
+    def test_failures_are_reported(self):
+        scenario = factories.Scenario(config=[('fail', {})])
+        resp = self.app.post_json(self.url, params=[{'slug': scenario.slug}], status=201)
+        self.assertEqual(resp.json['records'][0]['status'], 'FAILED')
+
+    @QuadeMock(managers)
+    @requires_celery
+    @skipIf(not hasattr(transaction, 'on_commit'), "on_commit requires Django 1.9+")
+    def test_dispatched_through_celery_on_commit(self):
+        scenario = factories.Scenario(config=[('customer', {})])
+        qs = quade.Settings(use_celery=True, allowed_envs=quade.AllEnvs)
+        with mock.patch('quade.tasks.execute_test_task') as mock_task, override_settings(QUADE=qs):
+            with mock.patch.object(transaction, 'on_commit') as on_commit:
+                resp = self.app.post_json(
+                    self.url, params=[{'slug': scenario.slug, 'count': 2}], status=201
+                )
+            mock_task.delay.assert_not_called()
+            for (callback,), _ in on_commit.call_args_list:
+                callback()
+        ids = [record['id'] for record in resp.json['records']]
+        self.assertEqual(mock_task.delay.call_args_list, [mock.call(ids[0]), mock.call(ids[1])])
+
+    def test_unknown_slug_creates_nothing(self):
+        scenario = factories.Scenario()
+        resp = self.app.post_json(
+            self.url, params=[{'slug': scenario.slug}, {'slug': 'nope'}], status=400
+        )
+        self.assertEqual(resp.json['error'], "No active scenario(s) with slug: nope")
+        self.assertFalse(Record.objects.exists())
+
+    def test_invalid_bodies(self):
+        for body in ['not json', '{"slug": "x"}', '[{"count": 1}]', '[{"slug": "x", "count": 0}]']:
+            self.app.post(self.url, params=body, content_type='application/json', status=400)
+        self.assertFalse(Record.objects.exists())
+
+    def test_disabled(self):
+        with override_settings(QUADE=quade.Settings(allowed_envs=lambda _: False)):
+            self.app.post_json(self.url, params=[], status=403)
+
+
+class TestCreateRecordsCsrf(TestCase):
+
+    def test_csrf_protected(self):
+        client = Client(enforce_csrf_checks=True)
+        login(client, factories.UserAdmin())
+        with modify_settings(**CSRF_MIDDLEWARE):
+            resp = client.post(
+                reverse('quade-api-create-records'), data='[]', content_type='application/json'
+            )
+        self.assertEqual(resp.status_code, 403)
+
+
+class TestRecordStatus(WebTest):
+
+    def setUp(self):
+        self.app.set_user(factories.UserAdmin())
+        self.url = reverse('quade-api-record-status')
+
+    def test_statuses_in_one_query(self):
+        ready = factories.Record(status=Record.Status.READY, instructions='Log in as x')
+        not_ready = factories.Record()
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.app.get(self.url, params={'ids': '{},{},0'.format(ready.id, not_ready.id)})
+        self.assertEqual(
+            len([query for query in queries.captured_queries if 'quade_' in query['sql']]), 1
+        )
+        self.assertEqual(resp.json['records'], [
+            {
+                'id': ready.id, 'scenario': ready.scenario.slug, 'status': 'READY',
+                'instructions': 'Log in as x', 'completed_steps': 0, 'total_steps': None,
+            },
+            {
+                'id': not_ready.id, 'scenario': not_ready.scenario.slug, 'status': 'NOT_READY',
+                'instructions': None, 'completed_steps': 0, 'total_steps': None,
+            },
+        ])
+
+    def test_invalid_ids(self):
+        self.app.get(self.url, params={'ids': '1,x'}, status=400)
+
+    def test_no_ids(self):
+        self.assertEqual(self.app.get(self.url).json, {'records': []})
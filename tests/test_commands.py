@@ -1,10 +1,26 @@
-from django.core.management import call_command
-from django.test import TestCase
+from datetime import timedelta
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+import django
+from django.contrib.auth import get_user_model
+User = get_user_model()
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.utils.six import StringIO
+from mock import mock
 
+import quade
 from quade import managers
+from quade.management.commands.run_scenarios import percentile
+from quade.models import Record, RecordedObject, Scenario, SharedFixture
+from . import factories
 from .mock import QuadeMock
-from .fixtures import customer
+from .fixtures import customer, customer_username, staff_user
 
 
 class TestListFixturesCommand(TestCase):
@@ -36,3 +52,294 @@ class TestListFixturesCommand(TestCase):
         self.assertEqual(output[1], "- customer")
         self.assertEqual(output[2], "- staff_user")
         self.assertEqual(output[3], "")
+
+
+class TestFixturesManifest(TestCase):
+
+    def setUp(self):
+        self.out = StringIO()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'manifest.json')
+        qs = quade.Settings(allowed_envs=quade.AllEnvs, fixtures_manifest=self.path)
+        self.settings = override_settings(QUADE=qs)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    @QuadeMock(managers, funcs=[customer, staff_user])
+    def test_write_manifest(self):
+        call_command('list_fixtures', write_manifest=True, verbosity=2, stdout=self.out)
+        self.assertEqual(self.out.getvalue().splitlines(), [
+            "2 functions are registered with Quade:", "- customer()", "- staff_user(**kwargs)",
+        ])
+        with open(self.path) as manifest:
+            self.assertEqual(json.load(manifest)['fixtures_file'], 'quade.fixtures')
+
+    def test_read_manifest_without_importing(self):
+        with open(self.path, 'w') as manifest:
+            json.dump({
+                'fixtures_file': 'quade.fixtures',
+                'fixtures': [{'name': 'orders', 'signature': '(count=1)'}],
+            }, manifest)
+        with mock.patch.object(managers.manager, 'load') as mock_load:
+            call_command('list_fixtures', verbosity=2, stdout=self.out)
+        mock_load.assert_not_called()
+        self.assertEqual(self.out.getvalue().splitlines(), [
+            "1 function is registered with Quade:", "- orders(count=1)",
+        ])
+
+    @QuadeMock(managers, funcs=[customer])
+    def test_manifest_of_other_fixtures_file_ignored(self):
+        with open(self.path, 'w') as manifest:
+            json.dump({'fixtures_file': 'other.fixtures', 'fixtures': []}, manifest)
+        call_command('list_fixtures', stdout=self.out)
+        self.assertEqual(self.out.getvalue().splitlines()[1], "- customer")
+
+    def test_write_manifest_requires_setting(self):
+        with override_settings(QUADE=quade.Settings()):
+            with self.assertRaises(CommandError):
+                call_command('list_fixtures', write_manifest=True, stdout=self.out)
+
+
+class TestRunScenariosCommand(TestCase):
+
+    command_name = 'run_scenarios'
+
+    def setUp(self):
+        self.out = StringIO()
+        self.err = StringIO()
+        self.user = factories.UserAdmin()
+
+    def call(self, *args, **kwargs):
+        kwargs.setdefault('username', self.user.username)
+        kwargs.setdefault('processes', 1)
+        call_command(self.command_name, *args, stdout=self.out, stderr=self.err, **kwargs)
+
+    @QuadeMock(managers)
+    def test_creates_and_executes_records(self):
+        customers = factories.Scenario(config=[('customer', {})])
+        staff = factories.Scenario(config=[('staff_user', {})])
+        self.call('{}:3'.format(customers.slug), staff.slug)
+
+        self.assertEqual(Record.objects.filter(scenario=customers).count(), 3)
+        self.assertEqual(Record.objects.filter(scenario=staff).count(), 1)
+        self.assertFalse(Record.objects.exclude(status=Record.Status.READY).exists())
+        self.assertFalse(Record.objects.exclude(created_by=self.user).exists())
+        output = self.out.getvalue()
+        self.assertIn("Executed 4 records in", output)
+        self.assertIn("0 failed", output)
+        self.assertRegexpMatches(output, r"Latency: p50 [0-9.]+s, p95 [0-9.]+s, p99 [0-9.]+s.")
+
+    @QuadeMock(managers)
+    def test_reports_failures(self):
+        scenario = factories.Scenario(config=[('staff_user', {'no_such_field': 1})])
+        self.call('{}:2'.format(scenario.slug))
+        self.assertEqual(Record.objects.filter(status=Record.Status.FAILED).count(), 2)
+        self.assertIn("2 failed", self.out.getvalue())
+        self.assertEqual(self.err.getvalue().count("failed:"), 2)
+
+    def test_unknown_scenario(self):
+        with self.assertRaisesRegexp(CommandError, "No active scenario"):
+            self.call('does-not-exist:2')
+        self.assertFalse(Record.objects.exists())
+
+    def test_invalid_count(self):
+        with self.assertRaisesRegexp(CommandError, "Invalid count"):
+            self.call('scenario:zero')
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3.0], 99), 3.0)
+
+
+class TestPurgeRecordsCommand(TestCase):
+
+    command_name = 'purge_records'
+
+    def setUp(self):
+        self.out = StringIO()
+        self.err = StringIO()
+
+    def call(self, *args, **kwargs):
+        call_command(self.command_name, *args, stdout=self.out, stderr=self.err, **kwargs)
+        return self.out.getvalue().splitlines()
+
+    def execute(self, days_ago, **kwargs):
+        record = factories.Record(scenario__config=[('customer', {}), ('staff_user', {})], **kwargs)
+        record.execute_test()
+        Record.objects.filter(pk=record.pk).update(
+            created_on=timezone.now() - timedelta(days=days_ago)
+        )
+        return record
+
+    @QuadeMock(managers, funcs=[customer, staff_user])
+    def test_purges_old_records_and_their_objects(self):
+        old = self.execute(days_ago=10)
+        new = self.execute(days_ago=1)
+        old_users = [obj.object_id for obj in old.recorded_objects.all()]
+        output = self.call(older_than=7, batch_size=1)
+        if django.VERSION >= (1, 9):
+            self.assertEqual(output[0], "Deleted 7 rows:")
+            self.assertEqual(output[1:], [
+                "- auth.User: 2",
+                "- quade.Record: 1",
+                "- quade.RecordStep: 2",
+                "- quade.RecordedObject: 2",
+            ])
+        else:  # Cascades aren't counted.
+            self.assertEqual(output, ["Deleted 3 rows:", "- auth.User: 2", "- quade.Record: 1"])
+        self.assertFalse(Record.objects.filter(pk=old.pk).exists())
+        self.assertFalse(User.objects.filter(pk__in=old_users).exists())
+        self.assertEqual(new.recorded_objects.count(), 2)
+        self.assertTrue(all(obj.object is not None for obj in new.recorded_objects.all()))
+
+    @QuadeMock(managers, funcs=[customer, staff_user])
+    def test_status_filter(self):
+        done = self.execute(days_ago=10)
+        Record.objects.filter(pk=done.pk).update(status=Record.Status.DONE)
+        ready = self.execute(days_ago=10)
+        self.call(older_than=7, status=['DONE'])
+        self.assertEqual(list(Record.objects.all()), [ready])
+
+    @QuadeMock(managers, funcs=[customer, staff_user])
+    def test_skips_records_with_protected_objects(self):
+        protected = self.execute(days_ago=10)
+        purged = self.execute(days_ago=10)
+        user = protected.recorded_objects.first().object
+        factories.Record(created_by=user)
+        self.call(older_than=7)
+        errors = self.err.getvalue().splitlines()
+        self.assertEqual(errors[0], "Skipped 1 Records whose objects are protected:")
+        self.assertTrue(errors[1].startswith("- Record #{}: Cannot delete".format(protected.pk)))
+        self.assertFalse(Record.objects.filter(pk=purged.pk).exists())
+        # The skipped Record and all of its objects are left as they were.
+        self.assertEqual(protected.recorded_objects.count(), 2)
+        self.assertTrue(all(obj.object is not None for obj in protected.recorded_objects.all()))
+
+    @QuadeMock(managers, funcs=[customer, staff_user])
+    def test_dry_run(self):
+        self.execute(days_ago=10)
+        output = self.call(older_than=7, dry_run=True)
+        self.assertEqual(output, [
+            "Would delete 3 rows (not counting cascades):",
+            "- auth.User: 2",
+            "- quade.Record: 1",
+        ])
+        self.assertEqual(Record.objects.count(), 1)
+        self.assertEqual(RecordedObject.objects.count(), 2)
+
+    def test_older_than_required(self):
+        with self.assertRaisesRegexp(CommandError, "--older-than is required"):
+            self.call()
+
+
+class TestMaintainPoolsCommand(TestCase):
+
+    command_name = 'maintain_pools'
+
+    def setUp(self):
+        self.out = StringIO()
+
+    @QuadeMock(managers, funcs=[customer])
+    def test_refills_pools(self):
+        scenario = factories.Scenario(config=[('customer', {})], pool_size=3)
+        call_command(self.command_name, stdout=self.out)
+        self.assertEqual(self.out.getvalue(), "Created 3 pooled record(s).\n")
+        self.assertEqual(Record.objects.in_pool(scenario).count(), 3)
+
+    @QuadeMock(managers, funcs=[customer])
+    def test_interval(self):
+        factories.Scenario(config=[('customer', {})], pool_size=1)
+        with mock.patch('time.sleep', side_effect=[None, KeyboardInterrupt]) as mock_sleep:
+            call_command(self.command_name, interval=5, stdout=self.out)
+        self.assertEqual(mock_sleep.call_args_list, [mock.call(5), mock.call(5)])
+        self.assertEqual(self.out.getvalue().splitlines(), [
+            "Created 1 pooled record(s).",
+            "Created 0 pooled record(s).",
+        ])
+
+    def test_invalid_interval(self):
+        with self.assertRaises(CommandError):
+            call_command(self.command_name, interval=0, stdout=self.out)
+
+
+class TestClearSharedFixturesCommand(TestCase):
+
+    def test_clear(self):
+        for func_name in ['catalog', 'regions', 'regions']:
+            SharedFixture.objects.create(
+                func_name=func_name, kwargs_hash=str(SharedFixture.objects.count()), code_hash=''
+            )
+        out = StringIO()
+        call_command('clear_shared_fixtures', 'regions', stdout=out)
+        self.assertEqual(out.getvalue(), "Cleared 2 shared fixture output(s).\n")
+        self.assertEqual(
+            list(SharedFixture.objects.values_list('func_name', flat=True)), ['catalog']
+        )
+        call_command('clear_shared_fixtures', stdout=out)
+        self.assertFalse(SharedFixture.objects.exists())
+
+
+class TestExportImportRecordCommands(TestCase):
+
+    @QuadeMock(managers, funcs=[customer_username, staff_user])
+    def setUp(self):
+        self.record = factories.Record(
+            scenario__config=[('customer_username', {}), ('staff_user', {})]
+        )
+        self.record.execute_test()
+        self.user = factories.UserAdmin()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'record.jsonl.gz')
+        self.out = StringIO()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def export(self, **kwargs):
+        call_command('export_record', str(self.record.pk), self.path, stdout=self.out, **kwargs)
+
+    def load(self, **kwargs):
+        kwargs.setdefault('username', self.user.username)
+        call_command('import_record', self.path, stdout=self.out, **kwargs)
+
+    def test_round_trip(self):
+        self.export(batch_size=1)
+        self.assertEqual(self.out.getvalue(), "Exported 2 rows to {}.\n".format(self.path))
+        self.load(batch_size=1)
+
+        imported = Record.objects.exclude(pk=self.record.pk).get()
+        self.assertIn("Imported Record #{} with 2 rows.".format(imported.pk), self.out.getvalue())
+        self.assertEqual(imported.status, Record.Status.READY)
+        self.assertEqual(imported.created_by, self.user)
+        self.assertEqual(imported.scenario, self.record.scenario)
+        originals = [obj.object for obj in self.record.recorded_objects.order_by('pk')]
+        copies = [obj.object for obj in imported.recorded_objects.order_by('pk')]
+        self.assertEqual(len(copies), 2)
+        for original, copy in zip(originals, copies):
+            self.assertNotEqual(copy.pk, original.pk)
+            self.assertEqual(copy.last_name, original.last_name)
+            self.assertNotEqual(copy.username, original.username)
+        self.assertEqual(imported.instructions.split('\n')[0], copies[0].username)
+
+    def test_unknown_scenario(self):
+        self.export()
+        Scenario.objects.filter(pk=self.record.scenario_id).update(slug='renamed')
+        with self.assertRaisesRegexp(CommandError, "There is no Scenario with slug"):
+            self.load()
+        self.assertEqual(Record.objects.count(), 1)
+
+    def test_not_an_export(self):
+        with gzip.open(self.path, 'wb') as fileobj:
+            fileobj.write(b'{"format": "something-else"}\n')
+        with self.assertRaisesRegexp(CommandError, "isn't a Quade record export"):
+            self.load()
+
+    def test_unexecuted_record(self):
+        self.record = factories.Record(status=Record.Status.FAILED)
+        with self.assertRaisesRegexp(CommandError, "hasn't executed successfully"):
+            self.export()
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,156 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from django.contrib.auth import get_user_model
+User = get_user_model()
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import models as m
+from django.test import TestCase
+
+from quade.copying import (
+    CopyError, RowCopier, dependency_order, recorded_models, rewrite_unique_value, serialize_rows,
+    unique_transform,
+)
+from quade.models import RecordedObject
+from . import factories
+
+
+class TestDependencyOrder(TestCase):
+
+    def test_targets_come_first(self):
+        self.assertEqual(dependency_order([Permission, User, ContentType]), [
+            User, ContentType, Permission
+        ])
+
+    def test_independent_models_sorted_by_label(self):
+        self.assertEqual(dependency_order([User, Group]), [Group, User])
+
+
+class TestRewriteUniqueValue(TestCase):
+
+    def test_char_field(self):
+        field = m.CharField(max_length=20)
+        self.assertEqual(rewrite_unique_value(field, 'alyssa', 'abc'), 'alyssa-abc')
+
+    def test_char_field_respects_max_length(self):
+        field = m.CharField(max_length=10)
+        self.assertEqual(rewrite_unique_value(field, 'alyssa-p-hacker', 'abc'), 'alyssa-abc')
+
+    def test_email_field(self):
+        field = m.EmailField()
+        self.assertEqual(
+            rewrite_unique_value(field, 'alyssa@example.com', 'abc'), 'alyssa+abc@example.com'
+        )
+
+    def test_unsupported_values_unchanged(self):
+        self.assertIsNone(rewrite_unique_value(m.CharField(), None, 'abc'))
+        self.assertEqual(rewrite_unique_value(m.IntegerField(), 42, 'abc'), 42)
+
+
+class TestUniqueTransform(TestCase):
+
+    def test_falls_back_to_default(self):
+        self.assertIs(unique_transform({}), rewrite_unique_value)
+        transform = unique_transform({'auth.user.username': lambda field, value, token: 'qa'})
+        self.assertEqual(transform(User._meta.get_field('username'), 'alyssa', 'abc'), 'qa')
+        self.assertEqual(transform(Group._meta.get_field('name'), 'Testers', 'abc'), 'Testers-abc')
+
+
+class TestRowCopier(TestCase):
+
+    def copy(self, *objs):
+        models = dependency_order(type(obj) for obj in objs)
+        copier = RowCopier(models)
+        copies = {}
+        for model in models:
+            pks = [obj.pk for obj in objs if type(obj) is model]
+            copies[model] = copier.copy(model, serialize_rows(model, pks))
+        copier.finish()
+        return copier, copies
+
+    def test_copies_rows_with_new_pks_and_unique_values(self):
+        user = factories.User(first_name='Alyssa')
+        copier, copies = self.copy(user)
+        [copy] = copies[User]
+        copy.refresh_from_db()
+        self.assertNotEqual(copy.pk, user.pk)
+        self.assertEqual(copy.first_name, 'Alyssa')
+        self.assertNotEqual(copy.username, user.username)
+        self.assertTrue(copy.username.startswith(user.username))
+        self.assertEqual(
+            copier.rewrite_text("Log in as {}".format(user.username)),
+            "Log in as {}".format(copy.username)
+        )
+
+    def test_rewrite_text_with_overlapping_values(self):
+        copier = RowCopier([])
+        copier.replacements = {'user1': 'user1-aaaa', 'user10': 'user10-bbbb'}
+        self.assertEqual(
+            copier.rewrite_text("user10, user1 and user100"),
+            "user10-bbbb, user1-aaaa and user10-bbbb0"
+        )
+
+    def test_m2m_remapped_among_copies(self):
+        permission = Permission.objects.first()
+        group = Group.objects.create(name='Testers')
+        group.permissions.add(permission)
+        user = factories.User()
+        user.groups.add(group)
+
+        _, copies = self.copy(user, group)
+
+        [group_copy], [user_copy] = copies[Group], copies[User]
+        self.assertEqual(list(user_copy.groups.all()), [group_copy])
+        # Permissions weren't copied, so the copy refers to the original.
+        self.assertEqual(list(group_copy.permissions.all()), [permission])
+
+    def test_m2m_inserted_with_each_chunk(self):
+        group = Group.objects.create(name='Testers')
+        users = [factories.User(), factories.User()]
+        for user in users:
+            user.groups.add(group)
+        copier = RowCopier([Group, User], batch_size=1)
+        [group_copy] = copier.copy(Group, serialize_rows(Group, [group.pk]))
+        for user in users:
+            [user_copy] = copier.copy(User, serialize_rows(User, [user.pk]))
+            # The relation doesn't wait for finish(), since the group was already copied.
+            self.assertEqual(list(user_copy.groups.all()), [group_copy])
+        self.assertEqual(copier._deferred_m2m, [])
+
+    def test_only_replacements_in_text_kept(self):
+        users = [factories.User(), factories.User()]
+        copier = RowCopier([User], text="Log in as {}".format(users[0].username))
+        copies = copier.copy(User, serialize_rows(User, [user.pk for user in users]))
+        self.assertEqual(list(copier.replacements), [users[0].username])
+        self.assertEqual(
+            copier.rewrite_text("Log in as {}".format(users[0].username)),
+            "Log in as {}".format(copies[0].username)
+        )
+
+    def test_references_to_uncopied_objects_unchanged(self):
+        recorded_object = factories.RecordedObject()
+        _, copies = self.copy(recorded_object)
+        [copy] = copies[RecordedObject]
+        self.assertNotEqual(copy.pk, recorded_object.pk)
+        self.assertEqual(copy.record_id, recorded_object.record_id)
+        self.assertEqual(copy.object, recorded_object.object)
+
+    def test_forward_reference_that_is_not_nullable(self):
+        permission = Permission.objects.first()
+        copier = RowCopier([Permission, ContentType])
+        with self.assertRaises(CopyError):
+            copier.copy(Permission, serialize_rows(Permission, [permission.pk]))
+
+
+class TestRecordedModels(TestCase):
+
+    def test_grouped_in_dependency_order(self):
+        record = factories.Record()
+        user = factories.User()
+        permission = Permission.objects.first()
+        RecordedObject.objects.create(record=record, object=permission)
+        RecordedObject.objects.create(record=record, object=user)
+        self.assertEqual(
+            list(recorded_models(record).items()),
+            [(Permission, [permission.pk]), (User, [user.pk])]
+        )
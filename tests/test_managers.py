@@ -1,12 +1,67 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import threading
+
+from django.apps import apps
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 User = get_user_model()
-from django.test import TestCase
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from mock import mock
 
+import quade
 from quade import managers
+from quade.models import RecordedObject, SharedFixture
+from quade.receivers import activate_capture, active_capture
 from .mock import QuadeMock
-from .fixtures import customer, staff_user_id
+from . import factories
+from .fixtures import customer, fail, staff_user, staff_user_id
+
+
+first_started = threading.Event()
+second_started = threading.Event()
+WAIT = {'timeout': 5}
+
+
+def first():
+    first_started.set()
+    return second_started.wait(WAIT['timeout'])
+
+
+def second():
+    second_started.set()
+    return first_started.wait(WAIT['timeout'])
+
+
+def echo(value):
+    return value
+
+
+def greet(name, greeting='Hello'):
+    return '{}, {}'.format(greeting, name)
+
+
+def capture_name():
+    return getattr(active_capture(), 'name', None)
+
+
+step_connections = []
+
+
+def create_user(name):
+    """Creates a user, noting the connection it used."""
+    step_connections.append(connections[DEFAULT_DB_ALIAS])
+    return User.objects.create(username=name).username
+
+
+class NamedCapture(object):
+
+    name = 'named capture'
+
+    def add(self, instance):
+        pass
 
 
 class TestExecution(TestCase):
@@ -40,6 +95,189 @@ class TestExecution(TestCase):
         self.assertEqual(instructions, '1')
 
 
+class TestParseSteps(TestCase):
+
+    def test_steps_depend_on_all_earlier_steps_by_default(self):
+        steps = managers.parse_steps([('customer', {}), ('staff_user', {'first_name': 'Ben'})])
+        self.assertEqual(steps, [
+            managers.Step(0, 'customer', 'customer', {}, ()),
+            managers.Step(1, 'staff_user', 'staff_user', {'first_name': 'Ben'}, (0,)),
+        ])
+
+    def test_named_dependencies(self):
+        steps = managers.parse_steps([
+            ('customer', {}, {'name': 'a', 'depends_on': []}),
+            ('customer', {}, {'name': 'b', 'depends_on': []}),
+            ('staff_user', {}, {'depends_on': ['b']}),
+            ('staff_user', {}),
+        ])
+        self.assertEqual([step.name for step in steps], ['a', 'b', 'staff_user', 'staff_user'])
+        self.assertEqual([step.depends_on for step in steps], [(), (), (1,), (0, 1, 2)])
+
+    def test_unknown_dependency(self):
+        with self.assertRaisesRegexp(managers.StepDependencyError, "not the name of an earlier"):
+            managers.parse_steps([
+                ('customer', {}, {'depends_on': ['staff_user']}),
+                ('staff_user', {}),
+            ])
+
+    def test_malformed_steps(self):
+        malformed = [
+            ({'customer': {}}, "config must be a list of steps"),
+            ([('customer', {}), 'staff_user'], r"step 1 must be \[func_name, kwargs\]"),
+            ([('customer',)], r"step 0 must be \[func_name, kwargs\]"),
+            ([(None, {})], "step 0: the function name must be a string"),
+            ([('customer', [])], r"step 0 \(customer\): kwargs must be a dict"),
+            ([('customer', {}, ['a'])], r"step 0 \(customer\): options must be a dict"),
+            ([('customer', {}, {'nme': 'a'})], r"step 0 \(customer\): unknown options: nme"),
+            ([('customer', {}, {'name': 1})], r"step 0 \(customer\): name must be a string"),
+            ([('customer', {}, {'depends_on': 'a'})], "depends_on must be a list of step names"),
+        ]
+        for config, message in malformed:
+            with self.assertRaisesRegexp(managers.StepFormatError, message):
+                managers.parse_steps(config)
+
+    def test_ambiguous_dependency(self):
+        with self.assertRaisesRegexp(managers.StepDependencyError, "more than one step"):
+            managers.parse_steps([
+                ('customer', {}),
+                ('customer', {}),
+                ('staff_user', {}, {'depends_on': ['customer']}),
+            ])
+
+
+@override_settings(QUADE=quade.Settings(allowed_envs=quade.AllEnvs, step_threads=4))
+class TestConcurrentExecution(TestCase):
+
+    def setUp(self):
+        first_started.clear()
+        second_started.clear()
+
+    @QuadeMock(managers, funcs=[first, second, echo])
+    def test_independent_steps_run_concurrently(self):
+        config = [
+            ('first', {}, {'depends_on': []}),
+            ('second', {}, {'depends_on': []}),
+            ('echo', {'value': 'done'}, {'depends_on': ['first', 'second']}),
+        ]
+        self.assertEqual(managers.manager.execute(config), 'True\nTrue\ndone')
+
+    @QuadeMock(managers, funcs=[echo])
+    def test_instructions_in_config_order(self):
+        config = [('echo', {'value': n}, {'depends_on': []}) for n in range(20)]
+        self.assertEqual(managers.manager.execute(config), '\n'.join(str(n) for n in range(20)))
+
+    @QuadeMock(managers, funcs=[first, second])
+    def test_dependent_steps_run_in_order(self):
+        config = [('first', {}), ('second', {})]
+        with mock.patch.dict(WAIT, timeout=0.1):
+            self.assertEqual(managers.manager.execute(config), 'False\nTrue')
+
+    @QuadeMock(managers, funcs=[fail, echo])
+    def test_failure_stops_dependents(self):
+        config = [('fail', {}), ('echo', {'value': 'never'})]
+        with mock.patch.object(managers.manager, '_call', wraps=managers.manager._call) as call:
+            with self.assertRaisesRegexp(ValueError, "Step failed"):
+                managers.manager.execute(config)
+        self.assertEqual(call.call_count, 1)
+
+    @QuadeMock(managers, funcs=[capture_name])
+    def test_threads_use_the_active_capture(self):
+        config = [('capture_name', {}, {'depends_on': []})] * 2
+        with activate_capture(NamedCapture()):
+            self.assertEqual(managers.manager.execute(config), 'named capture\nnamed capture')
+        self.assertEqual(managers.manager.execute(config), 'None\nNone')
+
+
+@override_settings(QUADE=quade.Settings(allowed_envs=quade.AllEnvs, step_threads=4))
+class TestConcurrentWrites(TransactionTestCase):
+    """Steps that save objects from several threads, each with its own database connection."""
+
+    def setUp(self):
+        del step_connections[:]
+
+    def tearDown(self):
+        # The tables are flushed after each test, so cached content types would be stale.
+        ContentType.objects.clear_cache()
+
+    def execute(self, count):
+        record = factories.Record(scenario__config=[
+            ('create_user', {'name': 'user-{}'.format(n)}, {'depends_on': []})
+            for n in range(count)
+        ])
+        closed_on = []
+        # SQLite's in-memory test database only allows one writer at a time, so steps (including
+        # what's saved around them) take turns, on the pool's threads.
+        call, lock = managers.manager._call, threading.Lock()
+
+        def take_turns(*args):
+            with lock:
+                return call(*args)
+
+        def close_all():
+            closed_on.append(threading.current_thread())
+        with mock.patch.object(managers.manager, '_call', side_effect=take_turns), \
+                mock.patch.object(managers.connections, 'close_all', side_effect=close_all):
+            record.execute_test()
+        return record, closed_on
+
+    @QuadeMock(managers, funcs=[create_user])
+    def test_objects_created_on_threads_are_recorded(self):
+        record, closed_on = self.execute(8)
+        self.assertEqual(
+            sorted(obj.object.username for obj in record.recorded_objects.all()),
+            ['user-{}'.format(n) for n in range(8)]
+        )
+        # Steps used the connections of the pool's threads, which were closed after each step.
+        main_connection = connections[DEFAULT_DB_ALIAS]
+        self.assertNotIn(main_connection, step_connections)
+        self.assertEqual(len(closed_on), 8)
+        self.assertNotIn(threading.current_thread(), closed_on)
+
+    @override_settings(QUADE=quade.Settings(
+        allowed_envs=quade.AllEnvs, step_threads=4, buffer_recorded_objects=True,
+        recorded_objects_batch_size=3,
+    ))
+    @QuadeMock(managers, funcs=[create_user])
+    def test_buffered_objects_created_on_threads_are_recorded(self):
+        record, _ = self.execute(8)
+        self.assertEqual(RecordedObject.objects.filter(record=record).count(), 8)
+        self.assertEqual(
+            sorted(obj.object.username for obj in record.recorded_objects.all()),
+            ['user-{}'.format(n) for n in range(8)]
+        )
+
+
+class TestCompile(TestCase):
+
+    @QuadeMock(managers, funcs=[greet, staff_user])
+    def test_defaults_applied(self):
+        plan = managers.manager.compile([
+            ('greet', {'name': 'Ben'}), ('staff_user', {'is_active': True}),
+        ])
+        self.assertEqual(plan.steps[0].kwargs, {'name': 'Ben', 'greeting': 'Hello'})
+        self.assertEqual(plan.steps[1].kwargs, {'is_active': True})
+        self.assertEqual(plan.funcs, {'greet': greet, 'staff_user': staff_user})
+        self.assertEqual(managers.manager.execute(plan).split('\n')[0], 'Hello, Ben')
+
+    @QuadeMock(managers, funcs=[greet])
+    def test_plans_cached_by_config_hash(self):
+        plan = managers.manager.compile([('greet', {'name': 'Ben'})])
+        self.assertIs(managers.manager.compile([['greet', {'name': 'Ben'}]]), plan)
+        self.assertEqual(plan.config_hash, managers.config_hash([('greet', {'name': 'Ben'})]))
+        self.assertIsNot(managers.manager.compile([('greet', {'name': 'Alyssa'})]), plan)
+
+    @QuadeMock(managers, funcs=[greet])
+    def test_missing_argument(self):
+        with self.assertRaisesRegexp(managers.StepArgumentError, r"step 0 \(greet\): missing"):
+            managers.manager.compile([('greet', {})])
+
+    @QuadeMock(managers, funcs=[greet])
+    def test_unexpected_argument(self):
+        with self.assertRaisesRegexp(managers.StepArgumentError, "unexpected keyword"):
+            managers.manager.compile([('greet', {'name': 'Ben', 'wave': True})])
+
+
 class TestValidation(TestCase):
 
     @QuadeMock(managers)
@@ -57,6 +295,94 @@ class TestValidation(TestCase):
             managers.manager.validate(config)
         self.assertEqual(exc.exception.unregistered_functions, set([bad_function]))
 
+    @QuadeMock(managers)
+    def test_validation_fails_with_bad_dependencies(self):
+        config = [('staff_user', {}, {'depends_on': ['customer']}), ('customer', {})]
+        with self.assertRaises(managers.StepDependencyError):
+            managers.manager.validate(config)
+
+
+class TestLazyLoading(TestCase):
+
+    def test_not_imported_at_startup(self):
+        with mock.patch('importlib.import_module') as mock_import:
+            apps.get_app_config('quade').ready()
+        mock_import.assert_not_called()
+
+    def test_imported_on_first_use(self):
+        manager = managers.FixtureManager()
+        with mock.patch('importlib.import_module') as mock_import:
+            self.assertEqual(manager.registry, {})
+            with self.assertRaises(managers.ConfigurationError):
+                manager.validate([('customer', {})])
+        mock_import.assert_called_once_with('quade.fixtures')
+
+    def test_not_imported_when_disallowed(self):
+        manager = managers.FixtureManager()
+        qs = quade.Settings(allowed_envs=lambda _: False)
+        with mock.patch('importlib.import_module') as mock_import, override_settings(QUADE=qs):
+            self.assertEqual(manager.registry, {})
+        mock_import.assert_not_called()
+
+
+def catalog(region='north'):
+    catalog.calls.append(region)
+    return customer()
+
+
+class TestSharedFixtures(TestCase):
+
+    def setUp(self):
+        catalog.calls = []
+
+    def register(self, **kwargs):
+        managers.register(shared=True, **kwargs)(catalog)
+
+    @QuadeMock(managers, funcs=[customer])
+    def test_called_once_per_kwargs(self):
+        self.register()
+        outputs = [managers.manager.execute([('catalog', {})]) for _ in range(2)]
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(catalog.calls, ['north'])
+        managers.manager.execute([('catalog', {'region': 'south'})])
+        managers.manager.execute([('catalog', {'region': 'north'})])
+        self.assertEqual(catalog.calls, ['north', 'south'])
+        self.assertEqual(SharedFixture.objects.count(), 2)
+
+    @QuadeMock(managers, funcs=[customer])
+    def test_expires(self):
+        self.register(ttl=60)
+        managers.manager.execute([('catalog', {})])
+        shared = SharedFixture.objects.get()
+        self.assertAlmostEqual(
+            (shared.expires_on - shared.created_on).total_seconds(), 60, delta=1
+        )
+        SharedFixture.objects.update(expires_on=timezone.now())
+        managers.manager.execute([('catalog', {})])
+        self.assertEqual(catalog.calls, ['north', 'north'])
+        self.assertEqual(SharedFixture.objects.count(), 1)
+
+    @QuadeMock(managers, funcs=[customer])
+    def test_recalled_when_code_changes(self):
+        self.register()
+        managers.manager.execute([('catalog', {})])
+        SharedFixture.objects.update(code_hash='old')
+        managers.manager.execute([('catalog', {})])
+        self.assertEqual(catalog.calls, ['north', 'north'])
+
+    @QuadeMock(managers, funcs=[customer])
+    def test_objects_not_recorded(self):
+        self.register()
+        record = factories.Record(scenario__config=[('catalog', {}), ('customer', {})])
+        record.execute_test()
+        recorded = [obj.object for obj in record.recorded_objects.all()]
+        self.assertEqual(len(recorded), 1)
+        self.assertEqual(record.instructions.split('\n')[1], recorded[0].get_full_name())
+
+    def test_ttl_requires_shared(self):
+        with self.assertRaises(ValueError):
+            managers.register(ttl=60)(catalog)
+
 
 class TestRegistration(TestCase):
 
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from mock import mock
+
+import quade
+from quade import managers, metrics
+from quade.metrics import MmapValues, read_values_file
+from quade.models import Record
+from . import factories
+from .fixtures import fail
+from .mock import QuadeMock
+
+
+class TestMmapValues(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'quade_1.metrics')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_values_persist(self):
+        values = MmapValues(self.path)
+        values.inc('a', 1)
+        values.inc('bé', 2.5)
+        values.inc('a', 1)
+        self.assertEqual(read_values_file(self.path), {'a': 2.0, 'bé': 2.5})
+        values = MmapValues(self.path)
+        values.inc('a', 1)
+        self.assertEqual(dict(values.items()), {'a': 3.0, 'bé': 2.5})
+
+    def test_grows(self):
+        values = MmapValues(self.path)
+        keys = ['key-{}'.format(number) for number in range(MmapValues.initial_size // 16)]
+        for key in keys:
+            values.inc(key, 1)
+        self.assertGreater(os.path.getsize(self.path), MmapValues.initial_size)
+        self.assertEqual(read_values_file(self.path), {key: 1.0 for key in keys})
+
+    def test_processes_added_up(self):
+        MmapValues(os.path.join(self.directory, 'quade_2.metrics')).inc('a', 2)
+        qs = quade.Settings(allowed_envs=quade.AllEnvs, metrics_dir=self.directory)
+        with override_settings(QUADE=qs), mock.patch('quade.metrics._values', {}):
+            metrics.get_values().inc('a', 1)
+            self.assertEqual(metrics.collect(), {'a': 3.0})
+
+
+class TestExecutionMetrics(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('quade.metrics._values', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def samples(self):
+        return {
+            line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+            for line in metrics.exposition().splitlines() if not line.startswith('#')
+        }
+
+    @QuadeMock(managers, funcs=[fail])
+    def test_failures_counted(self):
+        record = factories.Record(scenario__config=[('fail', {})])
+        with self.assertRaises(ValueError):
+            record.execute_test()
+        samples = self.samples()
+        label = 'scenario="{}"'.format(record.scenario.slug)
+        self.assertEqual(samples['quade_executions_total{{{},status="FAILED"}}'.format(label)], 1)
+        self.assertEqual(samples['quade_execution_seconds_count{{{}}}'.format(label)], 1)
+        self.assertNotIn('quade_captured_objects_count{{{}}}'.format(label), samples)
+
+    def test_errors_logged(self):
+        record = factories.Record(status=Record.Status.READY)
+        with mock.patch('quade.metrics.inc', side_effect=OSError), \
+                self.assertLogs('quade.metrics', 'ERROR'):
+            metrics.observe_execution(record, record.created_on)
@@ -2,14 +2,20 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 from django.contrib.auth import get_user_model
 User = get_user_model()
+from django.contrib.sessions.models import Session
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django_fsm.db.fields import TransitionNotAllowed
 from mock import mock
 
+import quade
 from quade import managers
-from quade.models import RecordedObject, Record, Scenario
+from quade.copying import CopyError
+from quade.models import RecordedObject, Record, Scenario, Snapshot
 from .mock import QuadeMock
+from .fixtures import customer, customer_username, fail, staff_user, staff_user_id
 from . import factories
 
 
@@ -81,6 +87,71 @@ class TestModels(TestCase):
             "config {} contains unregistered function(s): {}".format(config, bad_function)
         )
 
+    @QuadeMock(managers)
+    def test_dependency_error(self):
+        config = [('staff_user', {}, {'depends_on': ['nothing']})]
+        with self.assertRaises(ValidationError) as exc:
+            factories.Scenario(config=config)
+        self.assertEqual(
+            exc.exception.message,
+            "config {} has invalid step dependencies: step 0 (staff_user) depends on 'nothing', "
+            "which is not the name of an earlier step".format(config)
+        )
+
+    @QuadeMock(managers)
+    def test_format_error(self):
+        config = [('staff_user', {}), ('customer', {}, {'nme': 'a'})]
+        with self.assertRaises(ValidationError) as exc:
+            factories.Scenario(config=config)
+        self.assertEqual(
+            exc.exception.message,
+            "config {} is invalid: step 1 (customer): unknown options: nme".format(config)
+        )
+
+    @QuadeMock(managers)
+    def test_clean_reports_config_errors(self):
+        scenario = factories.Scenario.build(config=[['customer', None]])
+        with self.assertRaises(ValidationError) as exc:
+            scenario.clean()
+        [message] = exc.exception.message_dict['config']
+        self.assertIn("step 0 (customer): kwargs must be a dict", message)
+
+    @QuadeMock(managers)
+    def test_argument_error(self):
+        config = [('staff_user', {}), ('customer', {'first_name': 'Ben'})]
+        with self.assertRaises(ValidationError) as exc:
+            factories.Scenario(config=config)
+        self.assertEqual(
+            exc.exception.message,
+            "config {} has invalid arguments: step 1 (customer): got an unexpected keyword "
+            "argument 'first_name'".format(config)
+        )
+
+    @QuadeMock(managers)
+    def test_execute_test_records_config_hash(self):
+        record = factories.Record(scenario__config=[('customer', {})])
+        record.execute_test()
+        record.refresh_from_db()
+        self.assertEqual(record.config_hash, managers.config_hash([('customer', {})]))
+
+    @QuadeMock(managers)
+    def test_invalid_config_fails_before_executing(self):
+        record = factories.Record(
+            scenario__config=[('customer', {}), ('staff_user', {'first_name': 'Ben'})]
+        )
+        # The fixture is re-registered with a signature that the stored config no longer fits.
+        staff_user_id.__name__ = 'staff_user'
+        try:
+            managers.manager.register(staff_user_id)
+        finally:
+            staff_user_id.__name__ = 'staff_user_id'
+        initial_user_count = User.objects.count()
+        with self.assertRaises(managers.StepArgumentError):
+            record.execute_test()
+        self.assertEqual(User.objects.count(), initial_user_count)
+        record.refresh_from_db()
+        self.assertEqual(record.status, Record.Status.FAILED)
+
     def test_execute_test_transition(self):
         record = factories.Record()
         record.execute_test()
@@ -115,15 +186,17 @@ class TestModels(TestCase):
         self.assertTrue(user_object.object.is_staff)
 
     @QuadeMock(managers)
-    def test_signal_connection_and_disconnection(self):
+    def test_signal_not_connected_per_execution(self):
+        """The receiver is connected once, when the app is ready, rather than per execution."""
         record = factories.Record(scenario__config=[('staff_user', {})])
 
-        with mock.patch('quade.receivers.post_save') as mocked_post_save:
+        with mock.patch.object(post_save, 'connect') as mocked_connect, \
+                mock.patch.object(post_save, 'disconnect') as mocked_disconnect:
             record.execute_test()
 
-        mocked_post_save.connect.assert_called_once()
-        callback = mocked_post_save.connect.call_args[0][0]
-        mocked_post_save.disconnect.assert_called_once_with(callback)
+        mocked_connect.assert_not_called()
+        mocked_disconnect.assert_not_called()
+        self.assertTrue(record.recorded_objects.exists())
 
     @QuadeMock(managers)
     def test_recorded_objects_not_created_outside_test_execution(self):
@@ -138,8 +211,8 @@ class TestModels(TestCase):
     @QuadeMock(managers)
     def test_execute_test_that_errors(self):
         record = factories.Record(scenario__config=[('customer', {})])
-        with mock.patch('quade.models.manager') as mocked_manager:
-            mocked_manager.execute.side_effect = ValueError("Some error")
+        with mock.patch.object(managers.manager, 'execute') as mocked_execute:
+            mocked_execute.side_effect = ValueError("Some error")
             with self.assertRaises(ValueError):
                 record.execute_test()
         record.refresh_from_db()
@@ -147,6 +220,173 @@ class TestModels(TestCase):
         self.assertRegexpMatches(record.instructions, r"^ValueError\((u)?'Some error',\)$")
 
 
+class TestAtomicExecution(TestCase):
+
+    config = [('customer', {}), ('fail', {})]
+
+    @QuadeMock(managers, funcs=[customer, fail])
+    def test_failure_keeps_earlier_steps_by_default(self):
+        record = factories.Record(scenario__config=self.config)
+        users = User.objects.count()
+        with self.assertRaises(ValueError):
+            record.execute_test()
+        self.assertEqual(User.objects.count(), users + 1)
+        self.assertEqual(record.recorded_objects.count(), 1)
+
+    @QuadeMock(managers, funcs=[customer, fail])
+    def test_failure_rolls_back_every_step(self):
+        record = factories.Record(scenario__config=self.config)
+        users = User.objects.count()
+        qs = quade.Settings(allowed_envs=quade.AllEnvs, atomic_execution=True)
+        with override_settings(QUADE=qs), self.assertRaises(ValueError):
+            record.execute_test()
+        self.assertEqual(User.objects.count(), users)
+        self.assertFalse(record.recorded_objects.exists())
+        self.assertFalse(record.steps.exists())
+        record.refresh_from_db()
+        self.assertEqual(record.status, Record.Status.FAILED)
+
+    @QuadeMock(managers, funcs=[customer])
+    def test_steps_executed_in_one_thread(self):
+        record = factories.Record(
+            scenario__config=[('customer', {}, {'depends_on': []}), ('customer', {}, {'name': 'b'})]
+        )
+        qs = quade.Settings(allowed_envs=quade.AllEnvs, atomic_execution=True, step_threads=2)
+        with override_settings(QUADE=qs), mock.patch.object(
+            managers.manager, '_execute_concurrently'
+        ) as mock_concurrently:
+            record.execute_test()
+        mock_concurrently.assert_not_called()
+        self.assertEqual(record.recorded_objects.count(), 2)
+        self.assertEqual(record.status, Record.Status.READY)
+
+
+class TestClone(TestCase):
+
+    @QuadeMock(managers, funcs=[customer_username, staff_user])
+    def setUp(self):
+        self.record = factories.Record(
+            scenario__config=[('customer_username', {}), ('staff_user', {})]
+        )
+        self.record.execute_test()
+        self.user = factories.User()
+
+    def test_clone(self):
+        clone = self.record.clone(created_by=self.user)
+        self.assertEqual(clone.status, Record.Status.READY)
+        self.assertEqual(clone.created_by, self.user)
+        self.assertEqual(clone.config_hash, self.record.config_hash)
+        originals = [obj.object for obj in self.record.recorded_objects.order_by('pk')]
+        copies = [obj.object for obj in clone.recorded_objects.order_by('pk')]
+        self.assertEqual(len(copies), 2)
+        for original, copy in zip(originals, copies):
+            self.assertNotEqual(copy.pk, original.pk)
+            self.assertEqual(copy.last_name, original.last_name)
+            self.assertNotEqual(copy.username, original.username)
+        self.assertEqual(clone.instructions.split('\n')[0], copies[0].username)
+
+    def test_unique_transforms(self):
+        qs = quade.Settings(
+            allowed_envs=quade.AllEnvs,
+            unique_transforms={
+                'auth.User.username': lambda field, value, token: 'clone-{}'.format(token),
+            },
+        )
+        with override_settings(QUADE=qs):
+            clone = self.record.clone(created_by=self.user)
+        for recorded in clone.recorded_objects.all():
+            self.assertRegexpMatches(recorded.object.username, r'^clone-\w{8}$')
+
+    def test_not_executed(self):
+        for status in [Record.Status.NOT_READY, Record.Status.FAILED]:
+            record = factories.Record(status=status)
+            self.assertFalse(record.clonable)
+            with self.assertRaises(CopyError):
+                record.clone(created_by=self.user)
+
+
+class TestSnapshots(TestCase):
+
+    funcs = [customer_username, staff_user]
+    config = [('customer_username', {}), ('staff_user', {})]
+
+    def execute(self):
+        if not hasattr(self, 'scenario'):
+            self.scenario = factories.Scenario(config=self.config, use_snapshot=True)
+        record = factories.Record(scenario=self.scenario)
+        record.execute_test()
+        record.refresh_from_db()
+        return record
+
+    @QuadeMock(managers, funcs=funcs)
+    def test_snapshot_taken_after_execution(self):
+        record = self.execute()
+        snapshot = Snapshot.objects.get()
+        self.assertEqual(snapshot.record, record)
+        self.assertEqual(snapshot.instructions, record.instructions)
+        self.assertEqual(len(snapshot.rows), 2)
+
+    @QuadeMock(managers, funcs=funcs)
+    def test_not_taken_without_use_snapshot(self):
+        self.scenario = factories.Scenario(config=self.config)
+        self.execute()
+        self.assertFalse(Snapshot.objects.exists())
+
+    @QuadeMock(managers, funcs=funcs)
+    def test_later_records_replay_snapshot(self):
+        first = self.execute()
+        with mock.patch.object(managers.manager, 'execute') as mocked_execute:
+            second = self.execute()
+        mocked_execute.assert_not_called()
+        self.assertEqual(second.status, Record.Status.READY)
+
+        originals = [obj.object for obj in first.recorded_objects.order_by('pk')]
+        copies = [obj.object for obj in second.recorded_objects.order_by('pk')]
+        self.assertEqual(len(copies), 2)
+        self.assertFalse(set(originals) & set(copies))
+        for original, copy in zip(originals, copies):
+            self.assertNotEqual(copy.username, original.username)
+            self.assertEqual(copy.is_staff, original.is_staff)
+        self.assertEqual(second.instructions.split('\n')[0], copies[0].username)
+
+    @QuadeMock(managers, funcs=funcs)
+    def test_invalidated_when_config_changes(self):
+        self.execute()
+        self.scenario.config = [('staff_user', {})]
+        self.scenario.save()
+        self.assertIsNone(Snapshot.objects.current(self.scenario.config))
+        self.execute()
+        snapshot = Snapshot.objects.current(self.scenario.config)
+        self.assertEqual(len(snapshot.rows), 1)
+        self.assertTrue(snapshot.rows[0]['fields']['is_staff'])
+
+    @QuadeMock(managers, funcs=funcs)
+    def test_invalidated_when_fixture_code_changes(self):
+        self.execute()
+        with mock.patch.object(managers.manager, 'code_hash', return_value='changed'):
+            self.assertIsNone(Snapshot.objects.current(self.scenario.config))
+            with mock.patch.object(managers.manager, 'execute', return_value='') as mocked:
+                self.execute()
+        mocked.assert_called_once()
+
+
+class TestRecordQuerySet(TestCase):
+
+    def test_newest_first_breaks_ties_by_id(self):
+        records = [factories.Record() for _ in range(3)]
+        Record.objects.update(created_on=timezone.now())
+        self.assertEqual(list(Record.objects.newest_first()), records[::-1])
+
+    def test_older_than(self):
+        first, second, third = [factories.Record() for _ in range(3)]
+        Record.objects.filter(pk__in=[second.pk, third.pk]).update(created_on=timezone.now())
+        third.refresh_from_db()
+        self.assertEqual(
+            list(Record.objects.newest_first().older_than(third.created_on, third.id)),
+            [second, first]
+        )
+
+
 class TestRecordedObject(TestCase):
 
     def test_str(self):
@@ -155,3 +395,114 @@ class TestRecordedObject(TestCase):
             str(recorded_object),
             "RecordedObject #1: {}".format(recorded_object.object)
         )
+
+    def test_non_integer_primary_keys(self):
+        session = Session.objects.create(
+            session_key='abc123', session_data='', expire_date=timezone.now()
+        )
+        recorded_object = factories.RecordedObject(object=session)
+        recorded_object.refresh_from_db()
+        self.assertEqual(recorded_object.object_id, 'abc123')
+        self.assertEqual(recorded_object.object, session)
+
+
+class TestRecordLookups(TestCase):
+
+    def setUp(self):
+        self.user_object = factories.RecordedObject()
+        self.session = Session.objects.create(
+            session_key='abc123', session_data='', expire_date=timezone.now()
+        )
+        self.session_object = factories.RecordedObject(object=self.session)
+        self.other_user = factories.User()
+
+    def test_for_object(self):
+        self.assertEqual(
+            list(Record.objects.for_object(self.user_object.object)), [self.user_object.record]
+        )
+        self.assertEqual(
+            list(Record.objects.for_object(self.session)), [self.session_object.record]
+        )
+        self.assertFalse(Record.objects.for_object(self.other_user).exists())
+
+    def test_for_objects_in_one_query(self):
+        objects = [self.user_object.object, self.other_user, self.session]
+        with self.assertNumQueries(1):
+            records = Record.objects.for_objects(objects)
+        self.assertEqual(records, {
+            self.user_object.object: self.user_object.record,
+            self.session: self.session_object.record,
+        })
+
+    def test_for_objects_queryset(self):
+        records = Record.objects.for_objects(User.objects.all())
+        self.assertEqual(records, {self.user_object.object: self.user_object.record})
+
+    def test_for_objects_within_records(self):
+        records = Record.objects.exclude(pk=self.user_object.record.pk)
+        self.assertEqual(records.for_objects([self.user_object.object]), {})
+
+
+class TestPools(TestCase):
+
+    @QuadeMock(managers)
+    def setUp(self):
+        self.scenario = factories.Scenario(config=[('customer', {})], pool_size=2)
+        self.user = factories.User()
+
+    @QuadeMock(managers)
+    def test_refill_pool(self):
+        records = self.scenario.refill_pool()
+        self.assertEqual(len(records), 2)
+        for record in records:
+            record.refresh_from_db()
+            self.assertTrue(record.pooled)
+            self.assertIsNone(record.created_by)
+            self.assertEqual(record.status, Record.Status.READY)
+        self.assertEqual(self.scenario.refill_pool(), [])
+
+    @QuadeMock(managers)
+    def test_claim(self):
+        pooled = self.scenario.refill_pool()
+        first = Record.objects.claim(self.scenario, self.user)
+        second = Record.objects.claim(self.scenario, self.user)
+        self.assertEqual({first, second}, set(pooled))
+        self.assertIsNone(Record.objects.claim(self.scenario, self.user))
+        first.refresh_from_db()
+        self.assertFalse(first.pooled)
+        self.assertEqual(first.created_by, self.user)
+
+    @QuadeMock(managers)
+    def test_not_ready_records_cant_be_claimed(self):
+        factories.Record(scenario=self.scenario, pooled=True, created_by=None)
+        self.assertIsNone(Record.objects.claim(self.scenario, self.user))
+
+    @QuadeMock(managers)
+    def test_config_change_discards_pool(self):
+        pooled = self.scenario.refill_pool()
+        customers = RecordedObject.objects.filter(record__in=pooled).values_list('object_id')
+        customer_ids = [int(object_id) for object_id, in customers]
+        self.assertEqual(len(customer_ids), 2)
+        self.scenario.config = [('customer', {}), ('staff_user', {})]
+        self.scenario.save()
+        self.assertFalse(Record.objects.filter(pk__in=[record.pk for record in pooled]).exists())
+        self.assertFalse(User.objects.filter(pk__in=customer_ids).exists())
+        self.assertIsNone(Record.objects.claim(self.scenario, self.user))
+
+    @QuadeMock(managers)
+    def test_refill_discards_failed_records(self):
+        failed = factories.Record(
+            scenario=self.scenario, pooled=True, created_by=None, status=Record.Status.FAILED
+        )
+        self.assertEqual(len(self.scenario.refill_pool()), 2)
+        self.assertFalse(Record.objects.filter(pk=failed.pk).exists())
+
+    @QuadeMock(managers)
+    def test_refill_pools(self):
+        inactive = factories.Scenario(config=[('customer', {})])
+        leftover = factories.Record(
+            scenario=inactive, pooled=True, created_by=None, status=Record.Status.READY
+        )
+        inactive.deactivate()
+        self.assertEqual(len(Scenario.objects.refill_pools()), 2)
+        self.assertFalse(Record.objects.filter(pk=leftover.pk).exists())
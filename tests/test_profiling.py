@@ -0,0 +1,128 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from unittest import skipIf
+
+import django
+from django.contrib.admin import AdminSite, ModelAdmin
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils.six import StringIO
+
+import quade
+from quade import managers
+from quade.admin import ScenarioAdmin, register
+from quade.models import Record, Scenario
+from quade.profiling import profile_scenario
+from . import factories
+from .fixtures import customer, fail, staff_user
+from .mock import QuadeMock
+
+User = get_user_model()
+
+
+def lookups():
+    """Runs the same query several times."""
+    for _ in range(3):
+        list(User.objects.filter(username='nobody'))
+
+
+mock_fixtures = QuadeMock(managers, funcs=[customer, staff_user, lookups, fail])
+
+
+class TestProfileScenario(TestCase):
+
+    @mock_fixtures
+    def setUp(self):
+        self.scenario = factories.Scenario(
+            config=[('customer', {}), ('lookups', {}), ('staff_user', {})]
+        )
+        self.users = User.objects.count()
+
+    @mock_fixtures
+    def test_rolls_back(self):
+        profile = profile_scenario(self.scenario)
+        self.assertEqual(len(profile.output.split('\n')), 3)
+        self.assertEqual(User.objects.count(), self.users)
+        self.assertFalse(Record.objects.exists())
+
+    @skipIf(django.VERSION < (2, 0), "Logging queries requires Django 2.0+")
+    @mock_fixtures
+    def test_measurements(self):
+        profile = profile_scenario(self.scenario, trace_memory=True)
+        self.assertEqual(
+            [step['name'] for step in profile.steps], ['customer', 'lookups', 'staff_user']
+        )
+        self.assertEqual(profile.steps[1]['query_count'], 3)
+        self.assertEqual(profile.queries.count, sum(step['query_count'] for step in profile.steps))
+        [((sql, params), count)] = profile.queries.duplicates()
+        self.assertIn('"username" = %s', sql)
+        self.assertEqual(count, 3)
+
+    @skipIf(django.VERSION < (2, 0), "Logging queries requires Django 2.0+")
+    @mock_fixtures
+    def test_report(self):
+        report = profile_scenario(self.scenario).report(top=5)
+        self.assertRegexpMatches(
+            report[0], r"^Profiled scenario '{}' in [0-9.]+s \(rolled back\)\.$".format(
+                self.scenario.slug
+            )
+        )
+        self.assertRegexpMatches(report[1], r"^Queries: \d+, of which 2 repeated")
+        self.assertRegexpMatches(report[5], r"^- 1: lookups: [0-9.]+s, 3 queries$")
+        self.assertIn("Duplicated queries:", report)
+        self.assertIn("Top 5 functions by cumulative time:", report)
+
+    @mock_fixtures
+    def test_failing_step_rolled_back(self):
+        self.scenario.config = [('customer', {}), ('fail', {})]
+        with self.assertRaisesRegexp(ValueError, "Step failed"):
+            profile_scenario(self.scenario)
+        self.assertEqual(User.objects.count(), self.users)
+
+    @mock_fixtures
+    def test_command(self):
+        out = StringIO()
+        call_command('profile_scenario', self.scenario.slug, top=3, stdout=out)
+        self.assertIn("Top 3 functions by cumulative time:", out.getvalue())
+        self.assertEqual(User.objects.count(), self.users)
+
+    def test_command_unknown_scenario(self):
+        with self.assertRaisesRegexp(CommandError, "No scenario with slug"):
+            call_command('profile_scenario', 'does-not-exist', stdout=StringIO())
+
+    @override_settings(QUADE=quade.Settings())
+    def test_command_not_allowed(self):
+        with self.assertRaisesRegexp(CommandError, "disabled"):
+            call_command('profile_scenario', self.scenario.slug, stdout=StringIO())
+
+    @mock_fixtures
+    def test_admin_action(self):
+        model_admin = ScenarioAdmin(Scenario, AdminSite())
+        request = RequestFactory().post('/')
+        response = model_admin.profile_scenarios(request, Scenario.objects.all())
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertIn(
+            "Profiled scenario '{}'".format(self.scenario.slug), response.content.decode('utf-8')
+        )
+        self.assertEqual(User.objects.count(), self.users)
+
+
+class TestAdminRegistration(TestCase):
+
+    def test_registered(self):
+        site = AdminSite()
+        register(site)
+        self.assertIsInstance(site._registry[Scenario], ScenarioAdmin)
+
+    def test_own_admin_kept(self):
+        site = AdminSite()
+        site.register(Scenario, ModelAdmin)
+        register(site)
+        self.assertNotIsInstance(site._registry[Scenario], ScenarioAdmin)
+
+    @override_settings(QUADE=quade.Settings(register_admin=False))
+    def test_opt_out(self):
+        site = AdminSite()
+        register(site)
+        self.assertNotIn(Scenario, site._registry)
@@ -0,0 +1,176 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from contextlib import contextmanager
+import threading
+
+from django.contrib.auth import get_user_model
+User = get_user_model()
+from django.db import transaction
+from django.test import TestCase, override_settings
+from mock import mock
+
+import quade
+from quade import managers
+from quade.models import RecordedObject
+from quade.receivers import (
+    RecordedObjectBuffer, activate_capture, active_capture, associate_instance_with_qa_record,
+    capture_qa_objects,
+)
+from .fixtures import customer
+from .mock import QuadeMock
+from . import factories
+
+
+@transaction.atomic
+def failing_customer():
+    """Creates a customer, then raises, rolling the customer back."""
+    factories.User()
+    raise ValueError("Nope")
+
+
+@contextmanager
+def failing_monitor(run):
+    """Raises once the step has finished, after its transaction committed."""
+    yield
+    raise ValueError("Monitor failed")
+
+
+class ListCapture(list):
+
+    def add(self, instance):
+        self.append(instance)
+
+
+class TestCaptureRouting(TestCase):
+
+    def test_no_capture_outside_execution(self):
+        self.assertIsNone(active_capture())
+        user = factories.User()
+        associate_instance_with_qa_record(sender=User, instance=user, created=True)
+        self.assertFalse(RecordedObject.objects.exists())
+
+    def test_routes_to_active_capture(self):
+        capture = ListCapture()
+        with activate_capture(capture):
+            user = factories.User()
+        factories.User()  # Noise
+        self.assertEqual(capture, [user])
+
+    def test_updates_are_not_captured(self):
+        capture = ListCapture()
+        user = factories.User()
+        with activate_capture(capture):
+            user.save()
+        self.assertEqual(capture, [])
+
+    def test_innermost_capture_wins(self):
+        outer, inner = ListCapture(), ListCapture()
+        with activate_capture(outer):
+            first = factories.User()
+            with activate_capture(inner):
+                second = factories.User()
+            third = factories.User()
+        self.assertEqual(outer, [first, third])
+        self.assertEqual(inner, [second])
+
+    def test_other_threads_are_not_captured(self):
+        main_capture, thread_capture = ListCapture(), ListCapture()
+        user, other_user = factories.User.create_batch(2)
+        seen_in_thread = []
+
+        def save_in_thread():
+            seen_in_thread.append(active_capture())
+            associate_instance_with_qa_record(sender=User, instance=other_user, created=True)
+            with activate_capture(thread_capture):
+                associate_instance_with_qa_record(sender=User, instance=other_user, created=True)
+
+        with activate_capture(main_capture):
+            thread = threading.Thread(target=save_in_thread)
+            thread.start()
+            thread.join()
+            associate_instance_with_qa_record(sender=User, instance=user, created=True)
+
+        self.assertEqual(seen_in_thread, [None])
+        self.assertEqual(main_capture, [user])
+        self.assertEqual(thread_capture, [other_user])
+
+
+class TestRecordedObjectBuffer(TestCase):
+
+    def test_flush_writes_pending_objects(self):
+        record = factories.Record()
+        users = factories.User.create_batch(3)
+        buffer = RecordedObjectBuffer(record, batch_size=10)
+        for user in users:
+            buffer.add(user)
+        self.assertFalse(record.recorded_objects.exists())
+
+        buffer.flush()
+
+        self.assertEqual({obj.object for obj in record.recorded_objects.all()}, set(users))
+
+    def test_flushes_when_batch_size_is_reached(self):
+        record = factories.Record()
+        buffer = RecordedObjectBuffer(record, batch_size=2)
+        buffer.add(factories.User())
+        self.assertEqual(record.recorded_objects.count(), 0)
+        buffer.add(factories.User())
+        self.assertEqual(record.recorded_objects.count(), 2)
+
+    def test_flush_with_nothing_pending(self):
+        record = factories.Record()
+        with self.assertNumQueries(0):
+            RecordedObjectBuffer(record, batch_size=2).flush()
+
+
+@override_settings(QUADE=quade.Settings(allowed_envs=quade.AllEnvs, buffer_recorded_objects=True))
+class TestBufferedCapture(TestCase):
+
+    def test_objects_saved_on_exit(self):
+        record = factories.Record()
+        with capture_qa_objects(record):
+            user = factories.User()
+            self.assertFalse(record.recorded_objects.exists())
+        self.assertEqual([obj.object for obj in record.recorded_objects.all()], [user])
+
+    def test_objects_saved_when_execution_errors(self):
+        record = factories.Record()
+        with self.assertRaises(ValueError):
+            with capture_qa_objects(record):
+                user = factories.User()
+                raise ValueError
+        self.assertEqual([obj.object for obj in record.recorded_objects.all()], [user])
+
+    @QuadeMock(managers)
+    def test_execute_test_tracks_objects(self):
+        record = factories.Record(scenario__config=[('customer', {}), ('staff_user', {})])
+        with mock.patch.object(RecordedObject.objects, 'create') as mocked_create:
+            record.execute_test()
+        mocked_create.assert_not_called()
+        self.assertEqual(record.recorded_objects.count(), 2)
+        self.assertEqual(
+            {obj.object for obj in record.recorded_objects.all()},
+            set(User.objects.order_by('-pk')[:2])
+        )
+
+    @QuadeMock(managers, funcs=[customer, failing_customer])
+    def test_objects_of_failed_steps_are_not_saved(self):
+        record = factories.Record(scenario__config=[('customer', {}), ('failing_customer', {})])
+        with self.assertRaises(ValueError):
+            record.execute_test()
+        self.assertEqual(record.status, record.Status.FAILED)
+        self.assertEqual(
+            [obj.object for obj in record.recorded_objects.all()],
+            list(User.objects.exclude(pk=record.created_by_id))
+        )
+
+    @QuadeMock(managers)
+    def test_objects_saved_when_monitors_fail(self):
+        record = factories.Record()
+        with self.assertRaisesRegexp(ValueError, "Monitor failed"):
+            with capture_qa_objects(record):
+                managers.manager.execute([('customer', {})], monitors=[failing_monitor])
+        self.assertEqual(
+            [obj.object for obj in record.recorded_objects.all()],
+            list(User.objects.exclude(pk=record.created_by_id))
+        )
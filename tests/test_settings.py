@@ -1,11 +1,14 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-from django.apps import apps
 from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase, override_settings
 from mock import mock
 
 import quade
+from quade.managers import FixtureManager
+from quade.settings import (
+    validate_optional_string, validate_query_budget_action, validate_unique_transforms,
+)
 
 
 class TestModifyingDjangoSettings(object):
@@ -16,13 +19,13 @@ class TestModifyingDjangoSettings(object):
     active_on_prod = None
 
     def assertProperSetup(self, expected):
-        quade_config = apps.get_app_config('quade')
-        with mock.patch('quade.apps.manager') as mock_manager:
-            quade_config.ready()
+        manager = FixtureManager()
+        with mock.patch.object(manager, 'setup') as mock_setup:
+            manager.load()
             if expected:
-                mock_manager.setup.assert_called_once()
+                mock_setup.assert_called_once()
             else:
-                mock_manager.setup.assert_not_called()
+                mock_setup.assert_not_called()
 
     def setUp(self):
         self.QUADE = quade.Settings(allowed_envs=self.allowed_envs)
@@ -159,3 +162,40 @@ class TestUseCelery(TestCase):
     def test_boolean_required(self):
         with self.assertRaises(ImproperlyConfigured):
             quade.Settings(use_celery='True')
+
+
+class TestAllowedIsMemoized(TestCase):
+
+    def test_memoized_until_settings_change(self):
+        allowed_envs = mock.Mock(return_value=True)
+        qs = quade.Settings(allowed_envs=allowed_envs)
+        self.assertTrue(qs.allowed)
+        self.assertTrue(qs.allowed)
+        allowed_envs.assert_called_once()
+        allowed_envs.return_value = False
+        with override_settings(ENV='prod'):
+            self.assertFalse(qs.allowed)
+        self.assertEqual(allowed_envs.call_count, 2)
+
+
+class TestCacheAlias(TestCase):
+
+    def test_string_required(self):
+        with self.assertRaises(ImproperlyConfigured):
+            quade.Settings(cache_alias=1)
+
+
+class TestValidators(TestCase):
+
+    def test_optional_string(self):
+        self.assertIsNone(validate_optional_string(None))
+        with self.assertRaises(TypeError):
+            validate_optional_string(1)
+
+    def test_unique_transforms(self):
+        with self.assertRaises(TypeError):
+            validate_unique_transforms({'auth.user.username': 'not a callable'})
+
+    def test_query_budget_action(self):
+        with self.assertRaises(TypeError):
+            validate_query_budget_action('explode')
@@ -31,3 +31,11 @@ class TestExecuteTask(TestCase):
         execute_test_task(record.id)
         record.refresh_from_db()
         self.assertEqual(record.status, Record.Status.READY)
+
+    @QuadeMock(managers)
+    @requires_celery
+    def test_refill_pools(self):
+        from quade.tasks import refill_pools_task
+        scenario = factories.Scenario(config=[('customer', {})], pool_size=2)
+        refill_pools_task()
+        self.assertEqual(Record.objects.in_pool(scenario).count(), 2)
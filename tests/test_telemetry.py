@@ -0,0 +1,226 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from contextlib import contextmanager
+from unittest import skipIf
+
+import django
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from mock import mock
+
+import quade
+from quade import managers
+from quade.models import Record
+from quade.receivers import capture_qa_objects
+from quade.telemetry import QueryBudgetExceeded, StepTelemetry, normalize_sql, tracemalloc
+from .fixtures import customer_username, fail, staff_user
+from .mock import QuadeMock
+from . import factories
+
+
+def make_users(count):
+    """Saves users one at a time."""
+    for number in range(count):
+        get_user_model().objects.create(username='user-{}'.format(number))
+    return count
+
+
+def completed_steps():
+    """Reports the progress saved for the executing Record."""
+    return Record.objects.values_list('completed_steps', flat=True).get()
+
+
+class TestMonitors(TestCase):
+
+    @QuadeMock(managers, funcs=[customer_username, staff_user])
+    def test_monitors_see_each_step_and_its_output(self):
+        seen = []
+
+        @contextmanager
+        def monitor(run):
+            seen.append(('enter', run.step.name, run.output))
+            yield
+            seen.append(('exit', run.step.name, run.output))
+
+        output = managers.manager.execute(
+            [('customer_username', {}), ('staff_user', {})], monitors=[monitor]
+        )
+        first, second = output.split('\n')
+        self.assertEqual(seen, [
+            ('enter', 'customer_username', None),
+            ('exit', 'customer_username', first),
+            ('enter', 'staff_user', None),
+            ('exit', 'staff_user', second),
+        ])
+
+
+class TestStepTelemetry(TestCase):
+
+    @skipIf(tracemalloc is None, "tracemalloc requires Python 3.4+")
+    @QuadeMock(managers, funcs=[customer_username, staff_user])
+    def test_measurements(self):
+        telemetry = StepTelemetry()
+        record = factories.Record()
+        with capture_qa_objects(record):
+            managers.manager.execute(
+                [('customer_username', {}), ('staff_user', {})], monitors=[telemetry]
+            )
+        self.assertEqual(sorted(telemetry.measurements), [0, 1])
+        for index, name in enumerate(['customer_username', 'staff_user']):
+            measurement = telemetry.measurements[index]
+            self.assertEqual(measurement['name'], name)
+            self.assertGreaterEqual(measurement['duration'], 0)
+            if django.VERSION >= (2, 0):
+                self.assertGreater(measurement['query_count'], 0)
+            else:  # Queries can't be counted.
+                self.assertIsNone(measurement['query_count'])
+            self.assertEqual(measurement['objects_captured'], 1)
+            self.assertGreater(measurement['memory_peak'], 0)
+        # Counting doesn't stop objects from being recorded.
+        self.assertEqual(record.recorded_objects.count(), 2)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    @QuadeMock(managers, funcs=[customer_username])
+    def test_without_memory_tracing(self):
+        telemetry = StepTelemetry(trace_memory=False)
+        managers.manager.execute([('customer_username', {})], monitors=[telemetry])
+        self.assertIsNone(telemetry.measurements[0]['memory_peak'])
+        self.assertEqual(telemetry.measurements[0]['objects_captured'], 1)
+
+
+class TestRecordSteps(TestCase):
+
+    config = [('customer_username', {}), ('staff_user', {})]
+
+    @QuadeMock(managers, funcs=[customer_username, staff_user])
+    def test_saved_when_enabled(self):
+        record = factories.Record(scenario=factories.Scenario(config=self.config))
+        with override_settings(QUADE=quade.Settings(collect_telemetry=True)):
+            record.execute_test()
+        steps = list(record.steps.all())
+        self.assertEqual([step.name for step in steps], ['customer_username', 'staff_user'])
+        self.assertEqual([step.objects_captured for step in steps], [1, 1])
+
+    @QuadeMock(managers, funcs=[customer_username, staff_user])
+    def test_not_measured_by_default(self):
+        record = factories.Record(scenario=factories.Scenario(config=self.config))
+        record.execute_test()
+        for step in record.steps.all():
+            self.assertIsNone(step.duration)
+            self.assertIsNone(step.query_count)
+            self.assertIsNone(step.objects_captured)
+            self.assertIsNone(step.memory_peak)
+
+    @QuadeMock(managers, funcs=[customer_username, fail])
+    def test_saved_for_failed_records(self):
+        config = [('customer_username', {}), ('fail', {})]
+        record = factories.Record(scenario=factories.Scenario(config=config))
+        with override_settings(QUADE=quade.Settings(collect_telemetry=True)):
+            with self.assertRaises(ValueError):
+                record.execute_test()
+        record.refresh_from_db()
+        self.assertEqual(record.status, Record.Status.FAILED)
+        self.assertEqual(
+            list(record.steps.values_list('name', 'objects_captured')),
+            [('customer_username', 1), ('fail', 0)]
+        )
+
+    @QuadeMock(managers, funcs=[customer_username, completed_steps])
+    def test_saved_as_each_step_finishes(self):
+        config = [('customer_username', {}), ('completed_steps', {})]
+        record = factories.Record(scenario=factories.Scenario(config=config))
+        record.execute_test()
+        username, progress = record.instructions.split('\n')
+        self.assertEqual(progress, '1')
+        self.assertEqual(
+            list(record.steps.values_list('name', 'output')),
+            [('customer_username', username), ('completed_steps', '1')]
+        )
+        record.refresh_from_db()
+        self.assertEqual((record.completed_steps, record.total_steps), (2, 2))
+        # Steps aren't mistaken for objects created by the scenario.
+        self.assertEqual(record.recorded_objects.count(), 1)
+
+    @QuadeMock(managers, funcs=[customer_username, fail])
+    def test_failed_step_has_no_output(self):
+        config = [('customer_username', {}), ('fail', {})]
+        record = factories.Record(scenario=factories.Scenario(config=config))
+        with self.assertRaises(ValueError):
+            record.execute_test()
+        record.refresh_from_db()
+        self.assertEqual((record.completed_steps, record.total_steps), (1, 2))
+        self.assertIsNone(record.steps.get(name='fail').output)
+
+
+@QuadeMock(managers, funcs=[])
+def execute_budgeted(count, budget):
+    managers.register(query_budget=budget)(make_users)
+    return managers.manager.execute([('make_users', {'count': count})])
+
+
+class TestQueryBudgets(TestCase):
+
+    def test_within_budget(self):
+        with mock.patch('quade.telemetry.logger') as logger:
+            execute_budgeted(count=3, budget=10)
+        self.assertFalse(logger.warning.called)
+
+    @skipIf(django.VERSION < (2, 0), "Counting queries requires Django 2.0+")
+    def test_over_budget_warns(self):
+        with self.assertLogs('quade.telemetry', 'WARNING') as logs:
+            self.assertEqual(execute_budgeted(count=5, budget=2), '5')
+        [message] = logs.records
+        lines = message.getMessage().split('\n')
+        self.assertRegexpMatches(
+            lines[0], r"^Step 0 \(make_users\) ran \d+ queries, over its budget of 2\.$"
+        )
+        self.assertEqual(lines[1], "Likely N+1 queries:")
+        self.assertRegexpMatches(
+            lines[2], r'^- 5x at .*test_telemetry\.py:\d+: INSERT INTO "auth_user"'
+        )
+
+    @skipIf(django.VERSION < (2, 0), "Counting queries requires Django 2.0+")
+    @override_settings(
+        QUADE=quade.Settings(allowed_envs=quade.AllEnvs, query_budget_action='fail')
+    )
+    def test_over_budget_fails(self):
+        with self.assertRaisesRegexp(QueryBudgetExceeded, "over its budget of 2"):
+            execute_budgeted(count=5, budget=2)
+
+    @QuadeMock(managers, funcs=[])
+    def assert_over_budget_rolled_back(self, buffer_recorded_objects):
+        managers.register(query_budget=1)(make_users)
+        record = factories.Record(scenario__config=[('make_users', {'count': 5})])
+        users = get_user_model().objects.count()
+        settings = quade.Settings(
+            allowed_envs=quade.AllEnvs, query_budget_action='fail',
+            buffer_recorded_objects=buffer_recorded_objects,
+        )
+        with override_settings(QUADE=settings):
+            with self.assertRaises(QueryBudgetExceeded):
+                record.execute_test()
+        self.assertEqual(record.status, Record.Status.FAILED)
+        self.assertEqual(get_user_model().objects.count(), users)
+        self.assertFalse(record.recorded_objects.exists())
+
+    @skipIf(django.VERSION < (2, 0), "Counting queries requires Django 2.0+")
+    def test_over_budget_rolls_back_step(self):
+        self.assert_over_budget_rolled_back(buffer_recorded_objects=False)
+
+    @skipIf(django.VERSION < (2, 0), "Counting queries requires Django 2.0+")
+    def test_over_budget_rolls_back_buffered_step(self):
+        self.assert_over_budget_rolled_back(buffer_recorded_objects=True)
+
+    def test_negative_budget(self):
+        with self.assertRaises(ValueError):
+            managers.register(query_budget=-1)
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql('SELECT * FROM "t" WHERE "id" IN (%s, %s, %s) AND "x" = %s'),
+            'SELECT * FROM "t" WHERE "id" IN (...) AND "x" = %s',
+        )
+        self.assertEqual(
+            normalize_sql('INSERT INTO "t" ("a", "b") VALUES (%s, %s), (%s, %s)'),
+            'INSERT INTO "t" ("a", "b") VALUES (...)',
+        )
@@ -1,8 +1,15 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import json
+import re
+
 from django.contrib.auth import get_user_model
 User = get_user_model()
-from django.test import override_settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 try:
     from django.urls import reverse
 except ImportError:
@@ -12,10 +19,11 @@ from mock import mock
 
 import quade
 from quade import managers
-from quade.models import Record
+from quade.models import Record, RecordedObject, RecordStep
+from quade.views import MainView, RecordDetailView, RecordHistoryView, RecordProgressView
 
 from .mock import QuadeMock
-from .utils import requires_celery
+from .utils import CSRF_MIDDLEWARE, login, on_commit_immediately, requires_celery
 from . import factories
 
 
@@ -32,6 +40,7 @@ class TestViewPermissionsBase(object):
             ('get', reverse('quade-main')),
             ('post', reverse('quade-main')),
             ('post', reverse('quade-mark-done', args=[self.test_record.id])),
+            ('get', reverse('quade-metrics')),
         ]
 
     def _access_checker(self, allowed):
@@ -129,11 +138,39 @@ class TestViews(WebTest):
         url = reverse('quade-main')
         qs = quade.Settings(use_celery=True)
         with mock.patch('quade.tasks.execute_test_task') as mock_task, override_settings(QUADE=qs):
-            self.app.post(url, params={'scenarios': scenario.slug})
+            with on_commit_immediately():
+                self.app.post(url, params={'scenarios': scenario.slug})
         new_record = Record.objects.last()
         mock_task.delay.assert_called_once_with(new_record.id)
         self.assertEqual(new_record.status, Record.Status.NOT_READY)
 
+    @QuadeMock(managers)
+    def test_execute_claims_pooled_record(self):
+        scenario = factories.Scenario(config=[('customer', {})], pool_size=1)
+        pooled, = scenario.refill_pool()
+        self.app.post(reverse('quade-main'), params={'scenarios': scenario.slug})
+        self.assertEqual(Record.objects.count(), 1)
+        pooled.refresh_from_db()
+        self.assertFalse(pooled.pooled)
+        self.assertEqual(pooled.created_by, self.superuser)
+
+    @QuadeMock(managers)
+    @requires_celery
+    def test_claim_refills_pool_through_celery(self):
+        scenario = factories.Scenario(config=[('customer', {})], pool_size=1)
+        scenario.refill_pool()
+        qs = quade.Settings(use_celery=True)
+        with mock.patch('quade.tasks.refill_pool_task') as mock_task, override_settings(QUADE=qs):
+            self.app.post(reverse('quade-main'), params={'scenarios': scenario.slug})
+        mock_task.delay.assert_called_once_with(scenario.pk)
+
+    def test_main_page_hides_pooled_records(self):
+        pooled = factories.Record(pooled=True, created_by=None, status=Record.Status.READY)
+        claimed = factories.Record(status=Record.Status.READY)
+        resp = self.app.get(reverse('quade-main'))
+        self.assertIn(reverse('quade-record', args=[claimed.pk]), resp.text)
+        self.assertNotIn(reverse('quade-record', args=[pooled.pk]), resp.text)
+
     def test_execute_without_test_scenario_defined(self):
         initial_count = Record.objects.count()
         url = reverse('quade-main')
@@ -186,9 +223,280 @@ class TestViews(WebTest):
             resp = self.app.get(url)
         self.assertNotIn('form id="scenario-executor"', resp.text)
 
+    def test_main_page_shows_record_steps(self):
+        record = factories.Record()
+        RecordStep.objects.create(
+            record=record, index=0, name='make_customer', duration=1.5, query_count=12,
+            objects_captured=3, memory_peak=2048,
+        )
+        resp = self.app.get(reverse('quade-main'))
+        self.assertIn('make_customer', resp.text)
+        self.assertIn('1.500s', resp.text)
+        self.assertIn('2.0 kB', resp.text)
+
+    def progress_events(self, *ids, **headers):
+        url = '{}?ids={}'.format(reverse('quade-records-progress'), ','.join(map(str, ids)))
+        with mock.patch.object(RecordProgressView, 'max_duration', 0):
+            resp = self.app.get(url, headers=headers)
+        self.assertEqual(resp.content_type, 'text/event-stream')
+        events = []
+        for event in resp.text.split('\n\n')[1:-1]:
+            lines = dict(line.split(': ', 1) for line in event.split('\n'))
+            events.append((lines['event'], lines.get('id'), json.loads(lines['data'])))
+        return events
+
+    def test_record_progress_streams_steps_until_done(self):
+        record = factories.Record(status=Record.Status.READY, instructions='done', total_steps=1)
+        step = RecordStep.objects.create(record=record, index=0, name='make', output='made')
+        events = self.progress_events(record.id)
+        self.assertEqual(events[0], ('step', str(step.id), {
+            'id': step.id, 'record': record.id, 'index': 0, 'name': 'make', 'output': 'made'
+        }))
+        self.assertEqual([event[0] for event in events[1:]], ['progress', 'done'])
+        self.assertEqual(events[2][2]['instructions'], 'done')
+
+    def test_record_progress_resumes_after_last_event(self):
+        record = factories.Record(total_steps=2)
+        first = RecordStep.objects.create(record=record, index=0, name='first', output='1')
+        RecordStep.objects.create(record=record, index=1, name='second', output='2')
+        events = self.progress_events(record.id, **{'Last-Event-ID': str(first.id)})
+        self.assertEqual([data['name'] for name, _, data in events if name == 'step'], ['second'])
+        # The Record is still executing, so the stream ends without a "done" event.
+        self.assertEqual([event[0] for event in events], ['step', 'progress'])
+
+    def test_record_progress_of_many_records_in_one_stream(self):
+        executing = factories.Record(total_steps=2)
+        finished = factories.Record(status=Record.Status.READY)
+        RecordStep.objects.create(record=executing, index=0, name='first', output='1')
+        events = self.progress_events(executing.id, finished.id, 0)
+        self.assertEqual([(name, data['record']) for name, _, data in events], [
+            ('step', executing.id),
+            ('progress', executing.id),
+            ('progress', finished.id),
+            ('done', finished.id),
+            ('gone', 0),
+        ])
+
+    def test_main_page_follows_executing_records_in_one_stream(self):
+        executing = [factories.Record(), factories.Record()]
+        factories.Record(status=Record.Status.READY)
+        resp = self.app.get(reverse('quade-main'))
+        rows = resp.html.select('[data-in-progress]')
+        self.assertEqual(
+            sorted(int(row.attrs['data-in-progress']) for row in rows),
+            [record.id for record in executing]
+        )
+        self.assertEqual(resp.text.count('new EventSource('), 1)
+
+    def test_record_progress_invalid_ids(self):
+        url = '{}?ids=1,x'.format(reverse('quade-records-progress'))
+        self.assertEqual(self.app.get(url, expect_errors=True).status_code, 400)
+
     def test_mark_done(self):
         test_record = factories.Record()
         url = reverse('quade-mark-done', args=[test_record.id])
         self.app.post(url)
         test_record.refresh_from_db()
         self.assertEqual(test_record.status, Record.Status.DONE)
+
+
+@override_settings(QUADE=quade.Settings(allowed_envs=quade.AllEnvs, cache_alias='default'))
+class TestMainViewCaching(WebTest):
+
+    def setUp(self):
+        cache.clear()
+        self.app.set_user(factories.UserAdmin())
+        self.scenario = factories.Scenario()
+        self.record = factories.Record(scenario=self.scenario)
+
+    def quade_queries(self):
+        """GET the main page, returning the response and the queries on Quade's tables."""
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.app.get(reverse('quade-main'))
+        return resp, [query for query in queries.captured_queries if 'quade_' in query['sql']]
+
+    def test_cached(self):
+        self.quade_queries()
+        resp, queries = self.quade_queries()
+        self.assertEqual(queries, [])
+        self.assertIn(self.scenario.slug, resp.text)
+        self.assertIn(reverse('quade-record', args=[self.record.pk]), resp.text)
+
+    def test_invalidated_by_scenario_changes(self):
+        self.quade_queries()
+        new_scenario = factories.Scenario()
+        self.scenario.deactivate()
+        resp, _ = self.quade_queries()
+        select = resp.forms['scenario-executor']['scenarios']
+        self.assertEqual([value for value, _, _ in select.options], ['', new_scenario.slug])
+
+    def test_invalidated_by_record_changes(self):
+        self.quade_queries()
+        new_record = factories.Record(scenario=self.scenario)
+        resp, _ = self.quade_queries()
+        new_record_url = reverse('quade-record', args=[new_record.pk])
+        self.assertIn(new_record_url, resp.text)
+        self.assertIn('Mark Done', resp.text)
+        new_record.delete()
+        self.record.status = Record.Status.DONE
+        self.record.save()
+        resp, _ = self.quade_queries()
+        self.assertNotIn(new_record_url, resp.text)
+        self.assertNotIn('Mark Done', resp.text)
+
+    def test_csrf_token_per_request(self):
+        self.quade_queries()
+        client = Client(enforce_csrf_checks=True)
+        login(client, factories.UserAdmin())
+        with modify_settings(**CSRF_MIDDLEWARE):
+            html = client.get(reverse('quade-main')).content.decode('utf-8')
+            self.assertNotIn(MainView.csrf_placeholder, html)
+            # The last token on the page is in the cached table's "Mark Done" form.
+            token = re.findall(r"name='csrfmiddlewaretoken' value='(\w+)'", html)[-1]
+            resp = client.post(
+                reverse('quade-mark-done', args=[self.record.pk]), {'csrfmiddlewaretoken': token}
+            )
+        self.assertEqual(resp.status_code, 302)
+
+
+class TestRecordHistory(WebTest):
+
+    def setUp(self):
+        self.app.set_user(factories.UserAdmin())
+        self.url = reverse('quade-history')
+
+    def ids(self, resp):
+        return [int(row['data-record-id']) for row in resp.html.select('tr[data-record-id]')]
+
+    def test_pages_through_ties_in_order(self):
+        records = [factories.Record() for _ in range(5)]
+        Record.objects.update(created_on=timezone.now())  # Every Record ties on created_on.
+        expected = sorted((record.id for record in records), reverse=True)
+        with mock.patch.object(RecordHistoryView, 'page_size', 2):
+            seen = []
+            resp = self.app.get(self.url)
+            while True:
+                seen.extend(self.ids(resp))
+                older = resp.html.find('a', string='Older')
+                if older is None:
+                    break
+                resp = self.app.get(older['href'])
+        self.assertEqual(seen, expected)
+
+    def test_filters(self):
+        scenario = factories.Scenario()
+        done = factories.Record(scenario=scenario, status=Record.Status.DONE)
+        factories.Record(scenario=scenario)  # Noise
+        factories.Record(status=Record.Status.DONE)  # Noise
+        resp = self.app.get(self.url, params={
+            'scenario': scenario.slug, 'status': Record.Status.DONE,
+            'created_by': done.created_by.username,
+        })
+        self.assertEqual(self.ids(resp), [done.id])
+
+    def test_invalid_filters(self):
+        factories.Record()
+        resp = self.app.get(self.url, params={'created_by': 'nobody', 'after': 'garbage'})
+        self.assertEqual(self.ids(resp), [])
+        self.assertIn('No user with this username.', resp.text)
+        self.assertIn('Invalid cursor.', resp.text)
+
+
+class TestCloneRecord(WebTest):
+
+    def setUp(self):
+        self.superuser = factories.UserAdmin()
+        self.app.set_user(self.superuser)
+
+    @QuadeMock(managers)
+    def test_clone(self):
+        record = factories.Record(scenario__config=[('customer', {})])
+        record.execute_test()
+        resp = self.app.get(reverse('quade-record', args=[record.pk]))
+        resp = resp.forms[0].submit().follow()
+        clone = Record.objects.latest('pk')
+        self.assertEqual(resp.request.path, reverse('quade-record', args=[clone.pk]))
+        self.assertEqual(clone.created_by, self.superuser)
+        self.assertEqual(clone.recorded_objects.count(), 1)
+
+    def test_failed_record(self):
+        record = factories.Record(status=Record.Status.FAILED)
+        resp = self.app.get(reverse('quade-record', args=[record.pk]))
+        self.assertNotIn('Clone', resp.text)
+        self.app.post(reverse('quade-clone-record', args=[record.pk]), status=400)
+
+
+class TestMetricsView(WebTest):
+
+    def setUp(self):
+        self.app.set_user(factories.UserAdmin())
+
+    @QuadeMock(managers)
+    def test_metrics(self):
+        record = factories.Record(scenario__config=[('customer', {})])
+        factories.Record(scenario=record.scenario)
+        with mock.patch('quade.metrics._values', {}):
+            record.execute_test()
+            resp = self.app.get(reverse('quade-metrics'))
+        self.assertEqual(resp.content_type, 'text/plain')
+        lines = resp.text.splitlines()
+        scenario = 'scenario="{}"'.format(record.scenario.slug)
+        self.assertIn('# TYPE quade_executions_total counter', lines)
+        self.assertIn('quade_executions_total{{{},status="READY"}} 1.0'.format(scenario), lines)
+        self.assertIn('quade_execution_seconds_count{{{}}} 1.0'.format(scenario), lines)
+        self.assertIn('quade_queued_seconds_bucket{{le="+Inf",{}}} 1.0'.format(scenario), lines)
+        self.assertIn('quade_captured_objects_bucket{{le="1.0",{}}} 1.0'.format(scenario), lines)
+        self.assertIn('quade_captured_objects_sum{{{}}} 1.0'.format(scenario), lines)
+        self.assertIn('quade_records{status="NOT_READY"} 1.0', lines)
+        self.assertIn('quade_records{status="IN_PROGRESS"} 0.0', lines)
+
+
+class TestRecordDetail(WebTest):
+
+    def setUp(self):
+        self.app.set_user(factories.UserAdmin())
+
+    def record_with_objects(self, users, scenarios):
+        record = factories.Record()
+        for obj in [factories.User() for _ in range(users)] + \
+                [factories.Scenario() for _ in range(scenarios)]:
+            RecordedObject.objects.create(record=record, object=obj)
+        return record
+
+    def get(self, record, **params):
+        return self.app.get(reverse('quade-record', args=[record.id]), params=params)
+
+    def test_groups_objects_by_content_type(self):
+        record = self.record_with_objects(users=2, scenarios=1)
+        resp = self.get(record)
+        headings = [h.text for h in resp.html.find_all('h5')]
+        self.assertEqual(headings, ['auth.user', 'quade.scenario'])
+        counts = [li.text for li in resp.html.select('.recorded-object-counts li')]
+        self.assertEqual(counts, ['auth.user: 2', 'quade.scenario: 1'])
+        for recorded in record.recorded_objects.all():
+            self.assertIn(str(recorded.object), resp.text)
+
+    def test_queries_dont_grow_with_objects(self):
+        queries = []
+        for users in [2, 20]:
+            record = self.record_with_objects(users=users, scenarios=2)
+            self.get(record)  # Warm up caches, e.g. of content types.
+            with CaptureQueriesContext(connection) as captured:
+                self.get(record)
+            queries.append(len(captured))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_paginates(self):
+        record = self.record_with_objects(users=3, scenarios=0)
+        with mock.patch.object(RecordDetailView, 'page_size', 2):
+            first = self.get(record)
+            second = self.get(record, page=2)
+            self.app.get(reverse('quade-record', args=[record.id]), params={'page': 3}, status=404)
+        self.assertEqual(len(first.html.select('.recorded-objects li')), 2)
+        self.assertEqual(len(second.html.select('.recorded-objects li')), 1)
+        self.assertIn('Page 2 of 2', second.text)
+
+    def test_deleted_objects(self):
+        record = self.record_with_objects(users=1, scenarios=0)
+        record.recorded_objects.get().object.delete()
+        self.assertIn('deleted', self.get(record).html.select('.recorded-objects li')[0].text)
@@ -1,6 +1,32 @@
 import os
 import unittest
 
+import django
+from django.db import transaction
+from mock import mock
+
+
+MIDDLEWARE_SETTING = 'MIDDLEWARE' if django.VERSION >= (1, 10) else 'MIDDLEWARE_CLASSES'
+
+CSRF_MIDDLEWARE = {MIDDLEWARE_SETTING: {'append': 'django.middleware.csrf.CsrfViewMiddleware'}}
+
+
+def login(client, user):
+    """Log `client` in as `user` (Client.force_login requires Django 1.9+)."""
+    user.set_password('password')
+    user.save()
+    assert client.login(username=user.get_username(), password='password')
+
 
 def requires_celery(func):
     return unittest.skipUnless(os.getenv("TEST_CELERY"), "Requires Celery")(func)
+
+
+def on_commit_immediately():
+    """
+    Call the callbacks passed to transaction.on_commit right away, since a TestCase's transaction
+    never commits.
+    """
+    return mock.patch.object(
+        transaction, 'on_commit', side_effect=lambda callback: callback(), create=True
+    )